@@ -0,0 +1,219 @@
+from doltpy.core import Dolt
+from doltpy.core.dolt import ServerConfig
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Mapping
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+from open_elections.dolt.sql import read_sql_cli
+from open_elections.tools.logging_helper import get_logger, configure_logging, paused_logging
+from open_elections.tools.scheduling import CostModel, LOAD_STATE_STAGE
+
+logger = get_logger(__name__)
+
+StateLoader = Callable[[Dolt, str], None]
+
+LOAD_REMOTE = 'parallel-load'
+BRANCH_PREFIX = 'load'
+DEFAULT_BASE_PORT = 3320
+
+
+def parallel_branch_load(repo: Dolt,
+                         table: str,
+                         states: List[str],
+                         state_loader: StateLoader,
+                         workers: int = 4,
+                         states_per_branch: int = 1,
+                         base_port: int = DEFAULT_BASE_PORT,
+                         cost_model: CostModel = None) -> pd.DataFrame:
+    """
+    Loads states in parallel, each batch of states_per_branch states on its own branch of its own clone of repo, then
+    merges the branches back into the checked out branch of repo as a single commit. The table must already exist on
+    the checked out branch, so that the branches agree on its schema, and state must lead its primary key, so that
+    branches touch disjoint rows and the merges cannot conflict.
+
+    The clones are made from, and pushed back to, a file:// remote in a scratch directory, so nothing leaves the host.
+    Since doltpy writes through a SQL server, each clone gets its own server on base_port + i.
+    :param repo:
+    :param table:
+    :param states:
+    :param state_loader: a module level function, so it can be pickled, that loads one state into the repo it is given
+    :param workers:
+    :param states_per_branch:
+    :param base_port:
+    :param cost_model: if given, states are batched and started by how long they took to load before, see
+    batch_states, and how long each takes this time is recorded in it
+    :return: a DataFrame of per-state row counts before and after the load
+    """
+    assert table in [dolt_table.name for dolt_table in repo.ls()], \
+        'Table {} must exist before loading branches in parallel'.format(table)
+    active_branch, _ = repo.branch()
+    scratch_dir = tempfile.mkdtemp(prefix='open_elections_parallel_load_')
+    remote_url = 'file://{}'.format(os.path.join(scratch_dir, 'remote'))
+    state_batches = batch_states(states, states_per_branch, cost_model)
+    branches = ['{}-{}'.format(BRANCH_PREFIX, '-'.join(batch)) for batch in state_batches]
+
+    before = count_rows_by_state(repo, table)
+    try:
+        repo.execute(['remote', 'add', LOAD_REMOTE, remote_url])
+        repo.push(LOAD_REMOTE, active_branch.name)
+
+        logger.info('Loading {} states on {} branches with {} workers'.format(len(states), len(branches), workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure_logging) as executor:
+            # Submitting forks the workers
+            with paused_logging():
+                futures = [executor.submit(_load_branch,
+                                           remote_url,
+                                           active_branch.name,
+                                           os.path.join(scratch_dir, branch),
+                                           branch,
+                                           table,
+                                           batch,
+                                           state_loader,
+                                           base_port + i)
+                           for i, (branch, batch) in enumerate(zip(branches, state_batches))]
+            load_times = {}
+            for future in futures:
+                load_times.update(future.result())
+
+        if cost_model is not None:
+            for state, seconds in load_times.items():
+                cost_model.record(LOAD_STATE_STAGE, state.lower(), seconds)
+            cost_model.save()
+
+        repo.fetch(LOAD_REMOTE)
+        stats = merge_branches(repo, table, active_branch.name, branches, before, states)
+    finally:
+        repo.execute(['remote', 'remove', LOAD_REMOTE], print_output=False)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return stats
+
+
+def batch_states(states: List[str], states_per_branch: int, cost_model: CostModel = None) -> List[List[str]]:
+    """
+    Splits states into batches of at most states_per_branch, to be loaded on a branch each. Without a cost model, the
+    batches take the states in the order given. With one, states are taken from the longest to the quickest to load,
+    each going to the batch with room that has the least work so far, and the batches are returned longest first, so
+    that no worker is left starting a big state at the end. States that have never been timed count as the longest.
+    :param states:
+    :param states_per_branch:
+    :param cost_model:
+    :return:
+    """
+    if cost_model is None:
+        return [states[i:i + states_per_branch] for i in range(0, len(states), states_per_branch)]
+
+    estimates = {state: cost_model.estimate(LOAD_STATE_STAGE, state.lower()) for state in states}
+    # Ties, such as between states never timed, keep the order given
+    ordered = sorted(states, key=lambda state: (estimates[state] is None, estimates[state] or 0), reverse=True)
+    longest = max((estimate for estimate in estimates.values() if estimate is not None), default=1.0)
+
+    batch_count = -(-len(states) // states_per_branch)
+    batches, totals = [[] for _ in range(batch_count)], [0.0] * batch_count
+    for state in ordered:
+        i = min((i for i in range(batch_count) if len(batches[i]) < states_per_branch), key=lambda i: totals[i])
+        batches[i].append(state)
+        totals[i] += longest if estimates[state] is None else estimates[state]
+
+    return [batch for _, batch in sorted(zip(totals, batches), key=lambda pair: pair[0], reverse=True)]
+
+
+def merge_branches(repo: Dolt,
+                   table: str,
+                   target_branch: str,
+                   branches: List[str],
+                   before: pd.DataFrame,
+                   states: List[str]) -> pd.DataFrame:
+    """
+    Merges the fetched load branches into an integration branch one after another, then squash merges that into
+    target_branch, so target_branch gets one commit whose message lists the per-state row changes.
+    :param repo:
+    :param table:
+    :param target_branch:
+    :param branches:
+    :param before: per-state row counts on target_branch before the load
+    :param states: the states that were loaded
+    :return:
+    """
+    integration_branch = '{}-integration-{}'.format(BRANCH_PREFIX, int(time.time()))
+    repo.checkout(integration_branch, checkout_branch=True)
+    for branch in branches:
+        logger.info('Merging branch {} into {}'.format(branch, integration_branch))
+        repo.execute(['merge', 'remotes/{}/{}'.format(LOAD_REMOTE, branch)])
+        if not repo.status().is_clean:
+            repo.add(table)
+            repo.commit('Merge {}'.format(branch))
+
+    stats = _row_change_stats(before, count_rows_by_state(repo, table))
+    stats = stats[stats['state'].str.upper().isin([state.upper() for state in states])]
+    repo.checkout(target_branch)
+    repo.execute(['merge', '--squash', integration_branch])
+    repo.add(table)
+    repo.commit(_commit_message(table, stats))
+    repo.execute(['branch', '--delete', '--force', integration_branch], print_output=False)
+    return stats
+
+
+def count_rows_by_state(repo: Dolt, table: str) -> pd.DataFrame:
+    counts = read_sql_cli(repo, 'SELECT `state`, COUNT(*) AS `row_count` FROM `{}` GROUP BY `state`'.format(table))
+    return counts if not counts.empty else pd.DataFrame(columns=['state', 'row_count'])
+
+
+def _load_branch(remote_url: str,
+                 start_branch: str,
+                 clone_dir: str,
+                 branch: str,
+                 table: str,
+                 states: List[str],
+                 state_loader: StateLoader,
+                 port: int) -> Mapping[str, float]:
+    os.makedirs(clone_dir)
+    Dolt.clone(remote_url, clone_dir, branch=start_branch)
+    clone = Dolt(clone_dir, server_config=ServerConfig(port=port))
+    clone.checkout(branch, checkout_branch=True)
+
+    clone.sql_server()
+    load_times = {}
+    try:
+        _wait_for_server(clone)
+        for state in states:
+            logger.info('Loading state {} on branch {}'.format(state, branch))
+            start = time.monotonic()
+            state_loader(clone, state)
+            load_times[state] = time.monotonic() - start
+    finally:
+        clone.sql_server_stop()
+
+    clone.add(table)
+    clone.commit('Load {} for {}'.format(table, ', '.join(states)))
+    clone.push('origin', branch)
+    return load_times
+
+
+def _wait_for_server(repo: Dolt, timeout: float = 30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with repo.engine.connect():
+                return
+        except Exception:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def _row_change_stats(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    stats = before.merge(after, on='state', how='outer', suffixes=('_before', '_after')).fillna(0)
+    stats = stats.assign(row_count_before=stats['row_count_before'].astype(int),
+                         row_count_after=stats['row_count_after'].astype(int))
+    return stats.assign(row_change=stats['row_count_after'] - stats['row_count_before']).sort_values('state')
+
+
+def _commit_message(table: str, stats: pd.DataFrame) -> str:
+    lines = ['Parallel load of {} for {} states'.format(table, len(stats)), '']
+    for record in stats.to_dict('records'):
+        lines.append('{state}: {row_count_before} -> {row_count_after} rows ({row_change:+d})'.format(**record))
+    return '\n'.join(lines)
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import pandas as pd
+from typing import List, Optional, Iterator, Iterable
+from open_elections.tools.reading import VoteFile, VoteFileReader
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.open_elections', 'journals')
+
+FILE_ENTRY = 'file'
+BATCH_ENTRY = 'batch'
+COMPLETE_ENTRY = 'complete'
+
+
+class LoadJournal:
+    """
+    An append only journal of the progress of loading one state into one Dolt table, used to resume a load that failed
+    partway through. It records:
+        - if cache_parsed is set, each parsed file, along with its FileSource fingerprint, and a pickled copy of each
+          parsed chunk of it so that a resumed load does not have to parse it again. The copies take as much disk as
+          the state's parsed data, so they are only kept by loads that ask for them, and are deleted once the load
+          completes
+        - each batch of rows written to Dolt, along with a hash of its contents
+
+    A resumed load rebuilds exactly the same batches, in the same order, and skips those already recorded. Since the
+    import is an upsert, writing the remaining batches leaves the table as an uninterrupted load would have.
+    Entries are flushed and fsynced as they are written, so a journal survives the process being killed.
+    """
+    def __init__(self,
+                 journal_dir: str,
+                 repo_dir: str,
+                 table: str,
+                 state: str,
+                 resume: bool = False,
+                 vote_file_reader: VoteFileReader = None,
+                 cache_parsed: bool = False):
+        repo_hash = hashlib.sha1(os.path.abspath(repo_dir).encode('utf-8')).hexdigest()[:10]
+        self.path = os.path.join(journal_dir, '{}__{}__{}.jsonl'.format(state, table, repo_hash))
+        self.cache_dir = os.path.join(journal_dir, '{}__{}__{}.parsed'.format(state, table, repo_hash))
+        self._files = {}
+        self._batches = {}
+        self.vote_file_reader = vote_file_reader or VoteFile.enriched_dfs
+        self.cache_parsed = cache_parsed
+
+        if resume and os.path.exists(self.path):
+            self._read()
+            logger.info('Resuming from journal {}: {} files parsed and {} batches written'.format(
+                self.path, len(self._files), len(self._batches)
+            ))
+        else:
+            self.reset()
+
+    def _read(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write, everything before it is intact
+                    logger.warning('Ignoring corrupt journal entry in {}'.format(self.path))
+                    continue
+                if entry['type'] == FILE_ENTRY:
+                    self._files[entry['filepath']] = entry['fingerprint']
+                elif entry['type'] == BATCH_ENTRY:
+                    self._batches[entry['index']] = entry['fingerprint']
+
+    def reset(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        if self.cache_parsed:
+            os.makedirs(self.cache_dir)
+        open(self.path, 'w').close()
+        self._files, self._batches = {}, {}
+
+    def _append(self, entry: dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_vote_file(self, vote_file: VoteFile) -> Optional[Iterator[pd.DataFrame]]:
+        """
+        A VoteFileReader that yields the cached chunks of files parsed by an earlier attempt, provided they have not
+        changed since, and otherwise parses the file with vote_file_reader and records it, each chunk being cached as
+        it is passed on. Without cache_parsed it only parses the file.
+        :param vote_file:
+        :return:
+        """
+        if not self.cache_parsed:
+            return self.vote_file_reader(vote_file)
+        fingerprint = vote_file.state_metadata.source.fingerprint(vote_file.filepath)
+        cache_path = self._cache_path(vote_file.filepath)
+        if self._files.get(vote_file.filepath) == fingerprint and os.path.exists(cache_path):
+            logger.debug('Using parsed copy of %s from journal', vote_file.filepath)
+            return _load_chunks(cache_path)
+
+        result = self.vote_file_reader(vote_file)
+        if result is None:
+            return None
+        chunks = [result] if isinstance(result, pd.DataFrame) else result
+        return self._record_file(vote_file.filepath, fingerprint, chunks)
+
+    def _record_file(self, filepath: str, fingerprint: str, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        # The file is only recorded once every chunk of it has been cached. The journal being resumed may be of a load
+        # that did not cache, so it may have no cache directory
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._cache_path(filepath), 'wb') as f:
+            for chunk in chunks:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                yield chunk
+        self._append(dict(type=FILE_ENTRY, filepath=filepath, fingerprint=fingerprint))
+        self._files[filepath] = fingerprint
+
+    def is_batch_written(self, index: int, fingerprint: str) -> bool:
+        return self._batches.get(index) == fingerprint
+
+    def record_batch(self, index: int, fingerprint: str, rows: int):
+        self._append(dict(type=BATCH_ENTRY, index=index, fingerprint=fingerprint, rows=rows))
+        self._batches[index] = fingerprint
+
+    def mark_complete(self):
+        self._append(dict(type=COMPLETE_ENTRY))
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def mark_failed(self):
+        """
+        Keeps the parsed copies of a failed load for it to be resumed from if it cached them, and otherwise makes sure
+        none are left behind.
+        """
+        if self.cache_parsed:
+            logger.info('Parsed files are kept in {} for the load to resume from with --resume'.format(self.cache_dir))
+        else:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _cache_path(self, filepath: str) -> str:
+        return os.path.join(self.cache_dir, '{}.pkl'.format(hashlib.sha1(filepath.encode('utf-8')).hexdigest()))
+
+
+def _load_chunks(path: str) -> Iterator[pd.DataFrame]:
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            yield chunk
+
+
+def batch_fingerprint(batch: pd.DataFrame) -> str:
+    fingerprint = hashlib.sha1(repr(list(batch.columns)).encode('utf-8'))
+    fingerprint.update(pd.util.hash_pandas_object(batch.astype(str), index=False).values.tobytes())
+    return fingerprint.hexdigest()
+
+
+def split_batches(table_data: pd.DataFrame, batch_size: int) -> List[pd.DataFrame]:
+    return [table_data.iloc[i:i + batch_size] for i in range(0, len(table_data), batch_size)]
+
+
+def get_journal(journal_dir: Optional[str],
+                repo_dir: str,
+                table: str,
+                state: str,
+                resume: bool,
+                vote_file_reader: VoteFileReader = None,
+                cache_parsed: bool = False) -> LoadJournal:
+    """
+    The journal for a load, which caches the files it parses if asked to, and always when resuming, so that a resumed
+    load that fails again can be resumed without parsing them a third time.
+    """
+    return LoadJournal(journal_dir or DEFAULT_JOURNAL_DIR,
+                       repo_dir,
+                       table,
+                       state,
+                       resume,
+                       vote_file_reader,
+                       cache_parsed or resume)
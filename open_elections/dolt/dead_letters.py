@@ -0,0 +1,113 @@
+import json
+import os
+import time
+import pandas as pd
+from typing import Callable, Optional
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_DEAD_LETTER_DIR = os.path.join(os.path.expanduser('~'), '.open_elections', 'dead_letters')
+# A load that rejects more rows than this is failing for some reason other than bad rows, the server being down, say
+MAX_DEAD_LETTERS = 1000
+# The DB-API errors, as both mysql.connector and SQLAlchemy name them, for a lost or refused connection or a server that
+# cannot run the statement right now, which no row of a batch is to blame for
+CONNECTION_ERRORS = ['OperationalError', 'InterfaceError']
+
+
+class TooManyDeadLetters(Exception):
+    def __init__(self, count: int, cause: Exception):
+        super().__init__('Rejected more than {} rows, the last with: {}'.format(count, cause))
+        self.cause = cause
+
+
+class DeadLetterFile:
+    """
+    An append only JSON lines file of the rows a load could not write, each with the error writing it alone raised
+    and the source file it came from, so they can be fixed at the source and reloaded. The index labels of the rows
+    written to it this run are kept in rejected.
+    """
+    def __init__(self, path: str, table: str, max_rows: int = MAX_DEAD_LETTERS):
+        self.path = path
+        self.table = table
+        self.max_rows = max_rows
+        self.count = 0
+        self.rejected = []
+
+    def write(self, row: pd.Series, error: Exception, filepath: Optional[str] = None):
+        self.count += 1
+        self.rejected.append(row.name)
+        if self.count > self.max_rows:
+            raise TooManyDeadLetters(self.max_rows, error)
+        logger.error('Rejected row from {} writing to {}: {}'.format(filepath, self.table, _describe(error)))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(dict(table=self.table,
+                                    filepath=filepath,
+                                    error=_describe(error),
+                                    row={col: _json_value(value) for col, value in row.items()},
+                                    time=time.time()),
+                               default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def get_dead_letter_file(dead_letter_dir: Optional[str],
+                         table: str,
+                         state: str,
+                         max_rows: int = MAX_DEAD_LETTERS) -> DeadLetterFile:
+    path = os.path.join(dead_letter_dir or DEFAULT_DEAD_LETTER_DIR, '{}__{}.jsonl'.format(state, table))
+    return DeadLetterFile(path, table, max_rows)
+
+
+def write_isolating_errors(write: Callable[[pd.DataFrame], None],
+                           batch: pd.DataFrame,
+                           dead_letters: DeadLetterFile,
+                           filepaths: pd.Series = None) -> int:
+    """
+    Writes batch with write, and if that fails, bisects the batch and writes each half the same way, until the rows
+    that fail on their own are found. Those go to dead_letters, and everything else is written. write must either
+    write all the rows it is given or none of them, or be an upsert, so that retrying a half is safe.
+
+    Connection errors are raised straight away, since retrying halves of the batch against a server that is down would
+    only dead letter every row. Dolt reports most failed statements with the generic SQLSTATE HY000, which drivers
+    raise as a plain DatabaseError rather than a DataError, so every other error is taken to be caused by the data.
+
+    A batch of n rows with one bad row costs about 2 log2(n) extra writes, of n / 2, n / 4, ... rows.
+    :param write:
+    :param batch:
+    :param dead_letters:
+    :param filepaths: the source file of each row of batch, aligned on its index
+    :return: the number of rows written
+    """
+    try:
+        write(batch)
+        return len(batch)
+    except Exception as e:
+        if is_connection_error(e):
+            raise
+        if len(batch) == 1:
+            dead_letters.write(batch.iloc[0], e, filepaths.loc[batch.index[0]] if filepaths is not None else None)
+            return 0
+        logger.warning('Writing {} rows to {} failed, bisecting to isolate the bad rows: {}'.format(
+            len(batch), dead_letters.table, _describe(e)
+        ))
+
+    middle = len(batch) // 2
+    return (write_isolating_errors(write, batch.iloc[:middle], dead_letters, filepaths) +
+            write_isolating_errors(write, batch.iloc[middle:], dead_letters, filepaths))
+
+
+def is_connection_error(error: Exception) -> bool:
+    return isinstance(error, OSError) or any(cls.__name__ in CONNECTION_ERRORS for cls in type(error).__mro__)
+
+
+def _describe(error: Exception) -> str:
+    # Database errors can carry the whole failed statement, keep the first line
+    return '{}: {}'.format(type(error).__name__, str(error).split('\n')[0][:500])
+
+
+def _json_value(value):
+    if value is None or (not isinstance(value, str) and pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, 'item') else value
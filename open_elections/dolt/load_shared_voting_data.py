@@ -1,14 +1,29 @@
-from open_elections.tools.reading import PrecinctFile, StateMetadata, get_coerce_to_integer
+from open_elections.tools.reading import PrecinctFile, CountyFile, VoteFile, StateMetadata, get_coerce_to_integer, \
+    files_to_table_data, apply_row_cleaners
 from open_elections.tools.config import build_state_metadata
-from open_elections.validation.integrity_report_tools import check_post_clean, check_pre_clean
-from open_elections.tools.logging_helper import get_logger
-from open_elections.dolt.tools import load_to_dolt
+from open_elections.validation.integrity_report_tools import check_post_clean, check_pre_clean, \
+    write_pre_clean_report, write_post_clean_report
+from open_elections.validation.report_writer import IntegrityReportWriter
+from open_elections.validation.reconciliation import check_reconciliation
+from open_elections.tools.logging_helper import get_logger, configure_logging
+from open_elections.tools.sources import FileSource, build_file_source
+from open_elections.tools.store import VotingDataStore
+from open_elections.tools.quarantine import FileWatchdog, QuarantineLedger, DEFAULT_LEDGER_PATH, DEFAULT_TIMEOUT, \
+    DEFAULT_MAX_MEMORY
+from open_elections.tools.scheduling import CostModel, WorkScheduler, DEFAULT_COST_MODEL_PATH
+from open_elections.dolt.tools import load_to_dolt, FILEPATH_COLUMN
+from open_elections.dolt.branching import parallel_branch_load
+from open_elections.dolt.schema import TableSchema, Index, ensure_table, ensure_table_cli
+from open_elections.dolt.star_schema import StarSchema, Dimension, DIMENSION_ID_TYPE, ensure_star_schema_cli
+from open_elections.dolt.sql_server_sink import DoltSqlServerSink, DEFAULT_WRITERS, DEFAULT_UPSERT_BATCH_SIZE
+from open_elections.dolt.dead_letters import MAX_DEAD_LETTERS
 from doltpy.core import Dolt
 import os
-from typing import List, Union, Any
+from typing import List, Mapping, Union, Any, Type, Tuple
 import pandas as pd
 from datetime import datetime
 import argparse
+import functools
 import re
 
 
@@ -29,6 +44,58 @@ VOTING_DATA_PKS = [
     'candidate',
 ]
 
+VOTING_DATA_TABLE = 'national_voting_data'
+
+# Values too long for their column are rejected to the dead letter file, rather than truncated
+VOTING_DATA_COLUMNS = [
+    ('state', 'CHAR(2)'),
+    ('year', 'SMALLINT'),
+    ('date', 'DATETIME'),
+    ('election', 'VARCHAR(64)'),
+    ('special', 'BOOLEAN'),
+    ('office', 'VARCHAR(256)'),
+    ('district', 'VARCHAR(128)'),
+    ('county', 'VARCHAR(128)'),
+    ('precinct', 'VARCHAR(256)'),
+    ('party', 'VARCHAR(128)'),
+    ('candidate', 'VARCHAR(256)'),
+    ('votes', 'INT'),
+]
+
+# Secondary indexes for the common lookups, which the primary key cannot serve since it leads with the election
+VOTING_DATA_INDEXES = {
+    'county': Index('county_idx', ['state', 'county']),
+    'candidate': Index('candidate_idx', ['candidate']),
+    'office': Index('office_idx', ['office', 'district']),
+    'party': Index('party_idx', ['party']),
+}
+DEFAULT_VOTING_DATA_INDEXES = ['county', 'candidate', 'office']
+
+# Normalized, national_voting_data is a view of a fact table of precinct votes, keyed by the ids of the election,
+# office, county and candidate, which dimension tables hold the text of
+PRECINCT_VOTES_TABLE = 'precinct_votes'
+VOTING_DATA_TYPES = dict(VOTING_DATA_COLUMNS)
+ELECTIONS = Dimension('elections', 'election_id', [(col, VOTING_DATA_TYPES[col])
+                                                   for col in ['state', 'year', 'date', 'election', 'special']])
+OFFICES = Dimension('offices', 'office_id', [('office', VOTING_DATA_TYPES['office'])])
+COUNTIES = Dimension('counties', 'county_id', [(col, VOTING_DATA_TYPES[col]) for col in ['state', 'county']])
+CANDIDATES = Dimension('candidates', 'candidate_id', [(col, VOTING_DATA_TYPES[col]) for col in ['party', 'candidate']])
+VOTING_DATA_DIMENSIONS = [ELECTIONS, OFFICES, COUNTIES, CANDIDATES]
+PRECINCT_VOTES_COLUMNS = [
+    ('election_id', DIMENSION_ID_TYPE),
+    ('office_id', DIMENSION_ID_TYPE),
+    ('district', VOTING_DATA_TYPES['district']),
+    ('county_id', DIMENSION_ID_TYPE),
+    ('precinct', VOTING_DATA_TYPES['precinct']),
+    ('candidate_id', DIMENSION_ID_TYPE),
+    ('votes', VOTING_DATA_TYPES['votes']),
+]
+PRECINCT_VOTES_INDEXES = {
+    'county': Index('county_idx', ['county_id']),
+    'candidate': Index('candidate_idx', ['candidate_id']),
+    'office': Index('office_idx', ['office_id', 'district']),
+}
+
 DEFAULT_PK_VALUE = 'NA'
 
 STATE_DATA_FORMAT_MEMBER = 'national_precinct_dataformat'
@@ -39,16 +106,33 @@ def filepath_to_precinct_file(year: int,
                               file_name: str,
                               state_metadata: StateMetadata,
                               excluded: bool) -> Union[None, PrecinctFile]:
+    return _filepath_to_vote_file(year, path, file_name, state_metadata, excluded, PrecinctFile, ('precinct', 'ward'))
+
+
+def filepath_to_county_file(year: int,
+                            path: str,
+                            file_name: str,
+                            state_metadata: StateMetadata,
+                            excluded: bool) -> Union[None, CountyFile]:
+    return _filepath_to_vote_file(year, path, file_name, state_metadata, excluded, CountyFile, ('county',))
+
+
+def _filepath_to_vote_file(year: int,
+                           path: str,
+                           file_name: str,
+                           state_metadata: StateMetadata,
+                           excluded: bool,
+                           vote_file_class: Type[VoteFile],
+                           level_markers: Tuple[str, ...]) -> Union[None, VoteFile]:
     split = file_name.split('.')[0].split('__')
 
     special = 'special' in split
     if special:
         split.remove('special')
 
-    if 'precinct' not in split and 'ward' not in split:
-        logger.warning(
-            'Passed non-precinct file to precinct vote file builder, ignoring: '.format(os.path.join(path, file_name))
-        )
+    if not any(marker in split for marker in level_markers):
+        logger.debug('Passed file without any of %s in its name to %s builder, ignoring: %s',
+                     level_markers, vote_file_class.__name__, os.path.join(path, file_name))
         return None
 
     # Deals with the case of files formatted like:
@@ -60,45 +144,35 @@ def filepath_to_precinct_file(year: int,
         if 'democrat' in split:
             split.remove('democrat')
 
-    state = split[PrecinctFile.STATE_POS]
-    date_str = split[PrecinctFile.DATE_POS]
-    election = split[PrecinctFile.ELECTION_POS]
+    state = split[VoteFile.STATE_POS]
+    date_str = split[VoteFile.DATE_POS]
+    election = split[VoteFile.ELECTION_POS]
 
     assert state.lower() == state_metadata.state.lower(), 'Extracted state and state_metadata.state must be the same'
-    
+
     if date_str.startswith('_'):
         date = datetime.strptime(date_str.lstrip('_'), '%Y%m%d')
     else:
         date = datetime.strptime(date_str, '%Y%m%d')
 
-    return PrecinctFile(os.path.join(path, file_name), state_metadata, year, date, election, special, excluded)
+    return vote_file_class(os.path.join(path, file_name), state_metadata, year, date, election, special, excluded)
 
 
 # TODO
 #   we actually just want to run a series of row cleaners that exist per state
-def extract_precinct_voting_data(raw_precinct_data: pd.DataFrame, state_metadata: StateMetadata) -> List[dict]:
+def extract_precinct_voting_data(raw_precinct_data: pd.DataFrame, state_metadata: StateMetadata) -> pd.DataFrame:
     clean_precincts = raw_precinct_data.assign(precinct=raw_precinct_data['precinct'].apply(coerce_to_string),
                                                district=raw_precinct_data['district'].apply(coerce_to_string))
-    not_null_pk = ensure_pks_non_null(clean_precincts[VOTING_DATA_PKS + ['votes']])
+    # The file each row came from is kept for load_to_dolt to report bad rows against, it is not written
+    provenance = [FILEPATH_COLUMN] if FILEPATH_COLUMN in clean_precincts.columns else []
+    not_null_pk = ensure_pks_non_null(clean_precincts[VOTING_DATA_PKS + ['votes'] + provenance])
     deduplicated = not_null_pk.drop_duplicates(subset=VOTING_DATA_PKS)
-    logger.warning(
-        'There are {} records in the raw precinct data, and {} after de-duplicating'.format(
-            len(not_null_pk),
-            len(deduplicated)
-        )
-    )
+    if len(deduplicated) < len(not_null_pk):
+        logger.warning('There are %d records in the raw precinct data, and %d after de-duplicating',
+                       len(not_null_pk), len(deduplicated))
 
-    dicts = deduplicated.to_dict('records')
-
-    result = []
     # We want to run coerce_votes_numeric last since it throws an exception on invalid data.
-    for dic in dicts:
-        for row_cleaner in state_metadata.row_cleaners:
-            row_cleaner(dic)
-
-        result.append(dic)
-
-    return result
+    return apply_row_cleaners(deduplicated, state_metadata.row_cleaners, state_metadata.vote_columns)
 
 
 def coerce_votes_numeric(dic: dict):
@@ -138,7 +212,11 @@ def clean_vote_col_names(precinct_df: pd.DataFrame) -> pd.DataFrame:
     return precinct_df.rename(columns={'vote': 'votes'}) if 'vote' in precinct_df.columns else precinct_df
 
 
-def pre_clean_integrity_report(state_or_states: Union[str, List[str]]):
+def pre_clean_integrity_report(state_or_states: Union[str, List[str]], report_path: str = None):
+    """
+    Returns the file parse failures and invalid values found before cleaning, or if report_path is given streams them
+    to a report there and returns its per file summary.
+    """
     if type(state_or_states) == list:
         states = state_or_states
     else:
@@ -147,50 +225,271 @@ def pre_clean_integrity_report(state_or_states: Union[str, List[str]]):
     state_metadata_list = [build_metadata_helper(state) for state in states]
 
     logger.info('Building state metadata')
+    if report_path:
+        return write_pre_clean_report(state_metadata_list,
+                                      filepath_to_precinct_file,
+                                      IntegrityReportWriter(report_path))
     return check_pre_clean(state_metadata_list, filepath_to_precinct_file)
 
 
-def post_clean_integrity_report(state_or_states: Union[str, List[str]]):
+def post_clean_integrity_report(state_or_states: Union[str, List[str]], report_path: str = None):
+    """
+    Returns the invalid values left after cleaning, or if report_path is given streams them to a report there and
+    returns its per file summary.
+    """
     if type(state_or_states) == list:
         states = state_or_states
     else:
         states = [state_or_states]
 
     state_metadata_list = [build_metadata_helper(state) for state in states]
+    if report_path:
+        return write_post_clean_report(state_metadata_list,
+                                       filepath_to_precinct_file,
+                                       extract_precinct_voting_data,
+                                       IntegrityReportWriter(report_path))
     return check_post_clean(state_metadata_list, filepath_to_precinct_file, extract_precinct_voting_data)
 
 
-def build_metadata_helper(state: str) -> StateMetadata:
+def reconciliation_report(state_or_states: Union[str, List[str]], tolerance: int = 0, relative_tolerance: float = 0.0):
+    if type(state_or_states) == list:
+        states = state_or_states
+    else:
+        states = [state_or_states]
+
+    state_metadata_list = [build_metadata_helper(state) for state in states]
+    return check_reconciliation(state_metadata_list,
+                                filepath_to_precinct_file,
+                                filepath_to_county_file,
+                                tolerance,
+                                relative_tolerance)
+
+
+def build_voting_data_store(state_or_states: Union[str, List[str]], path: str) -> VotingDataStore:
+    if type(state_or_states) == list:
+        states = state_or_states
+    else:
+        states = [state_or_states]
+
+    table_data = [files_to_table_data(build_metadata_helper(state),
+                                      filepath_to_precinct_file,
+                                      extract_precinct_voting_data,
+                                      pks=VOTING_DATA_PKS)
+                  for state in states]
+    return VotingDataStore.build(path, pd.concat(table_data, ignore_index=True).drop(columns=[FILEPATH_COLUMN],
+                                                                                    errors='ignore'))
+
+
+def build_metadata_helper(state: str,
+                          source: Union[str, FileSource] = None,
+                          canonicalize_names: bool = False) -> StateMetadata:
     return build_state_metadata(state,
                                 STATE_DATA_FORMAT_MEMBER,
                                 False,
                                 columns=VOTING_DATA_PKS + ['votes'],
                                 vote_columns=['votes'],
                                 df_transformers=[clean_vote_col_names, ensure_pks_non_null],
-                                row_cleaners=[coerce_votes_numeric])
+                                row_cleaners=[coerce_votes_numeric],
+                                source=source,
+                                canonicalize_names=canonicalize_names)
+
+
+def voting_data_schema(indexes: List[str] = None, hashed_key: bool = False) -> TableSchema:
+    """
+    The schema of national_voting_data, with the named secondary indexes from VOTING_DATA_INDEXES, by default
+    DEFAULT_VOTING_DATA_INDEXES, and optionally a hashed key in place of the 11 column natural key.
+    """
+    return TableSchema(VOTING_DATA_TABLE,
+                       VOTING_DATA_COLUMNS,
+                       VOTING_DATA_PKS,
+                       _pick_indexes(VOTING_DATA_INDEXES, indexes),
+                       hashed_key)
+
+
+def voting_data_star_schema(indexes: List[str] = None) -> StarSchema:
+    """
+    national_voting_data normalized into precinct_votes and its dimension tables, with the named secondary indexes on
+    precinct_votes from PRECINCT_VOTES_INDEXES, by default DEFAULT_VOTING_DATA_INDEXES.
+    """
+    precinct_votes = TableSchema(PRECINCT_VOTES_TABLE,
+                                 PRECINCT_VOTES_COLUMNS,
+                                 [col for col, _ in PRECINCT_VOTES_COLUMNS if col != 'votes'],
+                                 _pick_indexes(PRECINCT_VOTES_INDEXES, indexes))
+    return StarSchema(VOTING_DATA_TABLE,
+                      [col for col, _ in VOTING_DATA_COLUMNS],
+                      precinct_votes,
+                      VOTING_DATA_DIMENSIONS)
+
+
+def _pick_indexes(available: Mapping[str, Index], names: List[str] = None) -> List[Index]:
+    names = DEFAULT_VOTING_DATA_INDEXES if names is None else names
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError('Unknown indexes {}, choose from {}'.format(unknown, sorted(available)))
+    return [available[name] for name in names]
+
+
+def load_state(repo: Dolt, state: str, canonicalize_names: bool = False, **load_kwargs):
+    """
+    Loads a single state's precinct data into national_voting_data, used as the per-branch loader in parallel loads.
+    """
+    load_to_dolt(repo,
+                 VOTING_DATA_TABLE,
+                 VOTING_DATA_PKS,
+                 build_metadata_helper(state, canonicalize_names=canonicalize_names),
+                 filepath_to_precinct_file,
+                 extract_precinct_voting_data,
+                 **load_kwargs)
 
 
 def main():
+    configure_logging()
     parser = argparse.ArgumentParser()
-    parser.add_argument('--state', type=str, help='State to load data for', required=True)
+    parser.add_argument('--state', type=str, help='State to load data for, or with --parallel-branches a comma '
+                                                  'separated list of states', required=True)
     parser.add_argument('--load-data', )
     parser.add_argument('--dolt-dir', type=str, help='Dolt repo directory')
     parser.add_argument('--start-dolt-server', action='store_true')
+    parser.add_argument('--source', type=str, help='State repo to read from: a directory, git repo or .zip bundle')
+    parser.add_argument('--commit', type=str, help='Read the state repo given by --source at this git commit')
+    parser.add_argument('--rollups', action='store_true', help='Maintain county, state and election rollup tables')
+    parser.add_argument('--resume', action='store_true', help='Resume a failed load of this state from its journal')
+    parser.add_argument('--journal-dir', type=str, help='Directory for load journals')
+    parser.add_argument('--cache-parsed-files',
+                        action='store_true',
+                        help='Keep a copy of each parsed file with the journal, so that a --resume of a failed load '
+                             'does not parse them again, loads run with --resume always do')
+    parser.add_argument('--sql-server-sink', action='store_true', help='Upsert through the running Dolt sql-server')
+    parser.add_argument('--writers', type=int, default=DEFAULT_WRITERS, help='Concurrent sql-server writers')
+    parser.add_argument('--upsert-batch-size', type=int, default=DEFAULT_UPSERT_BATCH_SIZE)
+    parser.add_argument('--parallel-branches', type=int, help='Load each state on its own branch using this many '
+                                                              'worker processes, then merge the branches')
+    parser.add_argument('--states-per-branch', type=int, default=1)
+    parser.add_argument('--canonicalize-names', action='store_true',
+                        help='Canonicalize spellings of candidate, party, office and county names before loading')
+    parser.add_argument('--watchdog', action='store_true', help='Parse each file under time and memory limits, '
+                                                                'quarantining and skipping files that exceed them')
+    parser.add_argument('--file-timeout', type=float, default=DEFAULT_TIMEOUT, help='Seconds allowed to parse a file')
+    parser.add_argument('--file-max-memory', type=int, default=DEFAULT_MAX_MEMORY // 1024 ** 2,
+                        help='Megabytes parsing a file may allocate')
+    parser.add_argument('--quarantine-ledger', type=str, default=DEFAULT_LEDGER_PATH)
+    parser.add_argument('--verify', action='store_true', help='Check the loaded partitions against the source data')
+    parser.add_argument('--dead-letter-dir', type=str, help='Directory for rows that could not be written')
+    parser.add_argument('--max-dead-letters', type=int, default=MAX_DEAD_LETTERS,
+                        help='Fail the load once more than this many rows could not be written')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parse files in this many processes, those expected to take longest first')
+    parser.add_argument('--cost-model', type=str,
+                        help='Where the time taken on each file and state is recorded, to plan the next run, by '
+                             'default {} when loading with more than one worker or branch'.format(
+                                 DEFAULT_COST_MODEL_PATH))
+    parser.add_argument('--indexes', type=str, default=','.join(DEFAULT_VOTING_DATA_INDEXES),
+                        help='Comma separated secondary indexes to keep on national_voting_data, from {}, or an empty '
+                             'string for none'.format(', '.join(sorted(VOTING_DATA_INDEXES))))
+    parser.add_argument('--hashed-key', action='store_true',
+                        help='Key national_voting_data on a 64 bit hash of its 11 key columns, which an existing '
+                             'table is only migrated to with --migrate-schema')
+    parser.add_argument('--migrate-schema', action='store_true',
+                        help='Rebuild an existing national_voting_data whose columns or primary key differ from its '
+                             'schema, copying its rows into the schema\'s narrower types, rather than stopping')
+    parser.add_argument('--normalized', action='store_true',
+                        help='Write precinct votes with integer ids for their election, office, county and candidate, '
+                             'held in dimension tables, and make national_voting_data a view joining them')
     args = parser.parse_args()
+    if args.parallel_branches:
+        # Branch loads read the checked out state repos and write through their own servers, and rollup tables built on
+        # each branch would conflict when merged, rollups are brought up to date by a later serial load instead
+        unsupported = [flag for flag, value in [('--source', args.source),
+                                                ('--commit', args.commit),
+                                                ('--sql-server-sink', args.sql_server_sink),
+                                                ('--resume', args.resume),
+                                                ('--rollups', args.rollups)] if value]
+        if unsupported:
+            parser.error('{} cannot be used with --parallel-branches'.format(', '.join(unsupported)))
+    if args.normalized and args.parallel_branches:
+        parser.error('--normalized assigns dimension ids in sequence, so branches loaded in parallel would collide')
+    if args.normalized and args.hashed_key:
+        parser.error('--normalized keys precinct votes on their dimension ids, a hashed key does not apply')
+
+    watchdog = None
+    if args.watchdog:
+        watchdog = FileWatchdog(QuarantineLedger(args.quarantine_ledger),
+                                timeout=args.file_timeout,
+                                max_memory=args.file_max_memory * 1024 ** 2)
+    # A serial load has nothing to plan, so it only records costs when asked to
+    cost_model, scheduler = None, None
+    if args.workers > 1 or args.parallel_branches or args.cost_model:
+        cost_model = CostModel(args.cost_model or DEFAULT_COST_MODEL_PATH)
+        scheduler = WorkScheduler(args.workers, cost_model)
+    indexes = [name for name in args.indexes.split(',') if name]
+    schema, star_schema = None, None
+    if args.normalized:
+        star_schema = voting_data_star_schema(indexes)
+    else:
+        schema = voting_data_schema(indexes, args.hashed_key)
 
     repo = Dolt(args.dolt_dir)
+    if args.parallel_branches:
+        # Branches are cloned from the last commit, so they must see the table as migrated
+        if ensure_table_cli(repo, schema, args.migrate_schema):
+            repo.add(VOTING_DATA_TABLE)
+            repo.commit('Migrate {} to its schema'.format(VOTING_DATA_TABLE))
+        stats = parallel_branch_load(repo,
+                                     VOTING_DATA_TABLE,
+                                     args.state.split(','),
+                                     functools.partial(load_state,
+                                                       canonicalize_names=args.canonicalize_names,
+                                                       watchdog=watchdog,
+                                                       verify=args.verify,
+                                                       dead_letter_dir=args.dead_letter_dir,
+                                                       max_dead_letters=args.max_dead_letters,
+                                                       scheduler=scheduler,
+                                                       schema=schema),
+                                     workers=args.parallel_branches,
+                                     states_per_branch=args.states_per_branch,
+                                     cost_model=cost_model)
+        logger.info('Row changes by state:\n{}'.format(stats.to_string(index=False)))
+        return
+
+    if not args.sql_server_sink:
+        if star_schema:
+            ensure_star_schema_cli(repo, star_schema, args.migrate_schema)
+        else:
+            ensure_table_cli(repo, schema, args.migrate_schema)
+
     if args.start_dolt_server:
         logger.info('start-dolt-server detected, starting server sub process')
         repo.sql_server(loglevel='trace')
 
-    state_metadata = build_metadata_helper(args.state)
+    sink = None
+    if args.sql_server_sink:
+        sink = DoltSqlServerSink.for_repo(repo, writers=args.writers, batch_size=args.upsert_batch_size)
+        if star_schema:
+            star_schema.ensure(sink.query, sink.execute, args.migrate_schema)
+        else:
+            ensure_table(schema, sink.query, sink.execute, args.migrate_schema)
+
+    source = build_file_source(args.source, args.commit) if args.source else None
+    state_metadata = build_metadata_helper(args.state, source, args.canonicalize_names)
 
     load_to_dolt(repo,
-                 'national_voting_data',
+                 VOTING_DATA_TABLE,
                  VOTING_DATA_PKS,
                  state_metadata,
                  filepath_to_precinct_file,
-                 extract_precinct_voting_data)
+                 extract_precinct_voting_data,
+                 maintain_rollups=args.rollups,
+                 resume=args.resume,
+                 journal_dir=args.journal_dir,
+                 cache_parsed=args.cache_parsed_files,
+                 sink=sink,
+                 watchdog=watchdog,
+                 verify=args.verify,
+                 dead_letter_dir=args.dead_letter_dir,
+                 max_dead_letters=args.max_dead_letters,
+                 scheduler=scheduler,
+                 schema=schema,
+                 star_schema=star_schema)
 
 
 if __name__ == '__main__':
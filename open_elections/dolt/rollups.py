@@ -0,0 +1,127 @@
+from doltpy.core import Dolt
+from doltpy.core.write import import_df
+from open_elections.dolt.sql import match_any_predicate, table_exists, get_import_mode, read_sql_cli
+from open_elections.tools.logging_helper import get_logger
+from typing import List, Union
+import pandas as pd
+
+logger = get_logger(__name__)
+
+# A partition is the set of precinct rows produced by a single election in a single state. Rollups are only ever
+# recomputed for whole partitions, and only when the precinct rows in that partition have changed.
+PARTITION_COLUMNS = ['state', 'year', 'date', 'election', 'special']
+
+ROLLUP_PARTITIONS_TABLE = 'rollup_partitions'
+
+
+class Rollup:
+    """
+    Describes a table of vote totals derived from the precinct level national_voting_data table by summing votes over
+    the precincts within each group. The group_by columns are the primary key of the rollup table.
+    """
+    def __init__(self, table: str, group_by: List[str]):
+        assert all(col in group_by for col in PARTITION_COLUMNS), 'Rollups must be grouped by the partition columns'
+        self.table = table
+        self.group_by = group_by
+
+    def compute(self, voting_data: pd.DataFrame) -> pd.DataFrame:
+        votes = pd.to_numeric(voting_data['votes'], errors='coerce')
+        # Precinct names are only unique within a county
+        precinct_key = voting_data['county'].astype(str) + '|' + voting_data['precinct'].astype(str)
+        grouped = voting_data.assign(votes=votes, precinct_key=precinct_key).groupby(self.group_by,
+                                                                                     dropna=False,
+                                                                                     sort=False)
+        result = grouped.agg(votes=('votes', 'sum'), precincts=('precinct_key', 'nunique')).reset_index()
+        return result.assign(votes=result['votes'].astype('int64'))
+
+
+COUNTY_ROLLUP = Rollup('county_voting_totals',
+                       PARTITION_COLUMNS + ['office', 'district', 'county', 'party', 'candidate'])
+STATE_ROLLUP = Rollup('state_voting_totals',
+                      PARTITION_COLUMNS + ['office', 'district', 'party', 'candidate'])
+ELECTION_ROLLUP = Rollup('election_voting_totals', PARTITION_COLUMNS)
+
+ROLLUPS = [COUNTY_ROLLUP, STATE_ROLLUP, ELECTION_ROLLUP]
+
+
+def partition_hashes(voting_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes a content hash for each partition that does not depend on row order, by hashing rows and summing the hashes
+    modulo 2^64. Two loads of the same precinct data give the same hashes, so unchanged partitions can be skipped.
+    :param voting_data:
+    :return:
+    """
+    columns = sorted(voting_data.columns)
+    row_hashes = pd.util.hash_pandas_object(voting_data[columns].astype(str), index=False)
+    hashes = (voting_data[PARTITION_COLUMNS]
+              .assign(row_hash=row_hashes.values)
+              .groupby(PARTITION_COLUMNS, dropna=False, sort=False)
+              .agg(row_hash=('row_hash', 'sum'), row_count=('row_hash', 'size'))
+              .reset_index())
+    return hashes.assign(row_hash=hashes['row_hash'].map('{:016x}'.format))
+
+
+def get_changed_partitions(repo: Dolt, hashes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares freshly computed partition hashes against those recorded by the last rollup update, returning the rows of
+    hashes for partitions that are new or whose content has changed.
+    :param repo:
+    :param hashes:
+    :return:
+    """
+    if not table_exists(repo, ROLLUP_PARTITIONS_TABLE):
+        return hashes
+
+    query = 'SELECT * FROM {} WHERE {}'.format(ROLLUP_PARTITIONS_TABLE, _partitions_predicate(hashes))
+    # Read as text, a hex hash of only digits would otherwise come back as a number
+    existing = read_sql_cli(repo, query, dtype={'row_hash': str})
+    if existing.empty:
+        return hashes
+
+    existing = existing.assign(year=existing['year'].astype(int),
+                               date=pd.to_datetime(existing['date']),
+                               special=existing['special'].astype(str).isin(['1', 'true', 'True']))
+    merged = hashes.merge(existing[PARTITION_COLUMNS + ['row_hash']],
+                          on=PARTITION_COLUMNS,
+                          how='left',
+                          suffixes=('', '_existing'))
+    changed = merged['row_hash'] != merged['row_hash_existing']
+    return merged.loc[changed, hashes.columns]
+
+
+def update_rollups(repo: Dolt, voting_data: Union[pd.DataFrame, List[dict]], rollups: List[Rollup] = None):
+    """
+    Brings the rollup tables up to date with freshly cleaned precinct data. Only partitions whose precinct rows changed
+    since the last update are recomputed: their old rollup rows are deleted and replaced with the new totals, so groups
+    that have disappeared from the source (a renamed candidate, say) do not linger.
+    :param repo:
+    :param voting_data:
+    :param rollups:
+    :return:
+    """
+    rollups = rollups or ROLLUPS
+    voting_data = voting_data if isinstance(voting_data, pd.DataFrame) else pd.DataFrame(voting_data)
+    if voting_data.empty:
+        return
+
+    hashes = partition_hashes(voting_data)
+    changed = get_changed_partitions(repo, hashes)
+    logger.info('{} of {} partitions changed, updating rollups'.format(len(changed), len(hashes)))
+    if changed.empty:
+        return
+
+    changed_data = voting_data.merge(changed[PARTITION_COLUMNS], on=PARTITION_COLUMNS, how='inner')
+    predicate = _partitions_predicate(changed)
+    for rollup in rollups:
+        rollup_df = rollup.compute(changed_data)
+        if table_exists(repo, rollup.table):
+            repo.sql(query='DELETE FROM {} WHERE {}'.format(rollup.table, predicate))
+        logger.info('Writing {} rows to rollup table {}'.format(len(rollup_df), rollup.table))
+        import_df(repo, rollup.table, rollup_df, rollup.group_by, get_import_mode(repo, rollup.table))
+
+    partitions_import_mode = get_import_mode(repo, ROLLUP_PARTITIONS_TABLE)
+    import_df(repo, ROLLUP_PARTITIONS_TABLE, changed, PARTITION_COLUMNS, partitions_import_mode)
+
+
+def _partitions_predicate(partitions: pd.DataFrame) -> str:
+    return match_any_predicate(PARTITION_COLUMNS, partitions[PARTITION_COLUMNS].to_dict('records'))
@@ -0,0 +1,239 @@
+from doltpy.core import Dolt
+from typing import Callable, List, Mapping, Tuple
+import functools
+import re
+import pandas as pd
+from open_elections.dolt.sql import read_sql_cli
+from open_elections.dolt.verification import row_hashes, row_hash_sql
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+# Runs a query and returns its result, or executes a statement, against the database holding the table
+QueryRunner = Callable[[str], pd.DataFrame]
+StatementRunner = Callable[[str], None]
+
+# The hashed key is the first 16 hex digits of the MD5 of the natural key, serialized as verification serializes rows
+ROW_KEY_COLUMN = 'row_key'
+ROW_KEY_TYPE = 'BIGINT UNSIGNED'
+ROW_KEY_DIGITS = 16
+
+MIGRATION_SUFFIX = '__migrating'
+
+
+class Index:
+    """
+    A secondary index on a table, over columns in the order given.
+    """
+    def __init__(self, name: str, columns: List[str]):
+        self.name = name
+        self.columns = columns
+
+    def create_statement(self, table: str) -> str:
+        return 'CREATE INDEX `{}` ON `{}` ({})'.format(self.name, table, _column_list(self.columns))
+
+
+class TableSchema:
+    """
+    An explicit schema for a table the loader writes, which it creates and migrates the table to rather than letting
+    the types be inferred from the first rows written. The primary key is either the natural key, or a hashed key:
+    a single unsigned 64 bit column derived from the natural key columns, which stay in the table as plain columns.
+    A hashed key keeps the primary index, and with it every secondary index, which holds a copy of the primary key,
+    narrow when the natural key spans many wide strings. Two natural keys hashing to the same value would overwrite one
+    another, the odds of which are about n^2 / 2^65 for n rows, under one in a thousand for a hundred million rows, and
+    would show up in verify_table as a partition short of a row.
+    """
+    def __init__(self,
+                 table: str,
+                 columns: List[Tuple[str, str]],
+                 natural_key: List[str],
+                 indexes: List[Index] = None,
+                 hashed_key: bool = False):
+        self.table = table
+        self.natural_key = natural_key
+        self.indexes = indexes or []
+        self.hashed_key = hashed_key
+        self.columns = [(ROW_KEY_COLUMN, ROW_KEY_TYPE)] + columns if hashed_key else columns
+
+    @property
+    def primary_key(self) -> List[str]:
+        return [ROW_KEY_COLUMN] if self.hashed_key else self.natural_key
+
+    def create_statements(self, table: str = None) -> List[str]:
+        """
+        The statements that create the table, with its indexes, as table if given.
+        """
+        table = table or self.table
+        definitions = ['`{}` {}'.format(col, sql_type) for col, sql_type in self.columns]
+        definitions.append('PRIMARY KEY ({})'.format(_column_list(self.primary_key)))
+        create = 'CREATE TABLE `{}` (\n    {}\n)'.format(table, ',\n    '.join(definitions))
+        return [create] + [index.create_statement(table) for index in self.indexes]
+
+    def add_key(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the hashed key column to rows about to be written, if the schema has one.
+        """
+        if not self.hashed_key or data.empty:
+            return data
+        return data.assign(**{ROW_KEY_COLUMN: row_hashes(data, self.natural_key, ROW_KEY_DIGITS)})
+
+
+def plan_migration(schema: TableSchema,
+                   columns: pd.DataFrame,
+                   indexes: pd.DataFrame,
+                   migrate: bool = False) -> List[str]:
+    """
+    Returns the statements that bring the table described by columns and indexes, as describe_table returns them, to
+    schema. A missing table is created. A table whose columns, column types or primary key differ is rebuilt, if
+    migrate is set: a new table is created alongside it, the rows copied over, computing the hashed key from the
+    natural key when one is being introduced, and the new table renamed over the old one. Otherwise only the secondary
+    indexes that differ are dropped and created.
+    :param schema:
+    :param columns: the name and type of each column of the table, empty if it does not exist
+    :param indexes: the name and column of each column of each index of the table, in order
+    :param migrate: whether a table that differs from schema may be rebuilt, rather than raising a ValueError
+    :return:
+    """
+    if columns.empty:
+        return schema.create_statements()
+
+    current_types = dict(zip(columns['name'], columns['type'].map(_normalize_type)))
+    current_indexes = {name: list(group['column']) for name, group in indexes.groupby('name', sort=False)}
+    if _needs_rebuild(schema, current_types, current_indexes):
+        if not migrate:
+            raise ValueError('{} differs from its schema in its columns or primary key, rebuilding it to the schema '
+                             'must be asked for with --migrate-schema'.format(schema.table))
+        logger.info('Rebuilding {}, its columns or primary key differ from the schema'.format(schema.table))
+        return _rebuild_statements(schema, current_types)
+
+    statements = []
+    wanted_indexes = {index.name: index for index in schema.indexes}
+    for name, index_columns in current_indexes.items():
+        if name != 'PRIMARY' and (name not in wanted_indexes or wanted_indexes[name].columns != index_columns):
+            statements.append('DROP INDEX `{}` ON `{}`'.format(name, schema.table))
+    for index in schema.indexes:
+        if current_indexes.get(index.name) != index.columns:
+            statements.append(index.create_statement(schema.table))
+    return statements
+
+
+def describe_table(query: QueryRunner, table: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Returns the columns and indexes of table, in the form plan_migration takes them.
+    """
+    columns = query('SELECT `COLUMN_NAME` AS `name`, `COLUMN_TYPE` AS `type` FROM `information_schema`.`columns` '
+                    "WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = '{}' "
+                    'ORDER BY `ORDINAL_POSITION`'.format(table))
+    indexes = query('SELECT `INDEX_NAME` AS `name`, `COLUMN_NAME` AS `column` FROM `information_schema`.`statistics` '
+                    "WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = '{}' "
+                    'ORDER BY `INDEX_NAME`, `SEQ_IN_INDEX`'.format(table))
+    columns = columns if not columns.empty else pd.DataFrame(columns=['name', 'type'])
+    indexes = indexes if not indexes.empty else pd.DataFrame(columns=['name', 'column'])
+    return columns, indexes
+
+
+def ensure_table(schema: TableSchema, query: QueryRunner, execute: StatementRunner, migrate: bool = False) -> List[str]:
+    """
+    Creates the table for schema, or migrates it to schema, returning the statements executed. A table whose columns
+    or primary key differ is only rebuilt if migrate is set, and only if its values fit the columns of schema.
+    :param schema:
+    :param query: runs a query against the database holding the table, such as read_sql_cli for a Dolt repo
+    :param execute: executes a statement against it
+    :param migrate: whether a table that differs from schema may be rebuilt
+    :return:
+    """
+    columns, indexes = describe_table(query, schema.table)
+    statements = plan_migration(schema, columns, indexes, migrate)
+    if statements and statements[0] == 'DROP TABLE IF EXISTS `{}{}`'.format(schema.table, MIGRATION_SUFFIX):
+        _check_values_fit(schema, query, columns)
+    for statement in statements:
+        logger.info('Migrating {}: {}'.format(schema.table, statement.split('\n')[0]))
+        try:
+            execute(statement)
+        except Exception:
+            if statement.startswith('INSERT INTO `{}{}`'.format(schema.table, MIGRATION_SUFFIX)):
+                execute('DROP TABLE IF EXISTS `{}{}`'.format(schema.table, MIGRATION_SUFFIX))
+            raise
+    return statements
+
+
+def ensure_table_cli(repo: Dolt, schema: TableSchema, migrate: bool = False) -> List[str]:
+    """
+    As ensure_table, through the dolt CLI, for when no SQL server is running against repo.
+    """
+    return ensure_table(schema,
+                        functools.partial(read_sql_cli, repo),
+                        lambda statement: repo.sql(query=statement),
+                        migrate)
+
+
+def _needs_rebuild(schema: TableSchema,
+                   current_types: Mapping[str, str],
+                   current_indexes: Mapping[str, List[str]]) -> bool:
+    wanted_types = {col: _normalize_type(sql_type) for col, sql_type in schema.columns}
+    return current_indexes.get('PRIMARY') != schema.primary_key or current_types != wanted_types
+
+
+def _check_values_fit(schema: TableSchema, query: QueryRunner, columns: pd.DataFrame):
+    # Copying a value into a narrower text column would fail part way through the copy, or truncate the value,
+    # depending on the server's SQL mode, so the longest value of each column that narrows is checked first
+    current_types = dict(zip(columns['name'], columns['type'].map(_normalize_type)))
+    lengths = {}
+    for col, sql_type in schema.columns:
+        match = re.match(r'^(var)?char\((\d+)\)$', _normalize_type(sql_type))
+        if match and col in current_types and current_types[col] != _normalize_type(sql_type):
+            lengths[col] = int(match.group(2))
+    if not lengths:
+        return
+
+    longest = query('SELECT {} FROM `{}`'.format(', '.join('MAX(CHAR_LENGTH(`{0}`)) AS `{0}`'.format(col)
+                                                           for col in lengths),
+                                                 schema.table))
+    too_long = ['{} has values of up to {} characters, where the schema allows {}'.format(col,
+                                                                                          int(longest[col].iloc[0]),
+                                                                                          length)
+                for col, length in lengths.items()
+                if not longest.empty and pd.notna(longest[col].iloc[0]) and int(longest[col].iloc[0]) > length]
+    if too_long:
+        raise ValueError('Cannot migrate {}, its values would not fit the schema: {}'.format(schema.table,
+                                                                                            '; '.join(too_long)))
+
+
+def _rebuild_statements(schema: TableSchema, current_types: Mapping[str, str]) -> List[str]:
+    new_table = '{}{}'.format(schema.table, MIGRATION_SUFFIX)
+    missing = [col for col in schema.natural_key if col not in current_types]
+    assert not missing, 'Cannot migrate {}, it lacks the key columns {}'.format(schema.table, missing)
+
+    selects = []
+    for col, _ in schema.columns:
+        if col == ROW_KEY_COLUMN and col not in current_types:
+            selects.append(row_hash_sql(schema.natural_key, ROW_KEY_DIGITS))
+        elif col in current_types:
+            selects.append('`{}`'.format(col))
+        else:
+            selects.append('NULL')
+
+    create, create_indexes = schema.create_statements(new_table)[0], schema.create_statements()[1:]
+    copy = 'INSERT INTO `{}` ({}) SELECT {} FROM `{}`'.format(new_table,
+                                                              _column_list([col for col, _ in schema.columns]),
+                                                              ', '.join(selects),
+                                                              schema.table)
+    # Indexes are built once the rows are in, rather than maintained row by row as they are copied
+    return ['DROP TABLE IF EXISTS `{}`'.format(new_table),
+            create,
+            copy,
+            'DROP TABLE `{}`'.format(schema.table),
+            'RENAME TABLE `{}` TO `{}`'.format(new_table, schema.table)] + create_indexes
+
+
+def _normalize_type(sql_type: str) -> str:
+    # Servers report types as they store them: BOOLEAN as tinyint(1), integers with or without a display width, and
+    # DATETIME with its fractional seconds precision
+    normalized = sql_type.lower().replace('not null', '').strip()
+    normalized = re.sub(r'^bool(ean)?$', 'tinyint', normalized)
+    normalized = re.sub(r'^integer', 'int', normalized)
+    return re.sub(r'^(tinyint|smallint|mediumint|int|bigint|datetime|timestamp)\(\d+\)', r'\1', normalized)
+
+
+def _column_list(columns: List[str]) -> str:
+    return ', '.join('`{}`'.format(col) for col in columns)
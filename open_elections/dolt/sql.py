@@ -0,0 +1,56 @@
+from doltpy.core import Dolt
+from datetime import datetime
+from typing import Any, List, Mapping
+import io
+import pandas as pd
+
+def sql_literal(value: Any) -> str:
+    """
+    Renders a Python value as a SQL literal for the handful of types that appear in voting data.
+    :param value:
+    :return:
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return 'NULL'
+    elif pd.api.types.is_bool(value):
+        return 'TRUE' if value else 'FALSE'
+    elif isinstance(value, (datetime, pd.Timestamp)):
+        return "'{}'".format(value.strftime('%Y-%m-%d %H:%M:%S'))
+    elif isinstance(value, str):
+        return "'{}'".format(value.replace('\\', '\\\\').replace("'", "''"))
+    else:
+        return str(value)
+
+
+def match_any_predicate(columns: List[str], records: List[dict]) -> str:
+    """
+    Builds a WHERE clause matching rows whose values for columns equal those of any one of records.
+    :param columns:
+    :param records:
+    :return:
+    """
+    clauses = []
+    for record in records:
+        clauses.append('({})'.format(' AND '.join('`{}` = {}'.format(col, sql_literal(record[col]))
+                                                  for col in columns)))
+    return ' OR '.join(clauses)
+
+
+def table_exists(repo: Dolt, table: str) -> bool:
+    return table in [dolt_table.name for dolt_table in repo.ls()]
+
+
+def get_import_mode(repo: Dolt, table: str) -> str:
+    return 'update' if table_exists(repo, table) else 'create'
+
+
+def read_sql_cli(repo: Dolt, query: str, dtype: Mapping[str, Any] = None) -> pd.DataFrame:
+    """
+    Runs query through the dolt CLI rather than the SQL server, for when no server is running against repo.
+    :param repo:
+    :param query:
+    :param dtype: types to read columns of the result as, rather than those inferred from the CSV the CLI returns
+    :return:
+    """
+    output = repo.execute(['sql', '--query', query, '--result-format', 'csv'], print_output=False)
+    return pd.read_csv(io.StringIO('\n'.join(output)), dtype=dtype) if any(output) else pd.DataFrame()
@@ -0,0 +1,211 @@
+from doltpy.core import Dolt
+from mysql.connector.pooling import MySQLConnectionPool
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Mapping, Any, Tuple, Union
+import socket
+import subprocess
+import time
+import pandas as pd
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 3306
+DEFAULT_WRITERS = 4
+DEFAULT_UPSERT_BATCH_SIZE = 5000
+DEFAULT_PARTITION_COLUMNS = ['state', 'year']
+
+
+class DoltSqlServerSink:
+    """
+    Writes rows to a table in a running Dolt sql-server using multi-row INSERT ... ON DUPLICATE KEY UPDATE statements.
+    Rows are split into partitions on partition_columns, which must be a prefix of the primary key so that partitions
+    never share a row, and the partitions are written concurrently by writers threads, each holding a connection from
+    a shared pool. Each upsert batch is committed on its own.
+    """
+    def __init__(self,
+                 database: str,
+                 host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT,
+                 user: str = 'root',
+                 password: str = '',
+                 writers: int = DEFAULT_WRITERS,
+                 batch_size: int = DEFAULT_UPSERT_BATCH_SIZE,
+                 partition_columns: List[str] = None):
+        self.database = database
+        self.writers = writers
+        self.batch_size = batch_size
+        self.partition_columns = partition_columns or DEFAULT_PARTITION_COLUMNS
+        self._pool = MySQLConnectionPool(pool_name='open_elections_{}'.format(database),
+                                         pool_size=writers,
+                                         host=host,
+                                         port=port,
+                                         user=user,
+                                         password=password,
+                                         database=database)
+
+    @classmethod
+    def for_repo(cls, repo: Dolt, **kwargs) -> 'DoltSqlServerSink':
+        """
+        Builds a sink for the database served for repo, using the host and port of its server config.
+        """
+        return cls(repo.repo_name, host=repo.server_config.host, port=repo.server_config.port, **kwargs)
+
+    def execute(self, statement: str):
+        conn = self._pool.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(statement)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def query(self, statement: str) -> pd.DataFrame:
+        conn = self._pool.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(statement)
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        return pd.DataFrame(rows, columns=columns)
+
+    def write(self,
+              table: str,
+              rows: Union[pd.DataFrame, List[Mapping[str, Any]]],
+              pks: List[str]) -> Mapping[str, float]:
+        """
+        Upserts rows to table, returning the number of rows written, the elapsed time, and the sustained rows/sec.
+        :param table:
+        :param rows: a DataFrame, or a list of dicts
+        :param pks:
+        :return:
+        """
+        assert pks[:len(self.partition_columns)] == self.partition_columns, \
+            'Partition columns {} must be a prefix of the primary key {}'.format(self.partition_columns, pks)
+        rows = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if rows.empty:
+            return dict(rows=0, seconds=0.0, rows_per_second=0.0)
+
+        columns = list(rows.columns)
+        partitions = [partition for _, partition in rows.groupby(self.partition_columns, dropna=False, sort=False)]
+
+        logger.info('Writing {} rows to {} in {} partitions with {} writers'.format(
+            len(rows), table, len(partitions), self.writers
+        ))
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.writers) as executor:
+            futures = [executor.submit(self._write_partition, table, columns, pks, partition_rows)
+                       for partition_rows in partitions]
+            written = sum(future.result() for future in futures)
+
+        seconds = time.time() - start
+        stats = dict(rows=written, seconds=seconds, rows_per_second=written / seconds if seconds else float(written))
+        logger.info('Wrote {rows} rows to {table} in {seconds:.1f}s, {rows_per_second:.0f} rows/sec'.format(
+            table=table, **stats
+        ))
+        return stats
+
+    def _write_partition(self, table: str, columns: List[str], pks: List[str], rows: pd.DataFrame) -> int:
+        conn = self._pool.get_connection()
+        try:
+            cursor = conn.cursor()
+            for i in range(0, len(rows), self.batch_size):
+                batch = rows.iloc[i:i + self.batch_size]
+                statement, params = build_upsert(table, columns, pks, batch)
+                cursor.execute(statement, params)
+                conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        return len(rows)
+
+
+def build_upsert(table: str,
+                 columns: List[str],
+                 pks: List[str],
+                 rows: Union[pd.DataFrame, List[Mapping[str, Any]]]) -> Tuple[str, List[Any]]:
+    """
+    Builds a single multi-row INSERT ... ON DUPLICATE KEY UPDATE statement for rows, with a parameter list to go with
+    it. Columns that are not part of the primary key are overwritten with the new values on conflict.
+    :param table:
+    :param columns:
+    :param pks:
+    :param rows: a DataFrame, or a list of dicts
+    :return:
+    """
+    row_placeholder = '({})'.format(', '.join(['%s'] * len(columns)))
+    updates = ['`{col}` = VALUES(`{col}`)'.format(col=col) for col in columns if col not in pks]
+    statement = 'INSERT INTO `{}` ({}) VALUES {}'.format(table,
+                                                          ', '.join('`{}`'.format(col) for col in columns),
+                                                          ', '.join([row_placeholder] * len(rows)))
+    if updates:
+        statement += ' ON DUPLICATE KEY UPDATE {}'.format(', '.join(updates))
+    else:
+        # Every column is part of the key, so there is nothing to update, but we still do not want to fail
+        statement += ' ON DUPLICATE KEY UPDATE `{col}` = `{col}`'.format(col=pks[0])
+
+    if isinstance(rows, pd.DataFrame):
+        params = [_to_sql_param(value) for row in rows[columns].itertuples(index=False, name=None) for value in row]
+    else:
+        params = [_to_sql_param(row[col]) for row in rows for col in columns]
+    return statement, params
+
+
+def _to_sql_param(value: Any) -> Any:
+    if value is None:
+        return None
+    elif isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    elif isinstance(value, datetime):
+        return value
+    elif hasattr(value, 'item'):
+        # numpy scalars, which the MySQL connector cannot convert
+        value = value.item()
+    if isinstance(value, float) and pd.isna(value):
+        return None
+    return value
+
+
+class LocalSqlServer:
+    """
+    Spawns `dolt sql-server` for a local Dolt repo and waits for it to accept connections, for tests and benchmarks.
+    Use as a context manager, the server is killed on exit.
+    """
+    def __init__(self, repo_dir: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: float = 30):
+        self.repo_dir = repo_dir
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._proc = None
+
+    def __enter__(self) -> 'LocalSqlServer':
+        self._proc = subprocess.Popen(['dolt', 'sql-server', '--host', self.host, '--port', str(self.port)],
+                                      cwd=self.repo_dir,
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return self
+            except OSError:
+                if self._proc.poll() is not None:
+                    raise RuntimeError('dolt sql-server exited with code {}'.format(self._proc.returncode))
+                time.sleep(0.2)
+
+        self._proc.kill()
+        raise TimeoutError('dolt sql-server did not start listening on {}:{}'.format(self.host, self.port))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._proc.terminate()
+        self._proc.wait()
@@ -0,0 +1,131 @@
+from doltpy.core import Dolt
+from typing import List, Tuple
+import functools
+import pandas as pd
+from open_elections.dolt.sql import read_sql_cli
+from open_elections.dolt.schema import TableSchema, QueryRunner, StatementRunner, ensure_table
+from open_elections.dolt.verification import row_hashes, row_hash_sql
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+DIMENSION_ID_TYPE = 'INT UNSIGNED'
+
+
+class Dimension:
+    """
+    A table of the distinct combinations of values of some columns of a flat table, such as the party and candidate of
+    each precinct row, each with an integer id that a fact table holds in their place. Ids are assigned from one more
+    than the largest in the table the first time a combination is loaded, and never change after, so loading more data
+    only ever adds rows to a dimension.
+    """
+    def __init__(self, table: str, id_column: str, columns: List[Tuple[str, str]]):
+        self.table = table
+        self.id_column = id_column
+        self.value_columns = [col for col, _ in columns]
+        self.schema = TableSchema(table, [(id_column, DIMENSION_ID_TYPE)] + columns, [id_column])
+
+    def assign_ids(self, data: pd.DataFrame, query: QueryRunner) -> Tuple[pd.Series, pd.DataFrame]:
+        """
+        Looks up the id of the values of each row of data in the dimension table, assigning ids to values it does not
+        hold yet, in the sort order of the values so that loading the same data always assigns the same ids.
+        :param data:
+        :param query: runs a query against the database holding the dimension table
+        :return: the id of each row of data, aligned on its index, and the rows to add to the dimension table
+        """
+        # Values are matched on their row hash, which is computed the same way from both the pipeline's values and the
+        # table's, whatever types each side reads them as
+        existing = query('SELECT `{}` AS `id`, {} AS `row_hash` FROM `{}`'.format(self.id_column,
+                                                                                  row_hash_sql(self.value_columns),
+                                                                                  self.table))
+        known = {int(row_hash): int(dimension_id) for dimension_id, row_hash in zip(existing.get('id', []),
+                                                                                     existing.get('row_hash', []))}
+
+        values = data[self.value_columns].drop_duplicates().sort_values(self.value_columns).reset_index(drop=True)
+        hashes = [int(row_hash) for row_hash in row_hashes(values, self.value_columns)]
+        is_new = [row_hash not in known for row_hash in hashes]
+        next_id = max(known.values(), default=0) + 1
+        ids = []
+        for row_hash, new in zip(hashes, is_new):
+            if new:
+                known[row_hash] = next_id
+                next_id += 1
+            ids.append(known[row_hash])
+
+        values.insert(0, self.id_column, ids)
+        new_rows = values.loc[is_new].reset_index(drop=True)
+        logger.info('{} distinct values of {} in the data, {} of them new'.format(len(values), self.table,
+                                                                                  len(new_rows)))
+        row_ids = data[self.value_columns].merge(values, on=self.value_columns, how='left')[self.id_column]
+        return pd.Series(row_ids.values, index=data.index, name=self.id_column), new_rows
+
+
+class StarSchema:
+    """
+    Stores a flat table as a fact table and the dimension tables its ids refer to, with a view in the flat table's place
+    that joins them back into the flat table's columns, so queries of the flat table keep working. The fact table holds
+    the columns of the flat table no dimension covers, and the id of each dimension, in place of the text repeated on
+    every row of the flat table, which is where its storage and diffs mostly go.
+    """
+    def __init__(self, view: str, view_columns: List[str], fact: TableSchema, dimensions: List[Dimension]):
+        self.view = view
+        self.view_columns = view_columns
+        self.fact = fact
+        self.dimensions = dimensions
+
+    def normalize(self, data: pd.DataFrame, query: QueryRunner) -> Tuple[List[Tuple[Dimension, pd.DataFrame]],
+                                                                          pd.DataFrame]:
+        """
+        Splits rows of the flat table into fact table rows, aligned on the index of data, and the rows each dimension
+        table needs added, which must be written before the facts referring to them.
+        """
+        facts = data
+        new_rows = []
+        for dimension in self.dimensions:
+            ids, dimension_rows = dimension.assign_ids(data, query)
+            facts = facts.assign(**{dimension.id_column: ids})
+            new_rows.append((dimension, dimension_rows))
+        return new_rows, facts[[col for col, _ in self.fact.columns]]
+
+    def view_statement(self) -> str:
+        selects = []
+        for col in self.view_columns:
+            owner = next((dimension.table for dimension in self.dimensions if col in dimension.value_columns),
+                         self.fact.table)
+            selects.append('`{}`.`{}`'.format(owner, col))
+        joins = ['JOIN `{0}` ON `{0}`.`{1}` = `{2}`.`{1}`'.format(dimension.table, dimension.id_column, self.fact.table)
+                 for dimension in self.dimensions]
+        return 'CREATE VIEW `{}` AS SELECT {} FROM `{}` {}'.format(self.view,
+                                                                   ', '.join(selects),
+                                                                   self.fact.table,
+                                                                   ' '.join(joins))
+
+    def ensure(self, query: QueryRunner, execute: StatementRunner, migrate: bool = False) -> List[str]:
+        """
+        Creates or migrates the fact and dimension tables as ensure_table does, and creates the view if it is missing,
+        returning the statements executed. A flat table already in the view's place is not converted.
+        """
+        existing = query('SELECT `TABLE_TYPE` AS `type` FROM `information_schema`.`tables` '
+                         "WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = '{}'".format(self.view))
+        if not existing.empty and existing['type'].iloc[0] != 'VIEW':
+            raise ValueError('{0} is a table, normalized tables can only be loaded where no flat {0} exists'.format(
+                self.view
+            ))
+
+        statements = []
+        for schema in [dimension.schema for dimension in self.dimensions] + [self.fact]:
+            statements.extend(ensure_table(schema, query, execute, migrate))
+        if existing.empty:
+            logger.info('Creating view {} over {}'.format(self.view, self.fact.table))
+            execute(self.view_statement())
+            statements.append(self.view_statement())
+        return statements
+
+
+def ensure_star_schema_cli(repo: Dolt, star_schema: StarSchema, migrate: bool = False) -> List[str]:
+    """
+    As StarSchema.ensure, through the dolt CLI, for when no SQL server is running against repo.
+    """
+    return star_schema.ensure(functools.partial(read_sql_cli, repo),
+                              lambda statement: repo.sql(query=statement),
+                              migrate)
@@ -0,0 +1,29 @@
+import sys
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt.branching import batch_states  # noqa: E402
+from open_elections.dolt import load_shared_voting_data  # noqa: E402
+from open_elections.dolt.load_shared_voting_data import main  # noqa: E402
+from open_elections.tools.scheduling import CostModel, LOAD_STATE_STAGE  # noqa: E402
+
+
+def test_batch_states(tmp_path):
+    states = ['PA', 'NY', 'OH', 'WY', 'VT']
+    assert batch_states(states, 2) == [['PA', 'NY'], ['OH', 'WY'], ['VT']]
+
+    cost_model = CostModel(str(tmp_path / 'costs.json'))
+    for state, seconds in [('pa', 100), ('ny', 90), ('oh', 50), ('wy', 5)]:
+        cost_model.record(LOAD_STATE_STAGE, state, seconds)
+    # VT has never been timed, so is counted as taking as long as the longest, PA
+    assert batch_states(states, 2, cost_model) == [['NY', 'OH'], ['VT', 'WY'], ['PA']]
+
+
+@pytest.mark.parametrize('flag', [['--rollups'], ['--resume'], ['--sql-server-sink'], ['--source', 'pa.zip']])
+def test_parallel_branches_rejects_unsupported_options(monkeypatch, capsys, flag):
+    monkeypatch.setattr(sys, 'argv', ['load', '--state', 'PA,NY', '--parallel-branches', '2'] + flag)
+    # The listener configure_logging starts would outlive the test, writing to the stream pytest captured for it
+    monkeypatch.setattr(load_shared_voting_data, 'configure_logging', lambda: None)
+    with pytest.raises(SystemExit):
+        main()
+    assert '{} cannot be used with --parallel-branches'.format(flag[0]) in capsys.readouterr().err
@@ -0,0 +1,135 @@
+from datetime import datetime
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt import tools  # noqa: E402
+from open_elections.tools.reading import StateMetadata, PrecinctFile  # noqa: E402
+from open_elections.tools.sources import LocalDirectorySource  # noqa: E402
+from open_elections.dolt.schema import TableSchema  # noqa: E402
+from open_elections.dolt.star_schema import StarSchema, Dimension  # noqa: E402
+
+PKS = ['county', 'precinct', 'candidate']
+
+
+class FakeRepo:
+    def __init__(self, repo_dir):
+        self._repo_dir = repo_dir
+        self.rows = {}
+
+    def repo_dir(self):
+        return self._repo_dir
+
+
+def _precinct_file_builder(year, dirpath, filename, state_metadata, excluded):
+    return PrecinctFile(os.path.join(dirpath, filename), state_metadata, year, datetime(2016, 11, 8), 'general',
+                        False, excluded)
+
+
+def _load(repo, state_dir, journal_dir, resume=False, **load_kwargs):
+    state_metadata = StateMetadata(LocalDirectorySource(state_dir), 'pa', [], ['votes'], excluded_files=[])
+    tools.load_to_dolt(repo, 'national_voting_data', PKS, state_metadata, _precinct_file_builder,
+                       lambda raw, state_metadata: raw[PKS + ['votes']], resume=resume, journal_dir=journal_dir,
+                       **load_kwargs)
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True)
+    for county in ('adams', 'berks', 'centre'):
+        rows = ['{},{},Jane Doe,{}'.format(county, precinct, precinct * 10) for precinct in range(5)]
+        (year_dir / '20161108__pa__general__{}__precinct.csv'.format(county)).write_text(
+            'county,precinct,candidate,votes\n' + '\n'.join(rows) + '\n'
+        )
+    return str(tmp_path / 'openelections-data-pa')
+
+
+def test_resumed_load_matches_uninterrupted_load(tmp_path, state_dir, monkeypatch):
+    writes = []
+
+    def import_dict(repo, table, data, pks, import_mode, batch_size):
+        if len(writes) == 2 and not getattr(repo, 'resumed', True):
+            raise KeyboardInterrupt('killed mid-load')
+        writes.append(len(data['votes']))
+        for row in pd.DataFrame(data).to_dict('records'):
+            repo.rows[tuple(row[pk] for pk in pks)] = row
+
+    monkeypatch.setattr(tools, 'import_dict', import_dict)
+    monkeypatch.setattr(tools, 'BATCH_SIZE', 4)
+
+    uninterrupted = FakeRepo(str(tmp_path / 'uninterrupted'))
+    _load(uninterrupted, state_dir, str(tmp_path / 'journals'))
+    assert len(uninterrupted.rows) == 15
+
+    writes.clear()
+    interrupted = FakeRepo(str(tmp_path / 'interrupted'))
+    interrupted.resumed = False
+    with pytest.raises(KeyboardInterrupt):
+        _load(interrupted, state_dir, str(tmp_path / 'journals'), cache_parsed=True)
+    assert len(interrupted.rows) == 8
+    assert len(list((tmp_path / 'journals').glob('*.parsed/*.pkl'))) == 3
+
+    # Only the batches the interrupted load did not write are written again
+    writes.clear()
+    interrupted.resumed = True
+    _load(interrupted, state_dir, str(tmp_path / 'journals'), resume=True)
+    assert writes == [4, 3]
+    assert interrupted.rows == uninterrupted.rows
+
+
+def test_failed_load_leaves_no_parsed_files_unless_asked_to(tmp_path, state_dir, monkeypatch):
+    def import_dict(repo, table, data, pks, import_mode, batch_size):
+        raise KeyboardInterrupt('killed mid-load')
+
+    monkeypatch.setattr(tools, 'import_dict', import_dict)
+    with pytest.raises(KeyboardInterrupt):
+        _load(FakeRepo(str(tmp_path / 'repo')), state_dir, str(tmp_path / 'journals'))
+    assert list((tmp_path / 'journals').glob('*.parsed')) == []
+
+
+def test_rejected_rows_are_not_rolled_up(tmp_path, state_dir, monkeypatch):
+    def import_dict(repo, table, data, pks, import_mode, batch_size):
+        if 40 in data['votes']:
+            raise ValueError('Out of range value for votes')
+        for row in pd.DataFrame(data).to_dict('records'):
+            repo.rows[tuple(row[pk] for pk in pks)] = row
+
+    rolled_up = []
+    monkeypatch.setattr(tools, 'import_dict', import_dict)
+    monkeypatch.setattr(tools, 'update_rollups', lambda repo, table_data: rolled_up.append(table_data))
+
+    repo = FakeRepo(str(tmp_path / 'repo'))
+    _load(repo, state_dir, str(tmp_path / 'journals'), maintain_rollups=True, dead_letter_dir=str(tmp_path / 'dead'))
+    assert len(repo.rows) == 12
+    assert sorted(rolled_up[0]['votes']) == sorted(row['votes'] for row in repo.rows.values())
+
+
+def test_facts_are_rejected_with_their_dimension_rows(tmp_path, state_dir, monkeypatch):
+    tables = {}
+
+    def import_dict(repo, table, data, pks, import_mode, batch_size):
+        if 'berks' in data.get('county', []):
+            raise ValueError('Data too long for column county')
+        tables.setdefault(table, []).extend(pd.DataFrame(data).to_dict('records'))
+
+    monkeypatch.setattr(tools, 'import_dict', import_dict)
+    # There are no dimension rows yet, and no server is running, so the ids are looked up through the CLI
+    monkeypatch.setattr(tools, 'read_sql_cli', lambda repo, query: pd.DataFrame())
+    counties = Dimension('counties', 'county_id', [('county', 'VARCHAR(5)')])
+    fact = TableSchema('precinct_votes', [('county_id', 'INT UNSIGNED'), ('precinct', 'VARCHAR(8)'),
+                                          ('candidate', 'VARCHAR(64)'), ('votes', 'INT')],
+                       ['county_id', 'precinct', 'candidate'])
+    star_schema = StarSchema('national_voting_data', PKS + ['votes'], fact, [counties])
+
+    dead_letter_dir = str(tmp_path / 'dead')
+    _load(FakeRepo(str(tmp_path / 'repo')), state_dir, str(tmp_path / 'journals'), star_schema=star_schema,
+          dead_letter_dir=dead_letter_dir)
+    assert [row['county'] for row in tables['counties']] == ['adams', 'centre']
+    assert len(tables['precinct_votes']) == 10
+    assert {row['county_id'] for row in tables['precinct_votes']} == {1, 3}
+    with open(os.path.join(dead_letter_dir, 'pa__counties.jsonl')) as f:
+        assert len(f.readlines()) == 1
+    with open(os.path.join(dead_letter_dir, 'pa__national_voting_data.jsonl')) as f:
+        assert len(f.readlines()) == 5
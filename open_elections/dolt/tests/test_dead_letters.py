@@ -0,0 +1,47 @@
+import json
+import pandas as pd
+import pytest
+from open_elections.dolt.dead_letters import DeadLetterFile, write_isolating_errors
+
+
+def test_bad_rows_are_isolated(tmp_path):
+    batch = pd.DataFrame(dict(precinct=[str(i) for i in range(100)], votes=list(range(100))), dtype=object)
+    batch.loc[37, 'votes'], batch.loc[80, 'votes'] = 'oops', 'x' * 300
+    filepaths = pd.Series(['file_{}.csv'.format(i // 50) for i in range(100)])
+    written, attempts = [], []
+
+    def write(rows):
+        attempts.append(len(rows))
+        if any(isinstance(votes, str) for votes in rows['votes']):
+            raise ValueError('Invalid value for votes\nINSERT INTO ...')
+        written.extend(rows['precinct'])
+
+    dead_letters = DeadLetterFile(str(tmp_path / 'dead.jsonl'), 'national_voting_data')
+    assert write_isolating_errors(write, batch, dead_letters, filepaths) == 98
+    assert sorted(written, key=int) == [str(i) for i in range(100) if i not in (37, 80)]
+    assert len(attempts) < 30
+
+    with open(dead_letters.path) as f:
+        rejected = [json.loads(line) for line in f]
+    assert [(row['row']['precinct'], row['filepath']) for row in rejected] == [('37', 'file_0.csv'),
+                                                                               ('80', 'file_1.csv')]
+    assert rejected[0]['error'] == 'ValueError: Invalid value for votes'
+    assert dead_letters.rejected == [37, 80]
+
+
+class OperationalError(Exception):
+    pass
+
+
+@pytest.mark.parametrize('error', [OperationalError('Lost connection to MySQL server'), ConnectionRefusedError()])
+def test_connection_errors_are_not_bisected(tmp_path, error):
+    attempts = []
+
+    def write(rows):
+        attempts.append(len(rows))
+        raise error
+
+    dead_letters = DeadLetterFile(str(tmp_path / 'dead.jsonl'), 'national_voting_data')
+    with pytest.raises(type(error)):
+        write_isolating_errors(write, pd.DataFrame(dict(votes=range(10))), dead_letters)
+    assert attempts == [10] and dead_letters.count == 0
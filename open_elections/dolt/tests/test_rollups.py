@@ -0,0 +1,75 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt import rollups  # noqa: E402
+from open_elections.dolt.rollups import (update_rollups, partition_hashes, COUNTY_ROLLUP, ELECTION_ROLLUP,  # noqa: E402
+                                         ROLLUP_PARTITIONS_TABLE)
+
+
+class FakeRepo:
+    """
+    Holds tables as DataFrames, standing in for the Dolt repo the rollup functions write to through the CLI.
+    """
+    def __init__(self):
+        self.tables = {}
+        self.deletes = []
+
+    def sql(self, query):
+        self.deletes.append(query)
+
+
+@pytest.fixture
+def repo(monkeypatch):
+    repo = FakeRepo()
+
+    def import_df(repo, table, data, pks, import_mode):
+        existing = repo.tables.get(table)
+        repo.tables[table] = pd.concat([existing, data], ignore_index=True).drop_duplicates(pks, keep='last')
+
+    def read_sql_cli(repo, query, dtype=None):
+        # As the CLI returns them, as text
+        partitions = repo.tables[ROLLUP_PARTITIONS_TABLE]
+        return partitions.assign(date=partitions['date'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                                 special=partitions['special'].astype(int))
+
+    monkeypatch.setattr(rollups, 'import_df', import_df)
+    monkeypatch.setattr(rollups, 'read_sql_cli', read_sql_cli)
+    monkeypatch.setattr(rollups, 'table_exists', lambda repo, table: table in repo.tables)
+    monkeypatch.setattr(rollups, 'get_import_mode', lambda repo, table: 'update' if table in repo.tables else 'create')
+    return repo
+
+
+def _voting_data(pa_votes=1):
+    return pd.DataFrame([dict(state=state, year=2016, date=datetime(2016, 11, 8), election='general', special=False,
+                              office='President', district='NA', county=county, precinct=str(precinct),
+                              party='DEM', candidate='Clinton', votes=pa_votes if state == 'PA' else 2)
+                         for state in ('PA', 'NY') for county in ('Adams', 'Berks') for precinct in range(3)])
+
+
+def test_partition_hashes_are_order_independent():
+    voting_data = _voting_data()
+    hashes = partition_hashes(voting_data).set_index('state')
+    shuffled = partition_hashes(voting_data.sample(frac=1, random_state=0)).set_index('state')
+    assert hashes.loc[['PA', 'NY'], 'row_hash'].tolist() == shuffled.loc[['PA', 'NY'], 'row_hash'].tolist()
+    assert hashes['row_count'].tolist() == [6, 6]
+    changed = partition_hashes(_voting_data(pa_votes=5)).set_index('state')
+    assert changed.loc['PA', 'row_hash'] != hashes.loc['PA', 'row_hash']
+    assert changed.loc['NY', 'row_hash'] == hashes.loc['NY', 'row_hash']
+
+
+def test_only_changed_partitions_are_rewritten(repo):
+    update_rollups(repo, _voting_data())
+    county_totals = repo.tables[COUNTY_ROLLUP.table].set_index(['state', 'county'])
+    assert county_totals.loc[('PA', 'Adams'), 'votes'] == 3 and county_totals.loc[('NY', 'Berks'), 'votes'] == 6
+    assert county_totals['precincts'].tolist() == [3, 3, 3, 3]
+    assert not repo.deletes
+
+    update_rollups(repo, _voting_data())
+    assert not repo.deletes
+
+    update_rollups(repo, _voting_data(pa_votes=10))
+    assert len(repo.deletes) == len(rollups.ROLLUPS) and all("`state` = 'PA'" in query for query in repo.deletes)
+    election_totals = repo.tables[ELECTION_ROLLUP.table].set_index('state')
+    assert election_totals.loc['PA', 'votes'] == 60 and election_totals.loc['NY', 'votes'] == 12
@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt.schema import TableSchema, Index, plan_migration, ensure_table, MIGRATION_SUFFIX  # noqa: E402
+from open_elections.dolt.verification import row_hashes  # noqa: E402
+
+COLUMNS = [('state', 'CHAR(2)'), ('year', 'SMALLINT'), ('special', 'BOOLEAN'), ('votes', 'INT')]
+KEY = ['state', 'year', 'special']
+
+
+def _describe(columns, indexes):
+    return (pd.DataFrame(columns, columns=['name', 'type']),
+            pd.DataFrame([(name, col) for name, cols in indexes.items() for col in cols], columns=['name', 'column']))
+
+
+def test_plan_migration():
+    schema = TableSchema('t', COLUMNS, KEY, [Index('state_idx', ['state'])])
+    assert plan_migration(schema, *_describe([], {})) == schema.create_statements()
+    assert schema.create_statements()[1] == 'CREATE INDEX `state_idx` ON `t` (`state`)'
+
+    # As a server reports the table the schema created, so there is nothing to do
+    current = [('state', 'char(2)'), ('year', 'smallint'), ('special', 'tinyint(1)'), ('votes', 'int')]
+    assert plan_migration(schema, *_describe(current, {'PRIMARY': KEY, 'state_idx': ['state']})) == []
+    assert plan_migration(schema, *_describe(current, {'PRIMARY': KEY, 'votes_idx': ['votes']})) == [
+        'DROP INDEX `votes_idx` ON `t`', 'CREATE INDEX `state_idx` ON `t` (`state`)'
+    ]
+
+    hashed = TableSchema('t', COLUMNS, KEY, hashed_key=True)
+    with pytest.raises(ValueError, match='--migrate-schema'):
+        plan_migration(hashed, *_describe(current, {'PRIMARY': KEY}))
+    statements = plan_migration(hashed, *_describe(current, {'PRIMARY': KEY}), migrate=True)
+    assert statements[1].startswith('CREATE TABLE `t{}`'.format(MIGRATION_SUFFIX))
+    assert 'PRIMARY KEY (`row_key`)' in statements[1]
+    assert statements[2].startswith('INSERT INTO `t{}` (`row_key`, `state`'.format(MIGRATION_SUFFIX))
+    assert statements[-1] == 'RENAME TABLE `t{}` TO `t`'.format(MIGRATION_SUFFIX)
+
+
+def test_hashed_key_is_the_row_hash_of_the_natural_key():
+    schema = TableSchema('t', COLUMNS, KEY, hashed_key=True)
+    data = pd.DataFrame(dict(state=['PA', 'PA', 'NY'], year=[2016, 2018, 2016], special=[False] * 3, votes=[1, 2, 3]))
+    keyed = schema.add_key(data)
+    assert list(keyed['row_key']) == list(row_hashes(data, KEY, 16))
+    assert keyed['row_key'].is_unique
+    assert 'row_key' not in TableSchema('t', COLUMNS, KEY).add_key(data).columns
+
+
+def test_rebuild_stops_when_values_would_not_fit():
+    current = [('state', 'varchar(16383)'), ('year', 'smallint'), ('special', 'tinyint(1)'), ('votes', 'int')]
+    executed = []
+
+    def query(sql):
+        if 'information_schema`.`columns' in sql:
+            return _describe(current, {})[0]
+        elif 'information_schema`.`statistics' in sql:
+            return _describe([], {'PRIMARY': KEY})[1]
+        assert sql == 'SELECT MAX(CHAR_LENGTH(`state`)) AS `state` FROM `t`'
+        return pd.DataFrame(dict(state=[longest]))
+
+    longest = 12
+    with pytest.raises(ValueError, match='state has values of up to 12 characters'):
+        ensure_table(TableSchema('t', COLUMNS, KEY), query, executed.append, migrate=True)
+    assert not executed
+
+    longest = 2
+    statements = ensure_table(TableSchema('t', COLUMNS, KEY), query, executed.append, migrate=True)
+    assert executed == statements and statements[-1] == 'RENAME TABLE `t{}` TO `t`'.format(MIGRATION_SUFFIX)
@@ -0,0 +1,122 @@
+from datetime import datetime
+import shutil
+import subprocess
+import threading
+import pandas as pd
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt import sql_server_sink  # noqa: E402
+from open_elections.dolt.sql_server_sink import DoltSqlServerSink, LocalSqlServer, build_upsert  # noqa: E402
+
+PORT = 3417
+
+
+def test_build_upsert():
+    statement, params = build_upsert('t', ['state', 'year', 'votes'], ['state', 'year'],
+                                     [dict(state='PA', year=2016, votes=1), dict(state='NY', year=2016, votes=2)])
+    assert statement == ('INSERT INTO `t` (`state`, `year`, `votes`) VALUES (%s, %s, %s), (%s, %s, %s) '
+                         'ON DUPLICATE KEY UPDATE `votes` = VALUES(`votes`)')
+    assert params == ['PA', 2016, 1, 'NY', 2016, 2]
+
+
+def test_build_upsert_from_data_frame():
+    rows = [dict(state='PA', year=2016, votes=1), dict(state='NY', year=2016, votes=None)]
+    _, params = build_upsert('t', ['state', 'year', 'votes'], ['state', 'year'], pd.DataFrame(rows))
+    assert params == ['PA', 2016, 1.0, 'NY', 2016, None]
+    assert all(type(param) in (str, int, float, type(None)) for param in params)
+
+
+class StubPool:
+    """
+    Stands in for MySQLConnectionPool, handing out at most pool_size connections, which record the rows upserted
+    through them and go back to the pool when closed.
+    """
+    def __init__(self, pool_size, **kwargs):
+        self.free = [StubConnection(self) for _ in range(pool_size)]
+        self.connections = list(self.free)
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def get_connection(self):
+        with self.lock:
+            assert self.free, 'Took more connections than the pool holds'
+            return self.free.pop()
+
+
+class StubConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.uses = 0
+        self.pending = []
+
+    def cursor(self):
+        self.uses += 1
+        return StubCursor(self)
+
+    def commit(self):
+        with self.pool.lock:
+            self.pool.rows.update((tuple(row[pk] for pk in ('state', 'year', 'precinct')), row) for row in self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        with self.pool.lock:
+            self.pool.free.append(self)
+
+
+class StubCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, statement, params):
+        columns = statement[statement.index('(') + 1:statement.index(')')].replace('`', '').split(', ')
+        self.conn.pending.extend(dict(zip(columns, params[i:i + len(columns)]))
+                                 for i in range(0, len(params), len(columns)))
+
+    def close(self):
+        pass
+
+
+def test_sink_upserts_every_row_through_pooled_connections(monkeypatch):
+    pools = []
+
+    def pool(**kwargs):
+        pools.append(StubPool(**kwargs))
+        return pools[-1]
+
+    monkeypatch.setattr(sql_server_sink, 'MySQLConnectionPool', pool)
+    rows = [dict(state=state, year=year, precinct=str(precinct), votes=precinct)
+            for state in ('PA', 'NY') for year in (2016, 2018) for precinct in range(20)]
+    sink = DoltSqlServerSink('voting_data', writers=2, batch_size=7)
+    assert sink.write('t', rows, ['state', 'year', 'precinct'])['rows'] == len(rows)
+    assert sink.write('t', [dict(rows[0], votes=1000)], ['state', 'year', 'precinct'])['rows'] == 1
+
+    assert sorted(pools[0].rows.values(), key=str) == sorted([dict(rows[0], votes=1000)] + rows[1:], key=str)
+    # Each partition's connection went back to the pool and was taken again, rather than a new one being opened
+    assert len(pools) == 1 and len(pools[0].free) == 2
+    assert sum(conn.uses for conn in pools[0].connections) == 4 + 1
+
+
+@pytest.mark.skipif(shutil.which('dolt') is None, reason='requires the dolt binary')
+def test_sink_upserts_against_local_sql_server(tmp_path):
+    repo_dir = tmp_path / 'voting_data'
+    repo_dir.mkdir()
+    subprocess.run(['dolt', 'init'], cwd=str(repo_dir), check=True)
+    rows = [dict(state=state, year=year, date=datetime(year, 11, 8), precinct=str(precinct), votes=precinct)
+            for state in ('PA', 'NY') for year in (2016, 2018) for precinct in range(50)]
+
+    with LocalSqlServer(str(repo_dir), port=PORT):
+        sink = DoltSqlServerSink('voting_data', port=PORT, writers=3, batch_size=7)
+        sink.execute('CREATE TABLE t (state VARCHAR(2), year INT, date DATETIME, precinct VARCHAR(8), votes INT, '
+                     'PRIMARY KEY (state, year, date, precinct))')
+        stats = sink.write('t', rows, ['state', 'year', 'date', 'precinct'])
+        assert stats['rows'] == len(rows)
+        sink.write('t', [dict(rows[0], votes=1000)], ['state', 'year', 'date', 'precinct'])
+
+        totals = sink.query('SELECT COUNT(*) AS count, SUM(votes) AS total FROM t')
+
+    assert totals['count'].iloc[0] == len(rows)
+    assert totals['total'].iloc[0] == sum(row['votes'] for row in rows) + 1000
@@ -0,0 +1,54 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt.load_shared_voting_data import voting_data_star_schema, VOTING_DATA_PKS  # noqa: E402
+from open_elections.dolt.verification import row_hashes  # noqa: E402
+
+
+def _voting_data(state, candidates, votes):
+    return pd.DataFrame([dict(state=state, year=2016, date=datetime(2016, 11, 8), election='general', special=False,
+                              office='President', district='NA', county='Adams', precinct=str(precinct),
+                              party=party, candidate=candidate, votes=votes)
+                         for precinct in range(3) for party, candidate in candidates])
+
+
+def test_normalize_assigns_stable_ids_and_round_trips():
+    star_schema = voting_data_star_schema()
+    tables = {}
+
+    # Stands in for the database, answering the dimension lookups from the rows written so far
+    def query(statement):
+        for dimension in star_schema.dimensions:
+            rows = tables.get(dimension.table)
+            if statement.endswith('FROM `{}`'.format(dimension.table)) and rows is not None:
+                return pd.DataFrame(dict(id=rows[dimension.id_column],
+                                         row_hash=row_hashes(rows, dimension.value_columns)))
+        return pd.DataFrame()
+
+    def load(data):
+        new_rows, facts = star_schema.normalize(data, query)
+        for dimension, rows in new_rows:
+            tables[dimension.table] = pd.concat([tables.get(dimension.table), rows], ignore_index=True)
+        return facts
+
+    pa = _voting_data('PA', [('DEM', 'Clinton'), ('REP', 'Trump')], 10)
+    pa_facts = load(pa)
+    assert list(tables['candidates']['candidate_id']) == [1, 2]
+    assert len(pa_facts) == len(pa) and not pa_facts.duplicated(star_schema.fact.primary_key).any()
+
+    # Values already held keep their ids, new ones continue from the largest
+    ny_facts = load(_voting_data('NY', [('REP', 'Trump'), ('GRN', 'Stein')], 20))
+    assert list(tables['candidates']['candidate']) == ['Clinton', 'Trump', 'Stein']
+    assert list(tables['counties']['state']) == ['PA', 'NY']
+    assert set(ny_facts['candidate_id']) == {2, 3}
+    assert load(pa).equals(pa_facts)
+
+    # Joining the dimensions back gives the flat table, as the view does, taking each column from the first holding it
+    flat = pa_facts
+    for dimension in star_schema.dimensions:
+        columns = [dimension.id_column] + [col for col in dimension.value_columns if col not in flat.columns]
+        flat = flat.merge(tables[dimension.table][columns], on=dimension.id_column)
+    pd.testing.assert_frame_equal(flat[pa.columns].sort_values(VOTING_DATA_PKS, ignore_index=True),
+                                  pa.sort_values(VOTING_DATA_PKS, ignore_index=True))
@@ -0,0 +1,76 @@
+from datetime import datetime
+import hashlib
+import sqlite3
+import pandas as pd
+import pytest
+
+pytest.importorskip('doltpy')
+from open_elections.dolt import verification  # noqa: E402
+from open_elections.dolt.verification import source_checksums, verify_table, row_hashes, row_hash_sql, _render, \
+    SEPARATOR  # noqa: E402
+
+
+def test_source_checksums_are_order_independent():
+    voting_data = pd.DataFrame([dict(state=state, year=2016, date=datetime(2016, 11, 8), election='general',
+                                     special=False, precinct=str(precinct), votes=precinct or None)
+                                for state in ('PA', 'NY') for precinct in range(20)])
+    checksums = source_checksums(voting_data).set_index('state')
+    shuffled = source_checksums(voting_data.sample(frac=1, random_state=0)).set_index('state')
+    assert checksums.loc[['PA', 'NY'], 'row_hash'].tolist() == shuffled.loc[['PA', 'NY'], 'row_hash'].tolist()
+    assert checksums['row_count'].tolist() == [20, 20]
+
+    changed = source_checksums(voting_data.assign(votes=voting_data['votes'].where(voting_data['state'] == 'NY', 1)))
+    changed = changed.set_index('state')
+    assert changed.loc['PA', 'row_hash'] != checksums.loc['PA', 'row_hash']
+    assert changed.loc['NY', 'row_hash'] == checksums.loc['NY', 'row_hash']
+
+
+def test_verify_table_compares_only_the_partitions_written(monkeypatch):
+    def voting_data(year, precincts):
+        return pd.DataFrame([dict(state='PA', year=year, date=datetime(year, 11, 8), election='general', special=False,
+                                  precinct=str(precinct), votes=precinct) for precinct in range(precincts)])
+
+    def read_sql_cli(repo, query, dtype=None):
+        # As the CLI returns them, with each partition's hash an unreduced DECIMAL sum
+        checksums = source_checksums(table)
+        return checksums.assign(date=checksums['date'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                                special=checksums['special'].astype(int),
+                                row_hash=[str(row_hash + 2 ** 64) for row_hash in checksums['row_hash']])
+
+    monkeypatch.setattr(verification, 'read_sql_cli', read_sql_cli)
+    written = voting_data(2016, 5)
+    # An earlier load wrote 2018, which is not compared
+    table = pd.concat([written, voting_data(2018, 3)], ignore_index=True)
+    assert verify_table(None, 'national_voting_data', written).empty
+
+    table = pd.concat([voting_data(2016, 6), voting_data(2018, 3)], ignore_index=True)
+    mismatches = verify_table(None, 'national_voting_data', written)
+    assert mismatches['year'].tolist() == [2016]
+    assert mismatches[['row_count_source', 'row_count_dolt']].values.tolist() == [[5, 6]]
+
+
+def test_rows_render_as_sql_casts_them():
+    values = ['Adams', 2016, 12.0, datetime(2016, 11, 8), True, None, float('nan')]
+    assert SEPARATOR.join(_render(value) for value in values) == SEPARATOR.join(
+        ['Adams', '2016', '12', '2016-11-08 00:00:00', '1', '\\N', '\\N']
+    )
+
+
+def test_sql_row_hashes_match_python_row_hashes():
+    # SQLite standing in for the server, with the MySQL functions row_hash_sql uses that it lacks. It does not treat
+    # backslashes in string literals as escapes, so CONCAT_WS undoes the escaping of the NULL marker the way MySQL would
+    connection = sqlite3.connect(':memory:')
+    connection.create_function('MD5', 1, lambda text: hashlib.md5(text.encode('utf-8')).hexdigest())
+    connection.create_function('CONV', 3, lambda digits, from_base, to_base: str(int(digits, from_base)))
+    connection.create_function('CONCAT_WS', -1, lambda separator, *values: separator.join(
+        value.replace('\\\\', '\\') for value in values
+    ))
+    data = pd.DataFrame(dict(state=['PA', 'NY', 'PA'], year=[2016, 2016, 2018], special=[False, True, False],
+                             date=[datetime(2016, 11, 8), datetime(2016, 11, 8), datetime(2018, 11, 6)],
+                             candidate=['Jane Doe', 'Zoë Roe', None], votes=[10, 0, None]))
+    columns = list(data.columns)
+    # Stored as the server casts them to text: booleans as 1 and 0, datetimes without fractional seconds
+    data.assign(special=data['special'].astype(int), date=data['date'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                votes=data['votes'].astype('Int64')).to_sql('t', connection, index=False)
+    sql_hashes = [row_hash for row_hash, in connection.execute('SELECT {} FROM t'.format(row_hash_sql(columns)))]
+    assert sql_hashes == list(row_hashes(data, columns))
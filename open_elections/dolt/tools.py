@@ -1,18 +1,46 @@
 from doltpy.core import Dolt
-from doltpy.core.write import import_list
-from typing import List
+from doltpy.core.write import import_dict
+from typing import List, Optional
+import pandas as pd
+import functools
 from open_elections.tools.reading import StateMetadata, VoteFileBuilder, TableDataBuilder, files_to_table_data
 from open_elections.tools.logging_helper import get_logger
+from open_elections.tools.quarantine import FileWatchdog
+from open_elections.tools.scheduling import WorkScheduler
+from open_elections.dolt.rollups import update_rollups
+from open_elections.dolt.checkpoint import LoadJournal, get_journal, batch_fingerprint, split_batches
+from open_elections.dolt.sql_server_sink import DoltSqlServerSink
+from open_elections.dolt.verification import verify_table
+from open_elections.dolt.dead_letters import get_dead_letter_file, write_isolating_errors, MAX_DEAD_LETTERS
+from open_elections.dolt.schema import TableSchema
+from open_elections.dolt.star_schema import StarSchema
+from open_elections.dolt.sql import read_sql_cli
 
 logger = get_logger(__name__)
 
+BATCH_SIZE = 100000
+# Table data builders may keep the file each row came from in this column, it is not written
+FILEPATH_COLUMN = 'filepath'
+
 
 def load_to_dolt(repo: Dolt,
                  dolt_table: str,
                  dolt_pks: List[str],
                  state_metadata: StateMetadata,
                  vote_file_builder: VoteFileBuilder,
-                 table_data_builder: TableDataBuilder):
+                 table_data_builder: TableDataBuilder,
+                 maintain_rollups: bool = False,
+                 resume: bool = False,
+                 journal_dir: str = None,
+                 cache_parsed: bool = False,
+                 sink: DoltSqlServerSink = None,
+                 watchdog: FileWatchdog = None,
+                 verify: bool = False,
+                 dead_letter_dir: str = None,
+                 max_dead_letters: int = MAX_DEAD_LETTERS,
+                 scheduler: WorkScheduler = None,
+                 schema: TableSchema = None,
+                 star_schema: StarSchema = None):
     """
     Load to the dolt dir/table specified using given columns for primary keys.
     :param repo:
@@ -21,6 +49,19 @@ def load_to_dolt(repo: Dolt,
     :param state_metadata:
     :param vote_file_builder:
     :param table_data_builder:
+    :param maintain_rollups: update the vote total rollup tables for any elections whose precinct data changed
+    :param resume: pick up from the journal of a previous failed load of this state, skipping completed work
+    :param journal_dir: where to keep load journals, defaults to ~/.open_elections/journals
+    :param cache_parsed: keep a copy of each parsed file with the journal, as a resumed load always does, so that
+        resuming the load if it fails does not parse the files again
+    :param sink: if given, rows are upserted through this pooled sql-server sink rather than with import_dict
+    :param watchdog: if given, files are parsed under its time and memory limits, and files it quarantines are skipped
+    :param verify: after loading, compare checksums of each partition in the table against the cleaned source data
+    :param dead_letter_dir: where rows that cannot be written are recorded, defaults to ~/.open_elections/dead_letters
+    :param max_dead_letters: fail the load once more than this many rows have been rejected
+    :param scheduler: if given, files are parsed across its workers, largest first, and their parse times recorded
+    :param schema: the schema the table was created with by ensure_table, which adds its hashed key to each row
+    :param star_schema: if given, rows are written to its fact and dimension tables, dolt_table being its view
     :return:
     """
     logger.info('''Loading data for state {}:
@@ -28,5 +69,115 @@ def load_to_dolt(repo: Dolt,
                 - dolt_table  : {}
                 - dolt_pks    : {}   
             '''.format(state_metadata.state, repo.repo_dir(), dolt_table, dolt_pks))
-    table_data = files_to_table_data(state_metadata, vote_file_builder, table_data_builder)
-    import_list(repo, dolt_table, table_data, dolt_pks, import_mode='update', batch_size=100000)
+    journal = get_journal(journal_dir,
+                          repo.repo_dir(),
+                          dolt_table,
+                          state_metadata.state,
+                          resume,
+                          watchdog.guard() if watchdog else None,
+                          cache_parsed)
+    try:
+        table_data = _load_rows(repo,
+                                dolt_table,
+                                dolt_pks,
+                                state_metadata,
+                                vote_file_builder,
+                                table_data_builder,
+                                journal,
+                                sink,
+                                dead_letter_dir,
+                                max_dead_letters,
+                                scheduler,
+                                schema,
+                                star_schema)
+        if maintain_rollups:
+            update_rollups(repo, table_data)
+    except BaseException:
+        journal.mark_failed()
+        raise
+    journal.mark_complete()
+
+    if verify and not table_data.empty:
+        mismatches = verify_table(repo, dolt_table, table_data)
+        if not mismatches.empty:
+            logger.error('Partitions of {} that disagree with the source:\n{}'.format(dolt_table,
+                                                                                     mismatches.to_string(index=False)))
+
+
+def _load_rows(repo: Dolt,
+               dolt_table: str,
+               dolt_pks: List[str],
+               state_metadata: StateMetadata,
+               vote_file_builder: VoteFileBuilder,
+               table_data_builder: TableDataBuilder,
+               journal: LoadJournal,
+               sink: Optional[DoltSqlServerSink],
+               dead_letter_dir: Optional[str],
+               max_dead_letters: int,
+               scheduler: Optional[WorkScheduler],
+               schema: Optional[TableSchema],
+               star_schema: Optional[StarSchema]) -> pd.DataFrame:
+    """
+    Parses the state's files and writes their rows in batches, skipping batches journal has recorded, returning the
+    rows that were written, without those that were dead lettered.
+    """
+    table_data = files_to_table_data(state_metadata,
+                                     vote_file_builder,
+                                     table_data_builder,
+                                     journal.read_vote_file,
+                                     scheduler,
+                                     dolt_pks).reset_index(drop=True)
+    filepaths = table_data.pop(FILEPATH_COLUMN) if FILEPATH_COLUMN in table_data.columns else None
+    if schema is not None:
+        table_data = schema.add_key(table_data)
+    dead_letters = get_dead_letter_file(dead_letter_dir, dolt_table, state_metadata.state, max_dead_letters)
+
+    def write_rows(table, pks, rows):
+        if sink:
+            sink.write(table, rows, pks)
+        else:
+            import_dict(repo, table, rows.to_dict('list'), pks, import_mode='update', batch_size=BATCH_SIZE)
+
+    # Given the natural key, even when the table has a hashed key, which is a function of it, so the sink can partition
+    # on the leading key columns
+    write = functools.partial(write_rows, dolt_table, dolt_pks)
+    rows_to_write = table_data
+    if star_schema is not None:
+        dimension_rows, rows_to_write = star_schema.normalize(table_data,
+                                                              sink.query if sink else functools.partial(read_sql_cli,
+                                                                                                        repo))
+        for dimension, rows in dimension_rows:
+            if rows.empty:
+                continue
+            # Dimension rows are indexed apart from table_data and come from no one file, so they are recorded apart
+            dimension_dead_letters = get_dead_letter_file(dead_letter_dir,
+                                                          dimension.table,
+                                                          state_metadata.state,
+                                                          max_dead_letters)
+            write_isolating_errors(functools.partial(write_rows, dimension.table, [dimension.id_column]),
+                                   rows,
+                                   dimension_dead_letters)
+            # Facts referring to a rejected dimension row would drop out of the view, they are rejected along with it
+            rejected_ids = rows.loc[dimension_dead_letters.rejected, dimension.id_column]
+            orphaned = rows_to_write[dimension.id_column].isin(rejected_ids)
+            for label in rows_to_write.index[orphaned]:
+                dead_letters.write(table_data.loc[label],
+                                   ValueError('Its row of {} was rejected'.format(dimension.table)),
+                                   filepaths.loc[label] if filepaths is not None else None)
+            rows_to_write = rows_to_write.loc[~orphaned]
+        write = functools.partial(write_rows, star_schema.fact.table, star_schema.fact.primary_key)
+
+    for i, batch in enumerate(split_batches(rows_to_write, BATCH_SIZE)):
+        fingerprint = batch_fingerprint(batch)
+        if journal.is_batch_written(i, fingerprint):
+            logger.info('Batch {} was written by a previous run, skipping'.format(i))
+            continue
+        written = write_isolating_errors(write, batch, dead_letters, filepaths)
+        if written < len(batch):
+            logger.error('Wrote {} of {} rows of batch {}, the rest are in {}'.format(
+                written, len(batch), i, dead_letters.path
+            ))
+        journal.record_batch(i, fingerprint, len(batch))
+
+    # Rollups and verification reflect what is in the table, which does not hold the rejected rows
+    return table_data.drop(index=dead_letters.rejected)
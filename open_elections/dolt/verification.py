@@ -0,0 +1,139 @@
+from doltpy.core import Dolt
+from open_elections.dolt.rollups import PARTITION_COLUMNS
+from open_elections.dolt.sql import read_sql_cli, sql_literal
+from open_elections.tools.logging_helper import get_logger
+from datetime import datetime
+from typing import Any, List
+import hashlib
+import numpy as np
+import pandas as pd
+
+logger = get_logger(__name__)
+
+# Rows are serialized the same way on both sides, as their values cast to strings and joined by the separator, with
+# NULLs written as the marker
+SEPARATOR = '\x1f'
+NULL_MARKER = '\\N'
+# Each row's hash is the first 15 hex digits of the MD5 of its serialization. CONV returns the digits as a string,
+# which SQL casts to an unsigned BIGINT, so that SUM adds them exactly rather than as doubles
+ROW_HASH_DIGITS = 15
+
+CHECKSUM_COLUMNS = PARTITION_COLUMNS + ['row_count', 'row_hash']
+
+
+def source_checksums(voting_data: pd.DataFrame, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Computes the row count and an order independent hash of the rows in each partition of freshly cleaned voting data:
+    the sum, modulo 2^64, of a hash of each row. dolt_checksums computes the same hashes in SQL.
+    :param voting_data:
+    :param columns: the columns to hash, by default all of them
+    :return:
+    """
+    columns = sorted(columns or voting_data.columns)
+    if voting_data.empty:
+        return pd.DataFrame(columns=CHECKSUM_COLUMNS)
+
+    grouped = (_normalize(voting_data[PARTITION_COLUMNS])
+               .assign(row_hash=row_hashes(voting_data, columns))
+               .groupby(PARTITION_COLUMNS, dropna=False, sort=False))
+    return grouped.agg(row_count=('row_hash', 'size'),
+                       row_hash=('row_hash', lambda hashes: int(np.sum(hashes.values, dtype=np.uint64)))).reset_index()
+
+
+def dolt_checksums(repo: Dolt, table: str, columns: List[str], states: List[str] = None) -> pd.DataFrame:
+    """
+    Computes the same checksums as source_checksums over the rows of a Dolt table, in a single grouped query run
+    through the dolt CLI, so that only one row per partition is transferred and no SQL server is needed.
+    :param repo:
+    :param table:
+    :param columns: the columns to hash, which must be the ones hashed on the source side
+    :param states: if given, only partitions for these states are computed
+    :return:
+    """
+    row_hash = row_hash_sql(sorted(columns))
+    partition_columns = ', '.join('`{}`'.format(col) for col in PARTITION_COLUMNS)
+    query = 'SELECT {}, COUNT(*) AS row_count, SUM({}) AS row_hash FROM `{}`'.format(partition_columns, row_hash, table)
+    if states:
+        query += ' WHERE `state` IN ({})'.format(', '.join(sql_literal(state) for state in states))
+    query += ' GROUP BY {}'.format(partition_columns)
+
+    # Sums of many hashes overflow 64 bits, so they are read as text rather than inferred to be floats
+    result = read_sql_cli(repo, query, dtype={'row_hash': str})
+    if result.empty:
+        return pd.DataFrame(columns=CHECKSUM_COLUMNS)
+    # SUM of unsigned integers is an exact DECIMAL, which is reduced to the 64 bit sum the source side computes
+    return _normalize(result).assign(row_count=result['row_count'].astype(int),
+                                     row_hash=[int(value) % 2 ** 64 for value in result['row_hash']])
+
+
+def verify_table(repo: Dolt, table: str, voting_data: pd.DataFrame, states: List[str] = None) -> pd.DataFrame:
+    """
+    Compares the checksums of cleaned voting data against those of what was loaded into table, returning only the
+    partitions that disagree, with their row counts and hashes on each side. A partition missing from the table has
+    NaN for its count and hash there.
+
+    Only the partitions voting_data holds are compared, since the table also holds whatever earlier loads wrote, such
+    as other years of the same state. So a partition voting_data no longer has any rows for is not reported, while
+    rows left in a compared partition by an earlier load show up as a mismatch.
+    :param repo:
+    :param table:
+    :param voting_data: the rows that were written
+    :param states: the states voting_data covers, by default those it contains
+    :return:
+    """
+    states = states or sorted(voting_data['state'].unique())
+    source = source_checksums(voting_data)
+    dolt = dolt_checksums(repo, table, list(voting_data.columns), states)
+    merged = source.merge(dolt, on=PARTITION_COLUMNS, how='left', suffixes=('_source', '_dolt'))
+    disagree = ((merged['row_count_source'] != merged['row_count_dolt'])
+                | (merged['row_hash_source'] != merged['row_hash_dolt']))
+    mismatches = merged.loc[disagree].reset_index(drop=True)
+    logger.info('Verified {} partitions of {} against source, {} disagree'.format(len(merged), table, len(mismatches)))
+    return mismatches
+
+
+def row_hashes(data: pd.DataFrame, columns: List[str], digits: int = ROW_HASH_DIGITS) -> np.ndarray:
+    """
+    Hashes each row of data to the integer given by the first digits hex digits of the MD5 of its values in columns,
+    serialized as described above. row_hash_sql computes the same hashes in SQL.
+    :param data:
+    :param columns:
+    :param digits: at most 16, so that hashes fit an unsigned 64 bit integer
+    :return:
+    """
+    serialized = data[columns[0]].map(_render)
+    for col in columns[1:]:
+        serialized = serialized + SEPARATOR + data[col].map(_render)
+    return np.array([int(hashlib.md5(row.encode('utf-8')).hexdigest()[:digits], 16) for row in serialized],
+                    dtype=np.uint64)
+
+
+def row_hash_sql(columns: List[str], digits: int = ROW_HASH_DIGITS) -> str:
+    """
+    A SQL expression for the hash row_hashes computes of the values of columns in a row.
+    """
+    serialized = ', '.join('IFNULL(CAST(`{}` AS CHAR), {})'.format(col, sql_literal(NULL_MARKER)) for col in columns)
+    return 'CAST(CONV(SUBSTRING(MD5(CONCAT_WS({}, {})), 1, {}), 16, 10) AS UNSIGNED)'.format(sql_literal(SEPARATOR),
+                                                                                           serialized,
+                                                                                           digits)
+
+
+def _render(value: Any) -> str:
+    # Matches how the SQL server casts the column types of voting data to strings
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return NULL_MARKER
+    elif pd.api.types.is_bool(value):
+        return '1' if value else '0'
+    elif isinstance(value, (datetime, pd.Timestamp)):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    else:
+        return str(value)
+
+
+def _normalize(partitions: pd.DataFrame) -> pd.DataFrame:
+    # Partition values come back from SQL as strings and integers rather than the types the pipeline produces
+    return partitions.assign(year=partitions['year'].astype(int),
+                             date=pd.to_datetime(partitions['date']).astype('datetime64[ns]'),
+                             special=partitions['special'].astype(str).isin(['1', 'true', 'True']))
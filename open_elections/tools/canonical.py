@@ -0,0 +1,154 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import Mapping, Optional, Iterable, Any
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+NAME_COLUMNS = ['candidate', 'party', 'office', 'county']
+
+# Applied to every state, keyed by column then by the casefolded spelling
+DEFAULT_ALIASES = {
+    'party': {
+        'r': 'REP', 'rep': 'REP', 'republican': 'REP', 'gop': 'REP',
+        'd': 'DEM', 'dem': 'DEM', 'democrat': 'DEM', 'democratic': 'DEM',
+        'l': 'LIB', 'lib': 'LIB', 'libertarian': 'LIB',
+        'g': 'GRN', 'grn': 'GRN', 'green': 'GRN',
+    },
+    'office': {
+        'president': 'President',
+        'us president': 'President',
+        'us senate': 'U.S. Senate',
+        'united states senate': 'U.S. Senate',
+        'us house': 'U.S. House',
+        'united states house of representatives': 'U.S. House',
+        'governor': 'Governor',
+    },
+}
+
+NAME_SUFFIXES = ['jr', 'sr', 'ii', 'iii', 'iv']
+_SUFFIX_PATTERN = re.compile(r',?\s+({})\.?$'.format('|'.join(NAME_SUFFIXES)), re.IGNORECASE)
+_INITIAL_PATTERN = re.compile(r'\b([A-Za-z])\.(?=\s|$)')
+_COUNTY_SUFFIX_PATTERN = re.compile(r'\s+county$', re.IGNORECASE)
+
+
+class NameCanonicalizer:
+    """
+    Maps spellings of candidate, party, office and county names to a canonical form. Spellings that agree once case,
+    whitespace, punctuation and name suffixes are normalized share a match key, and every spelling with a key takes
+    one canonical form: the canonical form of DEFAULT_ALIASES with that key if there is one, and otherwise the cleaned
+    spelling on the most rows of the first data the key is seen in, the lexically smallest of those tied. Alias tables
+    map spellings to canonical forms outright.
+
+    A canonicalizer keeps the forms it has chosen, so data given to it later takes the forms chosen from data given
+    earlier. Given all of a state's rows in one call, as canonicalize_names is, the forms depend only on those rows,
+    not on the order of its rows or files, nor on what was loaded before it.
+
+    Results are memoized per column, so each distinct spelling is canonicalized once however many times it appears.
+    """
+    def __init__(self):
+        self._memo = {col: {} for col in NAME_COLUMNS}
+        self._canonical_by_key = {col: {match_key(canonical): canonical
+                                        for canonical in DEFAULT_ALIASES.get(col, {}).values()}
+                                  for col in NAME_COLUMNS}
+
+    def canonicalize(self, df: pd.DataFrame, aliases: Mapping[str, Mapping[str, str]] = None) -> pd.DataFrame:
+        """
+        Canonicalizes the name columns of df. Each column is factorized, so only its distinct values are looked at,
+        and the canonical forms are mapped back by code.
+        :param df:
+        :param aliases: per state alias tables, keyed by column then by spelling, consulted before DEFAULT_ALIASES
+        :return:
+        """
+        result = df.copy()
+        for col in NAME_COLUMNS:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col])
+            col_aliases = {_casefold(spelling): canonical
+                           for spelling, canonical in (aliases or {}).get(col, {}).items()}
+            self._choose_canonical_forms(col, uniques, np.bincount(codes[codes >= 0], minlength=len(uniques)))
+            canonical = pd.Series([self.canonical_name(col, value, col_aliases) for value in uniques], dtype=object)
+            changed = sum(1 for value, name in zip(uniques, canonical) if value != name)
+            logger.debug('Canonicalized %d of %d distinct values of %s', changed, len(uniques), col)
+            values = canonical.values.take(codes)
+            values[codes == -1] = None
+            result[col] = values
+        return result
+
+    def _choose_canonical_forms(self, col: str, values: Iterable[Any], counts: Iterable[int]):
+        """
+        Fixes the canonical form of each match key of values not seen before as its most common cleaned spelling.
+        """
+        rows_by_key = {}
+        for value, count in zip(values, counts):
+            if not isinstance(value, str) or value in self._memo[col]:
+                continue
+            cleaned = clean_name(col, value)
+            key = match_key(cleaned)
+            if key not in self._canonical_by_key[col]:
+                spellings = rows_by_key.setdefault(key, {})
+                spellings[cleaned] = spellings.get(cleaned, 0) + int(count)
+        for key, spellings in rows_by_key.items():
+            self._canonical_by_key[col][key] = min(spellings, key=lambda spelling: (-spellings[spelling], spelling))
+
+    def canonical_name(self, col: str, value: Optional[str], aliases: Mapping[str, str] = None) -> Optional[str]:
+        if not isinstance(value, str):
+            return value
+        if aliases:
+            # State aliases depend on the state, so they bypass the memo
+            alias = aliases.get(_casefold(value), aliases.get(_casefold(clean_name(col, value))))
+            if alias is not None:
+                return alias
+
+        memo = self._memo[col]
+        if value not in memo:
+            cleaned = clean_name(col, value)
+            alias = DEFAULT_ALIASES.get(col, {}).get(_casefold(cleaned))
+            if alias is not None:
+                memo[value] = alias
+            else:
+                memo[value] = self._canonical_by_key[col].setdefault(match_key(cleaned), cleaned)
+        return memo[value]
+
+
+def clean_name(col: str, value: str) -> str:
+    """
+    Collapses whitespace, and for candidates drops the periods after initials and writes suffixes as 'Jr', and for
+    counties drops a trailing 'County'.
+    :param col:
+    :param value:
+    :return:
+    """
+    cleaned = ' '.join(value.split())
+    if col == 'candidate':
+        cleaned = _INITIAL_PATTERN.sub(r'\1', cleaned)
+        cleaned = _SUFFIX_PATTERN.sub(lambda match: ' ' + _format_suffix(match.group(1)), cleaned)
+    elif col == 'county':
+        cleaned = _COUNTY_SUFFIX_PATTERN.sub('', cleaned) or cleaned
+    return cleaned
+
+
+def match_key(value: str) -> str:
+    """
+    Spellings with the same key are the same name: 'Kenneth P La Valle' and 'Kenneth P Lavalle' both give
+    'kennethplavalle'.
+    """
+    return re.sub(r'[\W_]+', '', _casefold(value))
+
+
+def _format_suffix(suffix: str) -> str:
+    return suffix.capitalize() if suffix.lower() in ('jr', 'sr') else suffix.upper()
+
+
+def _casefold(value: str) -> str:
+    return ' '.join(value.split()).casefold()
+
+
+def canonicalize_names(df: pd.DataFrame, aliases: Mapping[str, Mapping[str, str]] = None) -> pd.DataFrame:
+    """
+    Canonicalizes the name columns of df with a canonicalizer of its own, so the canonical forms are chosen from the
+    rows of df alone.
+    """
+    return NameCanonicalizer().canonicalize(df, aliases)
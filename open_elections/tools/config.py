@@ -1,8 +1,9 @@
 import os
 from open_elections.tools.reading import StateMetadata, StateDataFormat
 from open_elections.tools.logging_helper import get_logger
+from open_elections.tools.sources import FileSource
 import pandas as pd
-from typing import List, Callable, Optional
+from typing import List, Callable, Optional, Union
 import importlib
 
 BASE_DIR = '/Users/oscarbatori/Documents/open-elections'
@@ -16,7 +17,9 @@ def build_state_metadata(state: str,
                          columns: List[str] = None,
                          vote_columns: List[str] = None,
                          df_transformers: List[Callable[[pd.DataFrame], pd.DataFrame]] = None,
-                         row_cleaners: List[Callable[[dict], None]] = None) -> StateMetadata:
+                         row_cleaners: List[Callable[[dict], None]] = None,
+                         source: Union[str, FileSource] = None,
+                         canonicalize_names: bool = False) -> StateMetadata:
     """
     This is a factor method for state metadata that allows for a number of ways ot spcify state specific attributes:
         - they can be explicitly specified (for example in nationwide voting data we want to the same set of columns)
@@ -29,10 +32,16 @@ def build_state_metadata(state: str,
     :param vote_columns:
     :param df_transformers:
     :param row_cleaners:
+    :param source: where to read the state's files from, defaults to the checked out repo under BASE_DIR
+    :param canonicalize_names: whether files_to_table_data should canonicalize candidate, party, office and county names
     :return:
     """
     assert state in STATES, 'State {} not in: {}'.format(state, STATES)
     excluded_files = []
+    encodings = None
+    column_dtypes = None
+    name_aliases = None
+    plan_reads = False
 
     # try_module is True and so we should try and grab attributes from the state
     try:
@@ -43,6 +52,10 @@ def build_state_metadata(state: str,
                 raise TypeError('state_module_member must resolve an object of type StateDataFormat')
             else:
                 excluded_files = excluded_files if not state_data_format.excluded_files else state_data_format.excluded_files
+                encodings = state_data_format.encodings
+                column_dtypes = state_data_format.column_dtypes
+                name_aliases = state_data_format.name_aliases
+                plan_reads = state_data_format.plan_reads
                 columns = _combine_helper(columns, state_data_format.columns)
                 vote_columns = _combine_helper(vote_columns, state_data_format.vote_columns)
                 df_transformers = _combine_helper(df_transformers, state_data_format.df_transformers)
@@ -61,13 +74,18 @@ def build_state_metadata(state: str,
         else:
             pass
 
-    return StateMetadata(get_state_dir(state),
+    return StateMetadata(source or get_state_dir(state),
                          state,
                          columns,
                          vote_columns,
                          df_transformers,
                          row_cleaners,
-                         excluded_files)
+                         excluded_files,
+                         encodings,
+                         column_dtypes,
+                         name_aliases,
+                         canonicalize_names,
+                         plan_reads)
 
 
 def get_state_dir(state: str) -> str:
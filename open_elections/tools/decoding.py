@@ -0,0 +1,145 @@
+import codecs
+import io
+import threading
+from typing import BinaryIO, Callable, List, TextIO, Tuple
+
+# Tried in order, the first that decodes the whole file without error wins. Most Open Elections files are UTF-8, and
+# those that are not were almost always saved from Excel on Windows.
+DEFAULT_ENCODINGS = ['utf-8', 'cp1252']
+
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+REPLACE_ERROR_HANDLER = 'open_elections_counting_replace'
+
+# Files that are streamed rather than read whole are decoded this many bytes at a time
+DECODE_BLOCK_BYTES = 1 << 20
+
+_replaced = threading.local()
+
+
+def _counting_replace(error: UnicodeDecodeError) -> Tuple[str, int]:
+    _replaced.count = getattr(_replaced, 'count', 0) + error.end - error.start
+    return '\ufffd', error.end
+
+
+codecs.register_error(REPLACE_ERROR_HANDLER, _counting_replace)
+
+
+class DecodedText:
+    """
+    The text of a file along with the encoding it was decoded with, and the number of undecodable bytes that were
+    replaced with U+FFFD, which is zero unless every encoding failed.
+    """
+    def __init__(self, text: str, encoding: str, replaced_bytes: int = 0):
+        self.text = text
+        self.encoding = encoding
+        self.replaced_bytes = replaced_bytes
+
+
+def sniff_bom(raw: bytes) -> Tuple[str, bool]:
+    """
+    Returns the encoding indicated by a byte order mark at the start of raw, and whether one was found.
+    """
+    # UTF-32 LE marks start with the UTF-16 LE mark, so the longer marks are checked first
+    for bom, encoding in BOMS:
+        if raw.startswith(bom):
+            return encoding, True
+    return '', False
+
+
+def decode_bytes(raw: bytes, encodings: List[str] = None) -> DecodedText:
+    """
+    Decodes raw, the full contents of a file, with the encoding named by its byte order mark if it has one, and
+    otherwise with the first of encodings that decodes it without error. If none do the first encoding is used, with
+    undecodable bytes replaced and counted, so a few bad bytes never cost us a whole file.
+    :param raw:
+    :param encodings:
+    :return:
+    """
+    encodings = encodings or DEFAULT_ENCODINGS
+    bom_encoding, has_bom = sniff_bom(raw)
+    candidates = [bom_encoding] if has_bom else encodings
+
+    for encoding in candidates:
+        try:
+            return DecodedText(raw.decode(encoding), encoding)
+        except UnicodeDecodeError:
+            continue
+
+    _replaced.count = 0
+    text = raw.decode(candidates[0], errors=REPLACE_ERROR_HANDLER)
+    return DecodedText(text, candidates[0], _replaced.count)
+
+
+def detect_encoding(open_file: Callable[[], BinaryIO], encodings: List[str] = None) -> Tuple[str, int]:
+    """
+    Picks the encoding decode_bytes would pick for a file, without holding the file in memory, by decoding it a block
+    at a time with each candidate in turn. open_file is called to reopen the file for each candidate. Returns the
+    encoding and the number of undecodable bytes that decoding with it replaces.
+    :param open_file:
+    :param encodings:
+    :return:
+    """
+    encodings = encodings or DEFAULT_ENCODINGS
+    with open_file() as f:
+        bom_encoding, has_bom = sniff_bom(f.read(4))
+    candidates = [bom_encoding] if has_bom else encodings
+
+    for encoding in candidates:
+        try:
+            _decode_blocks(open_file, encoding, 'strict')
+            return encoding, 0
+        except UnicodeDecodeError:
+            continue
+
+    _replaced.count = 0
+    _decode_blocks(open_file, candidates[0], REPLACE_ERROR_HANDLER)
+    return candidates[0], _replaced.count
+
+
+def guess_encoding(prefix: bytes, encodings: List[str] = None, complete: bool = False) -> str:
+    """
+    Picks the encoding decode_bytes would most likely pick for a file from prefix, its first bytes, for callers that
+    only read the start of the file. A character cut off at the end of prefix is not an error unless complete says
+    prefix is the whole file. Bytes past prefix that the guess cannot decode go unnoticed, so text decoded with it
+    should be opened leniently.
+    :param prefix:
+    :param encodings:
+    :param complete:
+    :return:
+    """
+    encodings = encodings or DEFAULT_ENCODINGS
+    bom_encoding, has_bom = sniff_bom(prefix)
+    if has_bom:
+        return bom_encoding
+
+    for encoding in encodings:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=complete)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return encodings[0]
+
+
+def open_decoded(fileobj: BinaryIO, encoding: str, replaced_bytes: int = 0, lenient: bool = False) -> TextIO:
+    """
+    Wraps a binary file in a text stream that decodes it as detect_encoding said to, or if lenient, as guess_encoding
+    guessed, replacing any undecodable bytes. Line endings are left as they are, as they are by decode_bytes.
+    """
+    errors = REPLACE_ERROR_HANDLER if replaced_bytes or lenient else 'strict'
+    return io.TextIOWrapper(fileobj, encoding=encoding, errors=errors, newline='')
+
+
+def _decode_blocks(open_file: Callable[[], BinaryIO], encoding: str, errors: str):
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    with open_file() as f:
+        for block in iter(lambda: f.read(DECODE_BLOCK_BYTES), b''):
+            decoder.decode(block)
+    decoder.decode(b'', final=True)
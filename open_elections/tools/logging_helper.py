@@ -1,11 +1,93 @@
+import atexit
+import contextlib
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import threading
+import time
 
 LOG_LEVEL = logging.INFO
+LOG_FORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+LOG_DATE_FORMAT = '%m-%d %H:%M:%S'
+# Handlers that emit the log records, on the listener thread, add to these with add_handler
 HANDLERS = []
+# How often a ProgressLog reports
+PROGRESS_INTERVAL = 10.0
 
-logging.basicConfig(level=LOG_LEVEL,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M:%S')
+_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+
+
+def configure_logging():
+    """
+    Routes all log records through a queue to a listener thread that owns the handlers, so the threads and processes
+    doing the work only ever enqueue a record and never wait on a stream or file. Entry points call this once before
+    doing any work, importing the package configures nothing. The queue is a multiprocessing queue, so worker
+    processes forked after this is called inherit its handler and log through the parent's listener, and calling it
+    again in them does nothing. Processes started with spawn or forkserver inherit neither, so pools pass this as their
+    initializer, which gives each such worker a listener of its own writing to the same stream.
+    :return:
+    """
+    global _listener, _listener_pid
+    with _lock:
+        if _listener is not None:
+            return
+
+        if not HANDLERS:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+            HANDLERS.append(stream_handler)
+
+        log_queue = multiprocessing.Queue(-1)
+        root = logging.getLogger()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(LOG_LEVEL)
+        _listener = logging.handlers.QueueListener(log_queue, *HANDLERS, respect_handler_level=True)
+        _listener_pid = os.getpid()
+        _listener.start()
+        atexit.register(_stop_listener)
+
+
+def add_handler(handler: logging.Handler):
+    """
+    Adds a handler to the listener, once however many times it is called with the same handler, taking effect when
+    configure_logging is called if it has not been yet.
+    :param handler:
+    :return:
+    """
+    with _lock:
+        if handler not in HANDLERS:
+            HANDLERS.append(handler)
+            if _listener is not None:
+                _listener.handlers = tuple(HANDLERS)
+
+
+@contextlib.contextmanager
+def paused_logging():
+    """
+    Stops the listener, once it has emitted the records already queued, until the block is done. Forking while the
+    listener thread is emitting a record can leave the child with the lock of a handler or its stream held by a thread
+    that does not exist in the child, so pools fork their workers inside this block. Records logged in the meantime
+    wait in the queue.
+    :return:
+    """
+    with _lock:
+        listener = _listener if _listener is not None and os.getpid() == _listener_pid else None
+        if listener is not None:
+            listener.stop()
+    try:
+        yield
+    finally:
+        if listener is not None:
+            listener.start()
+
+
+def _stop_listener():
+    # Forked children inherit this hook, but must leave the parent's listener running
+    if _listener is not None and os.getpid() == _listener_pid:
+        _listener.stop()
 
 
 def get_logger(name: str):
@@ -15,9 +97,29 @@ def get_logger(name: str):
     :return:
     """
     logger = logging.getLogger(name)
-
-    for handler in HANDLERS:
-        logger.addHandler(handler)
-
     logger.setLevel(LOG_LEVEL)
     return logger
+
+
+class ProgressLog:
+    """
+    Summarizes a stream of per item events, such as parsing a file, logging a count at most once every interval
+    seconds and once when done, rather than a line per item. Per item detail belongs at debug level.
+    """
+    def __init__(self, logger: logging.Logger, description: str, interval: float = PROGRESS_INTERVAL):
+        self.logger = logger
+        self.description = description
+        self.interval = interval
+        self.count = 0
+        self._start = time.monotonic()
+        self._last_logged = self._start
+
+    def update(self, item: str = None, n: int = 1):
+        self.count += n
+        now = time.monotonic()
+        if now - self._last_logged >= self.interval:
+            self._last_logged = now
+            self.logger.info('%s: %d so far, at %s', self.description, self.count, item)
+
+    def done(self):
+        self.logger.info('%s: %d in %.1fs', self.description, self.count, time.monotonic() - self._start)
@@ -0,0 +1,207 @@
+import json
+import multiprocessing
+import os
+import time
+import pandas as pd
+from typing import Optional
+from open_elections.tools.reading import VoteFile, VoteFileReader
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_LEDGER_PATH = os.path.join(os.path.expanduser('~'), '.open_elections', 'quarantine.jsonl')
+DEFAULT_TIMEOUT = 600.0
+DEFAULT_MAX_MEMORY = 4 * 1024 ** 3
+# How often the watchdog checks on a file being parsed
+POLL_INTERVAL = 0.1
+
+QUARANTINE_ENTRY = 'quarantine'
+RELEASE_ENTRY = 'release'
+
+TIMEOUT = 'timeout'
+MEMORY = 'memory'
+CRASHED = 'crashed'
+MEMORY_ERROR_EXIT_CODE = 3
+
+
+class QuarantineLedger:
+    """
+    An append only record of the files that could not be parsed within the watchdog's limits, along with why. Files
+    are keyed by state and path relative to the state repo, and each entry records the FileSource fingerprint of the
+    file when it was quarantined. A quarantined file is skipped until its fingerprint changes, that is until somebody
+    fixes it, or until it is released.
+    """
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+        self._entries = {}
+        if os.path.exists(path):
+            self._read()
+
+    def _read(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning('Ignoring corrupt quarantine entry in {}'.format(self.path))
+                    continue
+                key = (entry['state'], entry['path'])
+                if entry['type'] == QUARANTINE_ENTRY:
+                    self._entries[key] = entry
+                else:
+                    self._entries.pop(key, None)
+
+    def _append(self, entry: dict):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get(self, vote_file: VoteFile) -> Optional[dict]:
+        """
+        Returns the entry quarantining vote_file, if there is one and the file has not changed since.
+        """
+        entry = self._entries.get(_key(vote_file))
+        if entry is None:
+            return None
+        if entry['fingerprint'] != _fingerprint(vote_file):
+            logger.info('{} has changed since it was quarantined for {}, retrying it'.format(vote_file.filepath,
+                                                                                             entry['reason']))
+            return None
+        return entry
+
+    def quarantine(self, vote_file: VoteFile, reason: str, detail: str):
+        state, path = _key(vote_file)
+        entry = dict(type=QUARANTINE_ENTRY,
+                     state=state,
+                     path=path,
+                     fingerprint=_fingerprint(vote_file),
+                     reason=reason,
+                     detail=detail,
+                     time=time.time())
+        self._append(entry)
+        self._entries[(state, path)] = entry
+
+    def release(self, state: str, path: str):
+        self._append(dict(type=RELEASE_ENTRY, state=state, path=path, time=time.time()))
+        self._entries.pop((state, path), None)
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame(list(self._entries.values()),
+                            columns=['state', 'path', 'fingerprint', 'reason', 'detail', 'time'])
+
+
+class FileWatchdog:
+    """
+    Parses each file in a child process under a wall clock limit and a limit on how much the child's memory may grow,
+    so that one pathological file, say a huge one with a broken quote, costs at most those limits rather than the whole
+    load. A file that exceeds either, or kills the child, is quarantined in the ledger and skipped, and later runs skip
+    it without trying it again. Exceptions raised while parsing are raised in the caller, as they would be without the
+    watchdog.
+
+    Memory is measured as the growth in the child's resident set size over the parent's at the time of the fork, which
+    needs /proc. Where it is not available only the time limit applies.
+    """
+    def __init__(self,
+                 ledger: QuarantineLedger,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 max_memory: int = DEFAULT_MAX_MEMORY):
+        self.ledger = ledger
+        self.timeout = timeout
+        self.max_memory = max_memory
+
+    def guard(self, vote_file_reader: VoteFileReader = None) -> VoteFileReader:
+        """
+        Wraps vote_file_reader, by default VoteFile.to_enriched_df, in the watchdog. The wrapped reader returns None for
+        quarantined files, which read_vote_files skips.
+        """
+        vote_file_reader = vote_file_reader or VoteFile.to_enriched_df
+
+        def inner(vote_file: VoteFile) -> Optional[pd.DataFrame]:
+            entry = self.ledger.get(vote_file)
+            if entry is not None:
+                logger.warning('Skipping {}, quarantined for {}: {}'.format(vote_file.filepath,
+                                                                          entry['reason'],
+                                                                          entry['detail']))
+                return None
+            return self.read(vote_file_reader, vote_file)
+
+        return inner
+
+    def read(self, vote_file_reader: VoteFileReader, vote_file: VoteFile) -> Optional[pd.DataFrame]:
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        baseline = _rss(os.getpid())
+        process = context.Process(target=_read_in_child, args=(vote_file_reader, vote_file, sender))
+        start = time.monotonic()
+        process.start()
+        sender.close()
+        try:
+            # The receiver also polls ready when the child exits without sending anything
+            while not receiver.poll(POLL_INTERVAL):
+                elapsed, rss = time.monotonic() - start, _rss(process.pid)
+                if elapsed > self.timeout:
+                    return self._quarantine(vote_file, TIMEOUT, 'still parsing after {:.0f}s'.format(elapsed))
+                if rss is not None and baseline is not None and rss - baseline > self.max_memory:
+                    return self._quarantine(vote_file, MEMORY, 'grew by {} MB'.format((rss - baseline) // 1024 ** 2))
+
+            try:
+                succeeded, result = receiver.recv()
+            except EOFError:
+                process.join()
+                return self._quarantine(vote_file, *_classify_exit(process))
+            if not succeeded:
+                raise result
+            return result
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+
+    def _quarantine(self, vote_file: VoteFile, reason: str, detail: str) -> None:
+        logger.error('Quarantining {}: {}, {}'.format(vote_file.filepath, reason, detail))
+        self.ledger.quarantine(vote_file, reason, detail)
+        return None
+
+
+def _read_in_child(vote_file_reader: VoteFileReader, vote_file: VoteFile, sender):
+    try:
+        message = (True, vote_file_reader(vote_file))
+    except MemoryError:
+        os._exit(MEMORY_ERROR_EXIT_CODE)
+    except Exception as e:
+        message = (False, e)
+    try:
+        sender.send(message)
+    except Exception:
+        # The exception raised while parsing could not be pickled
+        sender.send((False, RuntimeError(repr(message[1]))))
+    finally:
+        sender.close()
+
+
+def _classify_exit(process) -> tuple:
+    # A child killed outright, rather than exiting with an error, was most likely killed by the OOM killer
+    if process.exitcode == MEMORY_ERROR_EXIT_CODE:
+        return MEMORY, 'raised MemoryError'
+    if process.exitcode is not None and process.exitcode < 0:
+        return MEMORY, 'killed by signal {}'.format(-process.exitcode)
+    return CRASHED, 'exited with code {}'.format(process.exitcode)
+
+
+def _rss(pid: int) -> Optional[int]:
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _key(vote_file: VoteFile) -> tuple:
+    return vote_file.state_metadata.state, vote_file.state_metadata.source.relpath(vote_file.filepath)
+
+
+def _fingerprint(vote_file: VoteFile) -> str:
+    return vote_file.state_metadata.source.fingerprint(vote_file.filepath)
@@ -0,0 +1,182 @@
+import re
+import pandas as pd
+from typing import List, Tuple, Optional, Any, Mapping, Callable
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+# Columns VoteFile adds from file name metadata before the transformers run
+ENRICHMENT_COLUMNS = ['state', 'year', 'date', 'election', 'special', 'filepath']
+
+RENAME, CONSTANT = 'rename', 'constant'
+
+
+class ReadPlan:
+    """
+    Describes how to turn a file with a given header directly into the DataFrame the transformer chain would produce
+    from it: which raw columns it takes values from and with what dtypes to read them, and for each output column
+    either the input column it is renamed from (with the value its missing values are filled with, if any), or the
+    constant it is set to.
+
+    Plans are computed by compute_read_plan, and only exist for transformer chains that rename, select, fill and add
+    constant columns. Chains that compute values from the data, such as summing vote columns, get no plan and are run
+    as they always have been.
+    """
+    def __init__(self,
+                 usecols: List[str],
+                 outputs: List[Tuple[str, str, str, Any]],
+                 dtypes: Mapping[str, Any] = None):
+        self.usecols = usecols
+        self.outputs = outputs
+        self.dtypes = dtypes
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Builds the output columns from df, which must contain usecols and the enrichment columns.
+        """
+        result = {}
+        for name, kind, source, value in self.outputs:
+            if kind == RENAME:
+                result[name] = df[source] if value is None else df[source].fillna(value)
+            else:
+                result[name] = pd.Series(value, index=df.index)
+        return pd.DataFrame(result, index=df.index, columns=[name for name, _, _, _ in self.outputs])
+
+
+class ReadPlanCache:
+    """
+    Read plans for one state's transformers, keyed by header signature, the tuple of column names in a file's header.
+    A state has only a handful of distinct headers, so nearly every file is a cache hit.
+
+    The probe cannot tell a transformer that drops rows by their values, say totals rows, from one that keeps every
+    row, since the probe holds no such values, nor one that changes only some values, say zero padding short precinct
+    numbers, from a rename. So the first file read with each plan is also run through the transformers, see check,
+    and the plan is dropped if they give any different rows. A transformer that leaves that file as it is, but would
+    change a later one, still goes unnoticed, which is why states opt in to read plans with plan_reads.
+    """
+    def __init__(self,
+                 transformers: List[Callable[[pd.DataFrame], pd.DataFrame]],
+                 required_columns: List[str] = None,
+                 column_dtypes: Mapping[str, Any] = None):
+        self.transformers = transformers
+        self.required_columns = required_columns
+        self.column_dtypes = column_dtypes
+        self._plans = {}
+        self._checked = set()
+
+    def get(self, header: Tuple[str, ...]) -> Optional[ReadPlan]:
+        if header not in self._plans:
+            self._plans[header] = compute_read_plan(list(header),
+                                                    self.transformers,
+                                                    self.required_columns,
+                                                    self.column_dtypes)
+            logger.debug('Computed read plan for header %s: %s', header, 'found' if self._plans[header] else 'none')
+        return self._plans[header]
+
+    def is_checked(self, header: Tuple[str, ...]) -> bool:
+        return header in self._checked
+
+    def check(self, header: Tuple[str, ...], planned: pd.DataFrame, transformed: pd.DataFrame) -> bool:
+        """
+        Compares a file read with the plan for header against the same file run through the transformers, dropping the
+        plan, so files with this header are read through the transformers from now on, unless they give the same rows.
+        Values are compared rather than dtypes, since the plan reads columns with column_dtypes and the transformers do
+        not.
+        :return: whether the plan was kept
+        """
+        self._checked.add(header)
+        if len(planned) != len(transformed):
+            logger.warning('Not planning reads of files with header {}, the transformers kept {} rows of a file the '
+                           'plan kept {} of, so they filter rows'.format(header, len(transformed), len(planned)))
+            self._plans[header] = None
+            return False
+        differing = [col for col in planned.columns
+                     if col not in transformed.columns or _values(planned[col]) != _values(transformed[col])]
+        if differing:
+            logger.warning('Not planning reads of files with header {}, the transformers give different values of {} '
+                           'than the plan does'.format(header, differing))
+            self._plans[header] = None
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._plans)
+
+
+def compute_read_plan(header: List[str],
+                      transformers: List[Callable[[pd.DataFrame], pd.DataFrame]],
+                      required_columns: List[str] = None,
+                      column_dtypes: Mapping[str, Any] = None) -> Optional[ReadPlan]:
+    """
+    Works out what transformers do to a file with the given header by running them on a probe DataFrame: two rows in
+    which every cell holds a sentinel unique to its column and row, and a row of missing values. An output column that
+    holds an input column's sentinels, unchanged, is a rename of it, and whatever is in its missing value row is the
+    fill value. One that holds the same plain value in every row is a constant. Anything else means a transformer
+    computes values from the data, and there is no plan.
+    :param header: the column names of the file, as pandas parses them
+    :param transformers:
+    :param required_columns: if given, the plan only reads and produces these columns
+    :param column_dtypes: dtypes to read output columns with, keyed by output column name
+    :return:
+    """
+    inputs = list(header) + [col for col in ENRICHMENT_COLUMNS if col not in header]
+    if len(set(header)) != len(header) or any(_is_mangled_duplicate(col, header) for col in header):
+        return None
+
+    probe = pd.DataFrame({col: [_sentinel(i, 0), _sentinel(i, 1), None] for i, col in enumerate(inputs)},
+                         dtype=object)
+    try:
+        for transformer in transformers:
+            probe = transformer(probe)
+        if not isinstance(probe, pd.DataFrame) or len(probe) != 3 or not probe.columns.is_unique:
+            return None
+    except Exception:
+        return None
+
+    outputs = []
+    for name in probe.columns:
+        first, second, missing = probe[name].tolist()
+        source = _sentinel_source(first, 0, inputs)
+        if source is not None and _sentinel_source(second, 1, inputs) == source:
+            outputs.append((name, RENAME, source, None if pd.isna(missing) else missing))
+        elif _is_plain(first) and first == second and (missing == first or pd.isna(missing) and pd.isna(first)):
+            outputs.append((name, CONSTANT, None, first))
+        else:
+            return None
+
+    if required_columns:
+        outputs = [output for output in outputs if output[0] in required_columns]
+
+    usecols = [source for _, kind, source, _ in outputs if kind == RENAME and source in header]
+    usecols = [col for col in header if col in usecols]
+    dtypes = {source: column_dtypes[name] for name, kind, source, _ in outputs
+              if column_dtypes and kind == RENAME and source in header and name in column_dtypes}
+    return ReadPlan(usecols, outputs, dtypes or None)
+
+
+def _values(column: pd.Series) -> List[Any]:
+    return column.astype(object).where(column.notna(), None).tolist()
+
+
+def _sentinel(column_index: int, row: int) -> str:
+    # Padded and in mixed case, so that transformers which strip or change the case of values, and so are not renames,
+    # leave no sentinel behind
+    return '  \x00pRoBe:{}:{}\x00  '.format(column_index, row)
+
+
+def _sentinel_source(value: Any, row: int, inputs: List[str]) -> Optional[str]:
+    if isinstance(value, str):
+        match = re.match(r'^  \x00pRoBe:(\d+):(\d)\x00  $', value)
+        if match and int(match.group(2)) == row:
+            return inputs[int(match.group(1))]
+    return None
+
+
+def _is_plain(value: Any) -> bool:
+    return not (isinstance(value, str) and '\x00' in value)
+
+
+def _is_mangled_duplicate(col: str, header: List[str]) -> bool:
+    # pandas renames the second 'votes' column in a header to 'votes.1'
+    match = re.match(r'^(.*)\.\d+$', col)
+    return bool(match) and match.group(1) in header
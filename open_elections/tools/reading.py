@@ -1,40 +1,92 @@
 from datetime import datetime
+import functools
 import os
 import pandas as pd
-from typing import List, Tuple, Callable, Union, Iterable, Optional, Any
+from typing import List, Tuple, Callable, Union, Iterable, Iterator, Optional, Any, BinaryIO, Mapping, TextIO
 import re
-from open_elections.tools.logging_helper import get_logger
+import zlib
+import numpy as np
+from open_elections.tools.logging_helper import get_logger, ProgressLog
+from open_elections.tools.canonical import canonicalize_names
+from open_elections.tools.sources import FileSource, as_file_source, strip_compression_suffix
+from open_elections.tools.decoding import decode_bytes, detect_encoding, guess_encoding, open_decoded, DecodedText
+from open_elections.tools.read_plans import ReadPlan, ReadPlanCache
+from open_elections.tools.scheduling import WorkScheduler, PARSE_STAGE
+import io
 
 
 logger = get_logger(__name__)
 
 
+# Rows read from each file by StatePreview.head and sample, and the chunks sample_df parses files in
+PREVIEW_ROWS = 5
+SAMPLE_CHUNK_ROWS = 50000
+# Bytes at the start of a file head_df and sample_df guess its encoding from, when it has not been read before
+PREVIEW_ENCODING_BYTES = 64 * 1024
+# Files with more decoded bytes than this are parsed by to_enriched_df in chunks of CHUNK_ROWS rows, rather than whole
+CHUNKED_READ_BYTES = 64 * 1024 * 1024
+CHUNK_ROWS = 250000
+
+
 class StateMetadata:
     """
     Stores state metadata such as where the data lives and required format information for parsing data correctly.
     """
     def __init__(self,
-                 source_dir: Union[None, str],
+                 source_dir: Union[None, str, FileSource],
                  state: str,
                  columns: List[str],
                  vote_columns: List[str],
                  df_transformers: List[Callable[[pd.DataFrame], pd.DataFrame]] = None,
                  row_cleaners: Callable[[dict], dict] = None,
-                 excluded_files: List[str] = None):
+                 excluded_files: List[str] = None,
+                 encodings: List[str] = None,
+                 column_dtypes: Mapping[str, Any] = None,
+                 name_aliases: Mapping[str, Mapping[str, str]] = None,
+                 canonicalize_names: bool = False,
+                 plan_reads: bool = False):
         self._source_dir = source_dir
+        self._source = None
+        self._read_plans = None
         self.state = state
         self.columns = columns
         self.vote_columns = vote_columns
         self.df_transformers = df_transformers
         self.row_cleaners = row_cleaners
         self.excluded_files = excluded_files
+        self.encodings = encodings
+        self.column_dtypes = column_dtypes
+        self.name_aliases = name_aliases
+        self.canonicalize_names = canonicalize_names
+        self.plan_reads = plan_reads
 
     @property
     def source_dir(self):
         return self._source_dir
 
-    def set_source_dir(self, value: str):
+    @property
+    def source(self) -> FileSource:
+        if self._source is None:
+            self._source = as_file_source(self._source_dir)
+        return self._source
+
+    @property
+    def read_plans(self) -> ReadPlanCache:
+        """
+        The read plans for this state's files, shared by all of them so each distinct header is only planned once. Files
+        are only read with them if plan_reads is set.
+        """
+        if self._read_plans is None:
+            # The file path is kept, as it is without a plan, so rows can be traced back to their file
+            required_columns = self.columns + self.vote_columns + ['filepath'] if self.columns else None
+            self._read_plans = ReadPlanCache([VoteFile.clean_column_names] + (self.df_transformers or []),
+                                             required_columns,
+                                             self.column_dtypes)
+        return self._read_plans
+
+    def set_source_dir(self, value: Union[str, FileSource]):
         self._source_dir = value
+        self._source = None
 
 
 class StateDataFormat:
@@ -51,12 +103,23 @@ class StateDataFormat:
                  columns: List[str] = None,
                  vote_columns: List[str] = None,
                  df_transformers: List[Callable[[pd.DataFrame], pd.DataFrame]] = None,
-                 row_cleaners: List[Callable[[dict], None]] = None):
+                 row_cleaners: List[Callable[[dict], None]] = None,
+                 encodings: List[str] = None,
+                 column_dtypes: Mapping[str, Any] = None,
+                 name_aliases: Mapping[str, Mapping[str, str]] = None,
+                 plan_reads: bool = False):
         self.excluded_files = excluded_files
         self.columns = columns
         self.vote_columns = vote_columns
         self.df_transformers = df_transformers
         self.row_cleaners = row_cleaners
+        self.encodings = encodings
+        self.column_dtypes = column_dtypes
+        # Spellings of candidate, party, office and county names to canonicalize, keyed by column, see canonical.py
+        self.name_aliases = name_aliases
+        # Whether files are parsed straight into the shape the transformers give them, see read_plans.py. Only for
+        # states whose transformers rename, select, fill and add constant columns, whatever the data
+        self.plan_reads = plan_reads
 
 
 class VoteFile:
@@ -90,28 +153,217 @@ class VoteFile:
         self.year = year
         self.is_special = is_special
         self.excluded = excluded
+        # Set when the file is read
+        self.encoding = None
+        self.replaced_bytes = 0
 
         if state_metadata.df_transformers:
             self.df_transformers = [self.clean_column_names] + state_metadata.df_transformers
         else:
             self.df_transformers = [self.clean_column_names]
 
+    def open(self) -> BinaryIO:
+        """
+        Opens the underlying file through the state's FileSource, so it may live in a working tree, git object database
+        or archive.
+        :return:
+        """
+        return self.state_metadata.source.open(self.filepath)
+
+    def read_text(self) -> DecodedText:
+        """
+        Reads the file's bytes once and decodes them with the first of the state's encodings that works (see
+        decode_bytes). Records the encoding used and the number of bytes that had to be replaced.
+        :return:
+        """
+        with self.open() as f:
+            return self._decode(f.read())
+
+    def open_text(self) -> TextIO:
+        """
+        Opens the file as a text stream, decoded the way read_text would decode it, but without ever holding the whole
+        file in memory. Finding the encoding costs a pass over the file the first time, so this is for files too big for
+        read_text, after which the encoding recorded is used.
+        :return:
+        """
+        if self.encoding is None:
+            self._record_decoding(*detect_encoding(self.open, self.state_metadata.encodings))
+        return open_decoded(self.open(), self.encoding, self.replaced_bytes)
+
+    def _decode(self, raw: bytes) -> DecodedText:
+        decoded = decode_bytes(raw, self.state_metadata.encodings)
+        self._record_decoding(decoded.encoding, decoded.replaced_bytes)
+        return decoded
+
+    def _record_decoding(self, encoding: str, replaced_bytes: int):
+        self.encoding, self.replaced_bytes = encoding, replaced_bytes
+        if replaced_bytes:
+            logger.warning('Replaced %d undecodable bytes decoding %s as %s', replaced_bytes, self.filepath, encoding)
+        elif encoding != 'utf-8':
+            logger.debug('Decoded %s as %s', self.filepath, encoding)
+
+    def read_df(self) -> pd.DataFrame:
+        return pd.read_csv(io.StringIO(self.read_text().text))
+
     def to_enriched_df(self) -> pd.DataFrame:
-        logger.info('Parsing file {}'.format(self.filepath))
+        """
+        Parses the file straight into the shape the transformers would give it when the state plans reads and has a read
+        plan for the file's header, and otherwise parses the whole file and runs enrich.
+        Files bigger than CHUNKED_READ_BYTES are parsed with iter_enriched_dfs instead, so that only the result, and
+        not the file's text and every intermediate copy of it, has to fit in memory.
+        :return:
+        """
+        dfs = list(self.enriched_dfs())
+        return dfs[0] if len(dfs) == 1 else pd.concat(dfs) if dfs else pd.DataFrame()
+
+    def enriched_dfs(self) -> Iterator[pd.DataFrame]:
+        """
+        As to_enriched_df, but a file bigger than CHUNKED_READ_BYTES is yielded a chunk at a time as iter_enriched_dfs
+        parses it, rather than concatenated, so that readers can hand each chunk on as soon as it is ready and memory is
+        bounded by the chunk size. A smaller file is yielded whole. A parse error partway through a big file ends it
+        there, keeping the chunks already yielded.
+        :return:
+        """
+        logger.debug('Parsing file %s', self.filepath)
+        with self.open() as f:
+            raw = f.read(CHUNKED_READ_BYTES + 1)
+        if len(raw) <= CHUNKED_READ_BYTES:
+            yield self._parse_text(self._decode(raw).text)
+            return
+
+        del raw
+        logger.info('%s is over %d bytes, parsing it in chunks of %d rows',
+                    self.filepath, CHUNKED_READ_BYTES, CHUNK_ROWS)
+        chunks = 0
         try:
-            df = pd.read_csv(self.filepath)
-        except (pd.errors.ParserError, UnicodeDecodeError) as e:
+            for chunk in self.iter_enriched_dfs(CHUNK_ROWS):
+                chunks += 1
+                yield chunk
+        except pd.errors.ParserError as e:
+            logger.error('%s, after %d chunks of %s', e, chunks, self.filepath)
+
+    def _parse_text(self, text: str) -> pd.DataFrame:
+        try:
+            header = tuple(pd.read_csv(io.StringIO(text), nrows=0).columns)
+            read_plans = self.state_metadata.read_plans
+            read_plan = self._read_plan(header)
+            if read_plan is None:
+                return self.enrich(pd.read_csv(io.StringIO(text)))
+            # Every column is read, not just usecols, so that duplicates are of whole rows, as they are for enrich
+            df = pd.read_csv(io.StringIO(text), dtype=read_plan.dtypes)
+            planned = read_plan.apply(self._add_file_metadata(df.drop_duplicates(keep='first')))
+            if not read_plans.is_checked(header):
+                transformed = self.enrich(pd.read_csv(io.StringIO(text)))
+                if not read_plans.check(header, planned, transformed):
+                    return transformed
+        except pd.errors.ParserError as e:
             logger.error(str(e))
             return pd.DataFrame()
-        deduplicated = df.drop_duplicates(keep='first')
-        # Add some columns that we extracted from the filepath, and the filepath for debugging
-        enriched_df = deduplicated.assign(state=self.state_metadata.state.upper(),
-                                          year=self.year,
-                                          date=self.date,
-                                          election=self.election,
-                                          special=self.is_special,
-                                          filepath=self.filepath)
+        return planned
+
+    def iter_enriched_dfs(self, chunksize: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """
+        Parses the file chunksize rows at a time, yielding each chunk as soon as it has been through the read plan or
+        enrich, as to_enriched_df would have it. Memory use is bounded by the chunk size rather than the file size,
+        other than the 8 bytes kept per distinct row to drop duplicates across chunks (see RowHashes).
+
+        Each column is read with the dtype a whole file parse would infer for it, found by a first pass that only infers
+        them (see _infer_dtypes), rather than inferred per chunk. So transformers see the same values they would of the
+        whole file, and a row repeated in two chunks is parsed the same in both and dropped. The read plan's dtypes win
+        over inferred ones. A parse error raises once the chunks before it have been yielded.
+        :param chunksize:
+        :return:
+        """
+        with self.open_text() as f:
+            header, dtypes = _infer_dtypes(f, chunksize)
+        read_plan = self._read_plan(header)
+        if read_plan is not None and not self.state_metadata.read_plans.is_checked(header):
+            # Plans are checked on a whole file, which is more than is held here, so go without until one has been
+            read_plan = None
+        if read_plan is not None:
+            dtypes = {**dtypes, **(read_plan.dtypes or {})}
+
+        seen = RowHashes()
+        with self.open_text() as f:
+            for chunk in pd.read_csv(f, chunksize=chunksize, dtype=dtypes):
+                chunk = seen.drop_seen(chunk)
+                if read_plan is None:
+                    yield self._transform(self._add_file_metadata(chunk))
+                else:
+                    yield read_plan.apply(self._add_file_metadata(chunk))
+
+    def _read_plan(self, header: Tuple[str, ...]) -> Optional[ReadPlan]:
+        return self.state_metadata.read_plans.get(header) if self.state_metadata.plan_reads else None
+
+    def _open_preview_text(self) -> TextIO:
+        """
+        Opens the file as a text stream for head_df and sample_df, decoded with the encoding recorded when it was read,
+        or else one guessed from its first PREVIEW_ENCODING_BYTES bytes, rather than found by a pass over the whole
+        file. Bytes the guess cannot decode are replaced, and the guess is not recorded.
+        :return:
+        """
+        if self.encoding is not None:
+            return open_decoded(self.open(), self.encoding, self.replaced_bytes)
+        with self.open() as f:
+            prefix = f.read(PREVIEW_ENCODING_BYTES + 1)
+        encoding = guess_encoding(prefix[:PREVIEW_ENCODING_BYTES],
+                                  self.state_metadata.encodings,
+                                  len(prefix) <= PREVIEW_ENCODING_BYTES)
+        return open_decoded(self.open(), encoding, lenient=True)
+
+    def head_df(self, n: int) -> pd.DataFrame:
+        """
+        Parses only the first n rows of the file, and enriches them. The file is streamed, and its encoding guessed from
+        its start (see _open_preview_text), so only those rows are held in memory and the rest of the file is not read.
+        :param n:
+        :return:
+        """
+        try:
+            with self._open_preview_text() as f:
+                return self.enrich(pd.read_csv(f, nrows=n))
+        except pd.errors.EmptyDataError:
+            logger.warning('%s is empty', self.filepath)
+            return pd.DataFrame()
+        except pd.errors.ParserError as e:
+            logger.error(str(e))
+            return pd.DataFrame()
+
+    def sample_df(self, n: int, seed: int = 0, chunksize: int = SAMPLE_CHUNK_ROWS) -> pd.DataFrame:
+        """
+        Parses the file in chunks streamed as head_df streams it, keeping a reservoir of n rows chosen uniformly at
+        random, and enriches them. Only the reservoir and one chunk are ever held in memory, not the file's text. The
+        same seed always gives the same sample of a file.
+        :param n:
+        :param seed:
+        :param chunksize:
+        :return:
+        """
+        rng = np.random.default_rng([seed, zlib.crc32(self.filepath.encode('utf-8'))])
+        try:
+            # Each row gets a random key, and the reservoir is the n rows with the smallest keys so far
+            reservoir = None
+            with self._open_preview_text() as f:
+                # A file with only a header still gives one empty chunk
+                for chunk in pd.read_csv(f, chunksize=chunksize):
+                    chunk = chunk.assign(_sample_key=rng.random(len(chunk)))
+                    reservoir = pd.concat([reservoir, chunk]).nsmallest(n, '_sample_key')
+        except pd.errors.EmptyDataError:
+            logger.warning('%s is empty', self.filepath)
+            return pd.DataFrame()
+        except pd.errors.ParserError as e:
+            logger.error(str(e))
+            return pd.DataFrame()
+        return self.enrich(reservoir.sort_index().drop(columns='_sample_key'))
+
+    def enrich(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the metadata parsed from the file name to the raw DataFrame from read_df, and applies the transformers.
+        :param df:
+        :return:
+        """
+        return self._transform(self._add_file_metadata(df.drop_duplicates(keep='first')))
 
+    def _transform(self, enriched_df: pd.DataFrame) -> pd.DataFrame:
         temp = enriched_df.copy()
         if self.df_transformers:
             for transformer in self.df_transformers:
@@ -119,6 +371,72 @@ class VoteFile:
 
         return temp
 
+    def _add_file_metadata(self, df: pd.DataFrame) -> pd.DataFrame:
+        # Add some columns that we extracted from the filepath, and the filepath for debugging
+        return df.assign(state=self.state_metadata.state.upper(),
+                         year=self.year,
+                         date=self.date,
+                         election=self.election,
+                         special=self.is_special,
+                         filepath=self.filepath)
+
+
+def _infer_dtypes(f: TextIO, chunksize: int) -> Tuple[Tuple[str, ...], Mapping[str, Any]]:
+    """
+    Parses f chunksize rows at a time, returning its header and the dtype pandas would infer for each column parsing it
+    whole: integers if every chunk's are, floats if every chunk's are numbers, booleans if every chunk's are, and
+    otherwise text. Inference stops at a parse error, which the parse these dtypes are for raises at the same row.
+    """
+    header, dtypes = None, {}
+    try:
+        # A file with only a header still gives one empty chunk
+        for chunk in pd.read_csv(f, chunksize=chunksize):
+            header = header or tuple(chunk.columns)
+            for col, dtype in chunk.dtypes.items():
+                dtypes[col] = _combine_dtypes(dtypes[col], dtype) if col in dtypes else dtype
+    except pd.errors.ParserError:
+        pass
+    if header is None:
+        raise pd.errors.EmptyDataError('No columns to parse from file')
+    return header, {col: _read_dtype(dtype) for col, dtype in dtypes.items()}
+
+
+def _combine_dtypes(first: Any, second: Any) -> Any:
+    if first == second:
+        return first
+    numeric = [dtype for dtype in (first, second)
+               if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+    return np.dtype('float64') if len(numeric) == 2 else str
+
+
+def _read_dtype(dtype: Any) -> Any:
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return dtype
+    return np.dtype('float64') if pd.api.types.is_float_dtype(dtype) else str
+
+
+class RowHashes:
+    """
+    Remembers the rows seen so far in a file by a 64 bit hash of their values, kept in a sorted array, so that rows
+    repeated across chunks can be dropped at a cost of 8 bytes per distinct row rather than the row itself. Rows are
+    compared as parsed, so chunks must be parsed with the same dtypes, as iter_enriched_dfs does.
+    """
+    def __init__(self):
+        self._hashes = np.empty(0, dtype=np.uint64)
+
+    def drop_seen(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drops the rows of df that repeat an earlier row of df, or one from a DataFrame passed before, and remembers the
+        rest.
+        """
+        hashes = pd.util.hash_pandas_object(df, index=False).values
+        positions = np.searchsorted(self._hashes, hashes)
+        seen = positions < len(self._hashes)
+        seen[seen] = self._hashes[positions[seen]] == hashes[seen]
+        keep = ~seen & ~pd.Series(hashes).duplicated().values
+        self._hashes = np.sort(np.concatenate([self._hashes, hashes[keep]]))
+        return df.loc[keep]
+
 
 class PrecinctFile(VoteFile):
     pass
@@ -132,39 +450,250 @@ class OfficeFile(VoteFile):
     pass
 
 
+# Table data is handed from builders to writers as a DataFrame, builders that still return a list of dicts are adapted
+TableData = Union[pd.DataFrame, List[dict]]
 VoteFileBuilder = Callable[[int, str, str, 'StateMetadata', bool], 'VoteFile']
-TableDataBuilder = Callable[[pd.DataFrame, StateMetadata], List[dict]]
+TableDataBuilder = Callable[[pd.DataFrame, StateMetadata], TableData]
+# Readers return the file's DataFrame, an iterator of chunks of it, or None to skip it
+VoteFileReader = Callable[['VoteFile'], Union[None, pd.DataFrame, Iterator[pd.DataFrame]]]
+
+
+def as_table_df(table_data: TableData) -> pd.DataFrame:
+    """
+    Adapts table data from builders that return a list of dicts to the DataFrame the rest of the pipeline expects.
+    """
+    return table_data if isinstance(table_data, pd.DataFrame) else pd.DataFrame(table_data)
+
+
+def table_df_to_records(table_df: pd.DataFrame) -> List[dict]:
+    """
+    The reverse of as_table_df, for callers that still consume table data as a list of dicts.
+    """
+    return table_df.to_dict('records')
+
+
+def apply_row_cleaners(df: pd.DataFrame,
+                       row_cleaners: List[Callable[[dict], None]],
+                       columns: List[str]) -> pd.DataFrame:
+    """
+    Row cleaners mutate a dict representing a row. Rather than building a dict for every row, they are run once on each
+    distinct combination of values in columns, the only columns they may read or write, and the cleaned values are
+    mapped back onto the DataFrame. A cleaner that reads any other column raises a KeyError, in which case we fall back
+    to running the cleaners on every row.
+    :param df:
+    :param row_cleaners:
+    :param columns:
+    :return:
+    """
+    columns = [col for col in columns if col in df.columns]
+    if not row_cleaners or df.empty:
+        return df
+
+    distinct = df[columns].drop_duplicates()
+    cleaned = distinct.to_dict('records')
+    try:
+        for dic in cleaned:
+            for row_cleaner in row_cleaners:
+                row_cleaner(dic)
+    except KeyError:
+        records = table_df_to_records(df)
+        for dic in records:
+            for row_cleaner in row_cleaners:
+                row_cleaner(dic)
+        return pd.DataFrame(records, index=df.index, columns=df.columns)
+
+    result = df.copy()
+    if len(columns) == 1:
+        col = columns[0]
+        # Mapping through a Series index, unlike a dict, matches missing values
+        result[col] = df[col].map(pd.Series([dic[col] for dic in cleaned], index=distinct[col].values, dtype=object))
+    else:
+        codes = df.groupby(columns, dropna=False, sort=False).ngroup()
+        distinct_codes = codes.loc[distinct.index].values
+        for col in columns:
+            mapping = pd.Series([dic[col] for dic in cleaned], index=distinct_codes, dtype=object)
+            result[col] = codes.map(mapping)
+    return result
 
 
 def files_to_table_data(state_metadata: StateMetadata,
                         vote_file_builder: VoteFileBuilder,
-                        table_data_builder: TableDataBuilder) -> List[dict]:
+                        table_data_builder: TableDataBuilder,
+                        vote_file_reader: VoteFileReader = None,
+                        scheduler: WorkScheduler = None,
+                        pks: List[str] = None) -> pd.DataFrame:
     """
     Uses state_metadata instance to map a collection of files to VoteFile objects that can be parsed into voting data.
     The vote_file_builder specifies how to map the file paths, combined with metadata, to VoteFile instances. The
-    table_data_builder specifies how to take the DataFrame produced by VoteFile instance and turn it into a dict
-    that can be written to Dolt.
+    table_data_builder specifies how to take the DataFrame produced by VoteFile instance and turn it into the table
+    data that is written to Dolt, as a DataFrame, or a list of dicts that as_table_df adapts.
+
+    The table data builder is applied to each file, or each chunk of a file parsed in chunks, as it is read, so that
+    only the table data, and not every file's raw rows at once, is held in memory. With a scheduler, each worker builds
+    the table data of the files it reads, so only the table data is sent back, and it is concatenated in the order of
+    the files, as it is without one.
     :param state_metadata:
     :param vote_file_builder:
     :param table_data_builder:
+    :param vote_file_reader: produces the enriched DataFrame, or chunks of it, for a VoteFile, defaults to
+        VoteFile.enriched_dfs
+    :param scheduler: if given, files are parsed, and their table data built, across its workers, largest first
+    :param pks: if given, rows repeating the primary key of a row from an earlier file or chunk are dropped, as the
+        table data builder drops them within one
     :return:
     """
+    # Name canonicalization waits for every file, so the canonical forms are chosen from all of the state's rows
+    vote_file_reader = vote_file_reader or VoteFile.enriched_dfs
     vote_file_objs = build_file_objects(state_metadata, vote_file_builder)
-    raw_voting_data = pd.concat([vote_file_obj.to_enriched_df() for vote_file_obj in vote_file_objs
-                                 if not vote_file_obj.excluded])
-    table_data = table_data_builder(raw_voting_data, state_metadata)
+    if scheduler is not None:
+        vote_file_objs = [vote_file_obj for vote_file_obj in vote_file_objs if not vote_file_obj.excluded]
+        built = dict(scheduler.map_as_completed(PARSE_STAGE,
+                                                functools.partial(_build_table_data,
+                                                                  vote_file_reader,
+                                                                  table_data_builder,
+                                                                  state_metadata),
+                                                vote_file_objs,
+                                                state_metadata.source,
+                                                [vote_file_obj.filepath for vote_file_obj in vote_file_objs],
+                                                state_metadata.state))
+        # In the order of the files, so the rows kept of those repeating a primary key do not depend on timing
+        table_data = pd.concat([built.pop(i) for i in sorted(built)])
+    else:
+        table_data = pd.concat([as_table_df(table_data_builder(raw_voting_data, state_metadata))
+                                for raw_voting_data in read_vote_files(state_metadata,
+                                                                       vote_file_objs,
+                                                                       vote_file_reader)])
+    if state_metadata.canonicalize_names:
+        table_data = canonicalize_names(table_data, state_metadata.name_aliases)
+    if pks:
+        deduplicated = table_data.drop_duplicates(subset=pks)
+        if len(deduplicated) < len(table_data):
+            logger.warning('Dropped %d rows of state %s repeating the primary key of a row from another file',
+                           len(table_data) - len(deduplicated), state_metadata.state)
+        table_data = deduplicated
     return table_data
 
 
 def files_to_df(state_metadata: StateMetadata, vote_file_builder: VoteFileBuilder) -> pd.DataFrame:
     """
-    Utility function for getting DataFrames for files in a state, useful for debugging.
+    Utility function for getting DataFrames for files in a state, useful for debugging. This parses every file, use
+    preview_files for a quick look at a large state.
     :param state_metadata:
     :param vote_file_builder:
     :return:
     """
     vote_file_objs = build_file_objects(state_metadata, vote_file_builder)
-    return pd.concat([vote_file_obj.to_enriched_df() for vote_file_obj in vote_file_objs])
+    return pd.concat(read_vote_files(state_metadata, vote_file_objs, VoteFile.to_enriched_df, include_excluded=True))
+
+
+def preview_files(state_metadata: StateMetadata,
+                  vote_file_builder: VoteFileBuilder,
+                  include_excluded: bool = True) -> 'StatePreview':
+    """
+    Returns a lazy view over the files of a state, for exploring it without parsing every file.
+    """
+    return StatePreview(state_metadata, vote_file_builder, include_excluded)
+
+
+class StatePreview:
+    """
+    A lazy view over the VoteFiles of a state. Nothing is parsed until asked for: iterating yields one file's enriched
+    DataFrame at a time, head and sample read a few rows from each file, and max_rows stops reading files once enough
+    rows have been collected. For example, in a notebook:
+        >>> preview = preview_files(state_metadata, filepath_to_precinct_file)
+        >>> preview.sample(10, max_rows=5000)
+    """
+    def __init__(self,
+                 state_metadata: StateMetadata,
+                 vote_file_builder: VoteFileBuilder,
+                 include_excluded: bool = True):
+        self.state_metadata = state_metadata
+        self.vote_file_builder = vote_file_builder
+        self.include_excluded = include_excluded
+        self._vote_files = None
+
+    @property
+    def vote_files(self) -> List[VoteFile]:
+        """
+        The files of the state, listed but not parsed.
+        """
+        if self._vote_files is None:
+            vote_files = build_file_objects(self.state_metadata, self.vote_file_builder)
+            self._vote_files = [vote_file for vote_file in vote_files
+                                if self.include_excluded or not vote_file.excluded]
+        return self._vote_files
+
+    def __len__(self):
+        return len(self.vote_files)
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        for vote_file in self.vote_files:
+            yield vote_file.to_enriched_df()
+
+    def head(self, n: int = PREVIEW_ROWS, max_rows: int = None) -> pd.DataFrame:
+        """
+        The first n rows of each file, stopping once max_rows rows have been read.
+        """
+        return self._collect(lambda vote_file: vote_file.head_df(n), max_rows)
+
+    def sample(self, n: int = PREVIEW_ROWS, max_rows: int = None, seed: int = 0) -> pd.DataFrame:
+        """
+        A uniform random sample of n rows from each file, stopping once max_rows rows have been read.
+        """
+        return self._collect(lambda vote_file: vote_file.sample_df(n, seed), max_rows)
+
+    def _collect(self, read: VoteFileReader, max_rows: Optional[int]) -> pd.DataFrame:
+        dfs, rows = [], 0
+        for vote_file in self.vote_files:
+            if max_rows is not None and rows >= max_rows:
+                logger.info('Read %d rows from %d of %d files, stopping', rows, len(dfs), len(self.vote_files))
+                break
+            df = read(vote_file)
+            dfs.append(df)
+            rows += len(df)
+        if not dfs:
+            return pd.DataFrame()
+        result = pd.concat(dfs, ignore_index=True)
+        return result if max_rows is None else result.iloc[:max_rows]
+
+
+def read_vote_files(state_metadata: StateMetadata,
+                    vote_file_objs: Iterable[VoteFile],
+                    vote_file_reader: VoteFileReader,
+                    include_excluded: bool = False) -> Iterator[pd.DataFrame]:
+    """
+    Reads each of vote_file_objs with vote_file_reader, yielding the DataFrames it returns as they are read, and
+    logging progress periodically rather than once per file. Readers may return None for a file they skip, such as one
+    in quarantine, or an iterator of DataFrames, such as VoteFile.enriched_dfs, whose chunks are yielded one by one.
+    :param state_metadata:
+    :param vote_file_objs:
+    :param vote_file_reader:
+    :param include_excluded:
+    :return:
+    """
+    progress = ProgressLog(logger, 'Parsed files for state {}'.format(state_metadata.state))
+    for vote_file_obj in vote_file_objs:
+        if include_excluded or not vote_file_obj.excluded:
+            result = vote_file_reader(vote_file_obj)
+            if isinstance(result, pd.DataFrame):
+                yield result
+            elif result is not None:
+                yield from result
+            progress.update(vote_file_obj.filepath)
+    progress.done()
+
+
+def _build_table_data(vote_file_reader: VoteFileReader,
+                      table_data_builder: TableDataBuilder,
+                      state_metadata: StateMetadata,
+                      vote_file: VoteFile) -> Optional[pd.DataFrame]:
+    # Run by scheduler workers, which build each chunk's table data as it is read and send back only the table data
+    result = vote_file_reader(vote_file)
+    if result is None:
+        return None
+    chunks = [result] if isinstance(result, pd.DataFrame) else result
+    table_dfs = [as_table_df(table_data_builder(chunk, state_metadata)) for chunk in chunks]
+    return pd.concat(table_dfs) if table_dfs else None
 
 
 def build_file_objects(state_metadata: StateMetadata, vote_file_builder: VoteFileBuilder) -> Iterable[VoteFile]:
@@ -175,26 +704,33 @@ def build_file_objects(state_metadata: StateMetadata, vote_file_builder: VoteFil
     :param vote_file_builder:
     :return:
     """
-    files = gather_files(state_metadata.source_dir)
+    files = gather_files(state_metadata.source)
 
     logger.info(
         'Parsing filenames and extracting election metadata to combine with state metadata to build VoteFile instances'
     )
     for year, dirpath, filename in files:
-        result = vote_file_builder(year, dirpath, filename, state_metadata, filename in state_metadata.excluded_files)
+        excluded = strip_compression_suffix(filename) in state_metadata.excluded_files
+        result = vote_file_builder(year, dirpath, filename, state_metadata, excluded)
         if result:
             yield result
 
 
-def gather_files(base_dir: str) -> List[Tuple[int, str, str]]:
-    logger.info('Collecting voting data files from base directory {}'.format(base_dir))
-    year_dirs = [(os.path.join(base_dir, subdir), subdir)
-                 for subdir in os.listdir(base_dir) if re.match(r'\d\d\d\d', subdir)]
+def gather_files(base_dir: Union[str, FileSource]) -> List[Tuple[int, str, str]]:
+    """
+    Yields (year, dirpath, filename) for every CSV, optionally gzipped, under a top level year directory of base_dir.
+    base_dir may be a path to a directory or archive, or any FileSource.
+    :param base_dir:
+    :return:
+    """
+    source = as_file_source(base_dir)
+    logger.info('Collecting voting data files from source {}'.format(source))
 
-    for year_dir, year in year_dirs:
-        for dirpath, _, filenames in os.walk(year_dir):
+    for dirpath, filenames in source.walk():
+        year = source.relpath(dirpath).split('/')[0]
+        if re.match(r'\d\d\d\d', year):
             for filename in filenames:
-                if filename.endswith('csv'):
+                if strip_compression_suffix(filename).endswith('csv'):
                     try:
                         yield int(year), dirpath, filename
                     except ValueError:
@@ -0,0 +1,201 @@
+import fcntl
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from open_elections.tools.sources import FileSource
+from open_elections.tools.logging_helper import get_logger, paused_logging, ProgressLog
+
+logger = get_logger(__name__)
+
+DEFAULT_COST_MODEL_PATH = os.path.join(os.path.expanduser('~'), '.open_elections', 'costs.json')
+# Assumed for a stage none of whose files have been timed yet, about what parsing and cleaning a precinct file costs
+DEFAULT_SECONDS_PER_BYTE = 1e-7
+
+# The stages timed by the cost model, validation is timed separately for each level since their costs differ so much
+PARSE_STAGE = 'parse'
+LOAD_STATE_STAGE = 'load_state'
+
+
+def validate_stage(level: int) -> str:
+    return 'validate_{}'.format(level)
+
+
+class CostModel:
+    """
+    Estimates how long a stage of the pipeline, such as parsing a file for a load, takes on each file it runs on:
+        - a file timed by a previous run is expected to take as long again if it is unchanged, and proportionally
+          longer or shorter if it has changed size since
+        - any other file is expected to take its size times the median seconds per byte of the files timed for the
+          stage, or DEFAULT_SECONDS_PER_BYTE before any have been
+    Timings are kept in a JSON file keyed by stage, and written back after each run, so the estimates improve as the
+    corpus is processed.
+    """
+    def __init__(self, path: str = DEFAULT_COST_MODEL_PATH):
+        self.path = path
+        self._costs = {}
+        self._recorded = {}
+        self._rates = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._costs = json.load(f)
+
+    def estimate(self, stage: str, key: str, size: Optional[int] = None, fingerprint: str = None) -> Optional[float]:
+        """
+        The expected seconds stage takes on key, or None if it has never been timed and its size is unknown.
+        """
+        recorded = self._costs.get(stage, {}).get(key)
+        if recorded is not None:
+            if recorded['fingerprint'] == fingerprint or not size or not recorded['bytes']:
+                return recorded['seconds']
+            return recorded['seconds'] * size / recorded['bytes']
+        return size * self.seconds_per_byte(stage) if size is not None else None
+
+    def seconds_per_byte(self, stage: str) -> float:
+        if stage not in self._rates:
+            rates = [cost['seconds'] / cost['bytes'] for cost in self._costs.get(stage, {}).values() if cost['bytes']]
+            self._rates[stage] = float(np.median(rates)) if rates else DEFAULT_SECONDS_PER_BYTE
+        return self._rates[stage]
+
+    def record(self, stage: str, key: str, seconds: float, size: Optional[int] = None, fingerprint: str = None):
+        cost = dict(seconds=seconds, bytes=size, fingerprint=fingerprint)
+        self._costs.setdefault(stage, {})[key] = cost
+        self._recorded.setdefault(stage, {})[key] = cost
+        self._rates.pop(stage, None)
+
+    def save(self):
+        """
+        Writes the timings recorded since the model was loaded back to its file, on top of whatever other runs have
+        written there in the meantime. Runs saving at once take turns, and the file is replaced atomically, so a run
+        starting concurrently never reads half of it.
+        """
+        if not self._recorded:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open('{}.lock'.format(self.path), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            costs = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    costs = json.load(f)
+            for stage, recorded in self._recorded.items():
+                costs.setdefault(stage, {}).update(recorded)
+
+            temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(temp_path, 'w') as f:
+                json.dump(costs, f)
+            os.replace(temp_path, self.path)
+        self._recorded = {}
+
+
+class WorkScheduler:
+    """
+    Runs a stage over the files of a state across worker processes, dispatching the files the cost model expects to
+    take longest first, so that a giant statewide file is never left to start last while the other workers sit idle.
+    Workers take the next file from a single shared queue as soon as they finish one, so a worker that drew quick
+    files keeps taking work that would otherwise have waited on a busy one. Every file is timed, and the timings are
+    recorded in the cost model for the next run.
+
+    Workers are forked, so the function run and the items it runs on are inherited rather than pickled, and need not
+    be picklable, only what run returns is sent back. With a single worker, files are run in process in their given
+    order, and are still timed.
+    """
+    def __init__(self, workers: int = 1, cost_model: CostModel = None):
+        self.workers = workers
+        self.cost_model = cost_model or CostModel()
+
+    def map(self,
+            stage: str,
+            run: Callable[[Any], Any],
+            items: Sequence[Any],
+            source: FileSource,
+            paths: List[str],
+            state: str) -> List[Any]:
+        """
+        Returns run(item) for each of items, in the order given.
+        :param stage: what run does, the cost model keeps timings for each stage separately
+        :param run:
+        :param items:
+        :param source:
+        :param paths: paths[i] is the path within source of the file items[i] is for
+        :param state:
+        :return:
+        """
+        results = [None] * len(items)
+        for i, result in self.map_as_completed(stage, run, items, source, paths, state):
+            results[i] = result
+        return results
+
+    def map_as_completed(self,
+                         stage: str,
+                         run: Callable[[Any], Any],
+                         items: Sequence[Any],
+                         source: FileSource,
+                         paths: List[str],
+                         state: str) -> Iterator[Tuple[int, Any]]:
+        """
+        As map, but yields i and run(items[i]) as each finishes, so a caller can be done with each result before the
+        next arrives, rather than holding them all.
+        """
+        keys = ['{}/{}'.format(state.lower(), source.relpath(path)) for path in paths]
+        sizes = [source.size(path) for path in paths]
+        fingerprints = [source.fingerprint(path) for path in paths]
+        order = list(range(len(items)))
+        if self.workers > 1:
+            order.sort(key=lambda i: self.cost_model.estimate(stage, keys[i], sizes[i], fingerprints[i]), reverse=True)
+            logger.info('Running {} on {} files of state {} with {} workers, largest first'.format(
+                stage, len(items), state, self.workers
+            ))
+
+        progress = ProgressLog(logger, 'Ran {} on files of state {}'.format(stage, state))
+        try:
+            for i, result, seconds in self._run(run, items, order):
+                self.cost_model.record(stage, keys[i], seconds, sizes[i], fingerprints[i])
+                progress.update(paths[i])
+                yield i, result
+        finally:
+            progress.done()
+            self.cost_model.save()
+
+    def _run(self,
+             run: Callable[[Any], Any],
+             items: Sequence[Any],
+             order: List[int]) -> Iterator[Tuple[int, Any, float]]:
+        if self.workers <= 1:
+            for i in order:
+                start = time.monotonic()
+                result = run(items[i])
+                yield i, result, time.monotonic() - start
+            return
+
+        global _forked
+        _forked = (run, items)
+        executor = None
+        try:
+            # Forked workers are all started by the first submit
+            with paused_logging():
+                executor = ProcessPoolExecutor(max_workers=self.workers,
+                                               mp_context=multiprocessing.get_context('fork'))
+                # Work is handed out in the order it is submitted
+                futures = {executor.submit(_run_forked, i): i for i in order}
+            for future in as_completed(futures):
+                result, seconds = future.result()
+                yield futures[future], result, seconds
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            _forked = None
+
+
+# What forked workers run, set by WorkScheduler before the workers are forked
+_forked = None
+
+
+def _run_forked(i: int) -> Tuple[Any, float]:
+    run, items = _forked
+    start = time.monotonic()
+    result = run(items[i])
+    return result, time.monotonic() - start
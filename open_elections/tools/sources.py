@@ -0,0 +1,326 @@
+import gzip
+import io
+import os
+import subprocess
+import threading
+import zipfile
+from typing import BinaryIO, Iterable, List, Mapping, Optional, Tuple, Union
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+COMPRESSION_SUFFIXES = ('.gz',)
+# Blobs bigger than this are streamed from a git cat-file process of their own, rather than read into memory whole
+STREAM_BLOB_BYTES = 16 * 1024 * 1024
+
+
+class FileSource:
+    """
+    A FileSource abstracts over where Open Elections data files live. Paths handed out by walk are always of the form
+    os.path.join(root, <path relative to the repository>), so that file names, and the metadata we parse from them,
+    look the same regardless of whether they come from a working tree, a git object database, or an archive. Passing
+    one of those paths back to open returns a binary file object with the (decompressed) file contents.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def walk(self) -> Iterable[Tuple[str, List[str]]]:
+        raise NotImplementedError()
+
+    def open(self, path: str) -> BinaryIO:
+        raise NotImplementedError()
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError()
+
+    def fingerprint(self, path: str) -> str:
+        """
+        Returns a cheap identifier for the current contents of path, that changes whenever the contents do.
+        """
+        raise NotImplementedError()
+
+    def size(self, path: str) -> int:
+        """
+        Returns the size of path in bytes as stored, which for a gzipped file in a directory is its compressed size.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.root)
+
+
+class LocalDirectorySource(FileSource):
+    """
+    A checked out working tree, or any directory of files, on local disk. This is the behaviour we have always had.
+    """
+    def walk(self) -> Iterable[Tuple[str, List[str]]]:
+        # Sorted, so that runs over the same tree see files in the same order
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            yield dirpath, sorted(filenames)
+
+    def open(self, path: str) -> BinaryIO:
+        return _maybe_decompress(path, open(path, 'rb'))
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def fingerprint(self, path: str) -> str:
+        stat = os.stat(path)
+        return '{}-{}'.format(stat.st_size, stat.st_mtime_ns)
+
+    def size(self, path: str) -> int:
+        return os.path.getsize(path)
+
+
+class GitObjectSource(FileSource):
+    """
+    Reads files straight out of a git object database at a given commit, without a working tree. The tree is listed
+    once with git ls-tree, and blobs are streamed through a single long lived git cat-file --batch process, so reading
+    thousands of files costs one process spawn rather than one per file. Blobs bigger than STREAM_BLOB_BYTES are the
+    exception, each is streamed from a cat-file process of its own, so that it never has to be held in memory whole.
+    A process forked from one reading a source starts its own cat-file process rather than sharing the parent's pipes.
+    """
+    def __init__(self, repo_dir: str, commit: str = 'HEAD'):
+        super().__init__(repo_dir)
+        self.commit = commit
+        self._git_dir = _resolve_git_dir(repo_dir)
+        self._blobs = None
+        self._sizes = None
+        self._cat_file = None
+        self._cat_file_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def blobs(self) -> Mapping[str, str]:
+        if self._blobs is None:
+            self._blobs, self._sizes = self._list_tree()
+        return self._blobs
+
+    def _list_tree(self) -> Tuple[Mapping[str, str], Mapping[str, int]]:
+        logger.info('Listing tree of {} at commit {}'.format(self._git_dir, self.commit))
+        output = subprocess.run(['git', '--git-dir', self._git_dir, 'ls-tree', '-r', '-l', '-z', self.commit],
+                                check=True,
+                                stdout=subprocess.PIPE).stdout
+        blobs, sizes = {}, {}
+        for entry in output.split(b'\0'):
+            if not entry:
+                continue
+            meta, path = entry.split(b'\t', 1)
+            # The size is padded with spaces, and is '-' for anything other than a blob
+            _, object_type, sha, size = meta.split()
+            if object_type == b'blob':
+                blobs[path.decode('utf-8')] = sha.decode('ascii')
+                sizes[path.decode('utf-8')] = int(size)
+
+        return blobs, sizes
+
+    def walk(self) -> Iterable[Tuple[str, List[str]]]:
+        by_dir = {}
+        for path in self.blobs:
+            dirname, filename = os.path.split(path)
+            by_dir.setdefault(dirname, []).append(filename)
+
+        for dirname in sorted(by_dir):
+            yield os.path.join(self.root, dirname) if dirname else self.root, by_dir[dirname]
+
+    def open(self, path: str) -> BinaryIO:
+        relpath = self.relpath(path)
+        if relpath not in self.blobs:
+            raise FileNotFoundError('No file {} in {} at commit {}'.format(relpath, self._git_dir, self.commit))
+        if self.size(path) > STREAM_BLOB_BYTES:
+            return _maybe_decompress(path, self.stream_blob(self.blobs[relpath]))
+        return _maybe_decompress(path, io.BytesIO(self.read_blob(self.blobs[relpath])))
+
+    def exists(self, path: str) -> bool:
+        return self.relpath(path) in self.blobs
+
+    def fingerprint(self, path: str) -> str:
+        return self.blobs[self.relpath(path)]
+
+    def size(self, path: str) -> int:
+        if self._sizes is None:
+            self._blobs, self._sizes = self._list_tree()
+        return self._sizes[self.relpath(path)]
+
+    def read_blob(self, sha: str) -> bytes:
+        if self._cat_file_pid is not None and self._cat_file_pid != os.getpid():
+            # Forked, as by FileWatchdog, possibly while another of the parent's threads held the lock, so the child
+            # takes a fresh lock and starts its own cat-file process rather than writing to the parent's pipes
+            self._lock = threading.Lock()
+            self._cat_file, self._cat_file_pid = None, None
+        with self._lock:
+            if self._cat_file is None or self._cat_file.poll() is not None:
+                self._cat_file = subprocess.Popen(['git', '--git-dir', self._git_dir, 'cat-file', '--batch'],
+                                                  stdin=subprocess.PIPE,
+                                                  stdout=subprocess.PIPE)
+                self._cat_file_pid = os.getpid()
+            self._cat_file.stdin.write('{}\n'.format(sha).encode('ascii'))
+            self._cat_file.stdin.flush()
+            header = self._cat_file.stdout.readline().decode('ascii').split()
+            if len(header) != 3:
+                raise ValueError('git cat-file could not read object {}: {}'.format(sha, ' '.join(header)))
+            size = int(header[2])
+            content = self._cat_file.stdout.read(size)
+            # Each object is followed by a trailing newline
+            self._cat_file.stdout.read(1)
+            return content
+
+    def stream_blob(self, sha: str) -> BinaryIO:
+        """
+        Opens a blob as a stream read from a git cat-file process started for it, which is ended when the stream is
+        closed.
+        """
+        process = subprocess.Popen(['git', '--git-dir', self._git_dir, 'cat-file', 'blob', sha],
+                                   stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE)
+        return io.BufferedReader(_ProcessOutput(process, 'git cat-file could not read object {}'.format(sha)))
+
+    def close(self):
+        with self._lock:
+            if self._cat_file is not None and self._cat_file_pid == os.getpid():
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file.stdout.close()
+                self._cat_file = None
+
+
+class ZipArchiveSource(FileSource):
+    """
+    Reads files out of a zip bundle of a state repository. Members may themselves be gzipped. A process forked from one
+    reading a source reopens the archive, since the two would otherwise share a file offset.
+    """
+    def __init__(self, archive_path: str):
+        super().__init__(archive_path)
+        self._archive = zipfile.ZipFile(archive_path)
+        self._archive_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @property
+    def archive(self) -> zipfile.ZipFile:
+        if self._archive_pid != os.getpid():
+            self._archive = zipfile.ZipFile(self.root)
+            self._archive_pid = os.getpid()
+        return self._archive
+
+    def walk(self) -> Iterable[Tuple[str, List[str]]]:
+        by_dir = {}
+        for name in self.archive.namelist():
+            if name.endswith('/'):
+                continue
+            dirname, filename = os.path.split(name)
+            by_dir.setdefault(dirname, []).append(filename)
+
+        for dirname in sorted(by_dir):
+            yield os.path.join(self.root, dirname) if dirname else self.root, by_dir[dirname]
+
+    def open(self, path: str) -> BinaryIO:
+        # Members are decompressed as they are read, and reads of members open at once are safe, but opening one is not
+        with self._lock:
+            member = self.archive.open(self.relpath(path))
+        return _maybe_decompress(path, member)
+
+    def exists(self, path: str) -> bool:
+        try:
+            self.archive.getinfo(self.relpath(path))
+            return True
+        except KeyError:
+            return False
+
+    def fingerprint(self, path: str) -> str:
+        info = self.archive.getinfo(self.relpath(path))
+        return '{}-{:08x}'.format(info.file_size, info.CRC)
+
+    def size(self, path: str) -> int:
+        return self.archive.getinfo(self.relpath(path)).file_size
+
+    def close(self):
+        self._archive.close()
+
+
+def build_file_source(path: str, commit: Optional[str] = None) -> FileSource:
+    """
+    Picks the right kind of FileSource for path: a zip bundle, a git repository read at commit, or a plain directory.
+    :param path:
+    :param commit: if specified the path must be a git repository (bare or not), and files are read at this commit
+    :return:
+    """
+    if path.endswith('.zip'):
+        return ZipArchiveSource(path)
+    elif commit is not None:
+        return GitObjectSource(path, commit)
+    else:
+        return LocalDirectorySource(path)
+
+
+def as_file_source(source_or_dir: Union[str, FileSource]) -> FileSource:
+    if isinstance(source_or_dir, FileSource):
+        return source_or_dir
+    return build_file_source(source_or_dir)
+
+
+def strip_compression_suffix(filename: str) -> str:
+    for suffix in COMPRESSION_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+class _ProcessOutput(io.RawIOBase):
+    """
+    The standard output of a process as a stream, which raises an OSError if the process fails rather than just
+    ending, and waits for the process when closed.
+    """
+    def __init__(self, process: subprocess.Popen, error: str):
+        self._process = process
+        self._error = error
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self._process.stdout.readinto(buffer)
+        if not n and self._process.wait() != 0:
+            raise OSError('{}, exit code {}'.format(self._error, self._process.returncode))
+        return n
+
+    def close(self):
+        if not self.closed:
+            # A process still writing gets a broken pipe, and exits
+            self._process.stdout.close()
+            self._process.wait()
+        super().close()
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    # GzipFile leaves a file object it is given open, which for us would leak the file, member or process under it
+    def close(self):
+        fileobj = self.fileobj
+        try:
+            super().close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+
+def _maybe_decompress(path: str, fileobj: BinaryIO) -> BinaryIO:
+    if path.endswith('.gz'):
+        return _ClosingGzipFile(fileobj=fileobj, mode='rb')
+    return fileobj
+
+
+def _resolve_git_dir(repo_dir: str) -> str:
+    dot_git = os.path.join(repo_dir, '.git')
+    return dot_git if os.path.isdir(dot_git) else repo_dir
@@ -0,0 +1,212 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Union, Any, Optional
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+META_FILENAME = 'meta.json'
+# Code given to missing values in columns of codes, which decode to None
+NULL_CODE = -1
+
+# The order of INDEXED_COLUMNS is also the physical sort order of the rows, so a query on state, or state and year,
+# reads one contiguous slice of every column file.
+INDEXED_COLUMNS = ['state', 'year', 'office', 'county', 'candidate']
+# Columns that are stored as numbers, whatever type they arrive as, values that are not numbers being stored as missing
+NUMERIC_COLUMNS = ['votes']
+
+
+class VotingDataStore:
+    """
+    A read only, columnar store of cleaned voting data on local disk. Each column is a numpy file that is memory mapped
+    on first use, so opening a store only reads a small metadata file, and processes on the same host share the pages
+    through the OS page cache.
+
+    Columns of strings are stored as integer codes into a sorted array of their distinct values, which is itself a
+    numpy file loaded on first use, with NULL_CODE for missing values. Every column in INDEXED_COLUMNS also has an
+    inverted index: a permutation of row numbers ordered by code, along with the offsets at
+    which each code starts. A point or range lookup on an indexed column is then a slice of that permutation, and only
+    the rows in it are read from the other column files.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILENAME)) as f:
+            self._meta = json.load(f)
+        self._arrays = {}
+
+    @classmethod
+    def build(cls,
+              path: str,
+              data: Union[pd.DataFrame, List[dict]],
+              numeric_columns: List[str] = None) -> 'VotingDataStore':
+        """
+        Writes data to a new store at path, replacing any store already there.
+        :param path:
+        :param data:
+        :param numeric_columns: columns to store as numbers, by default NUMERIC_COLUMNS
+        :return:
+        """
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        missing = [col for col in INDEXED_COLUMNS if col not in df.columns]
+        assert not missing, 'Data must contain indexed columns {}'.format(missing)
+        os.makedirs(path, exist_ok=True)
+        logger.info('Building voting data store at {} from {} rows'.format(path, len(df)))
+
+        numeric_columns = NUMERIC_COLUMNS if numeric_columns is None else numeric_columns
+        encoded, categories = {}, {}
+        for col in df.columns:
+            values = df[col]
+            if col in numeric_columns and not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values.astype(str).str.replace(',', '', regex=False).where(values.notna()),
+                                       errors='coerce')
+            if col in INDEXED_COLUMNS or not (pd.api.types.is_numeric_dtype(values) or
+                                              pd.api.types.is_datetime64_any_dtype(values)):
+                # Indexed numeric columns (year) keep their values as categories, so range lookups compare numbers
+                if not pd.api.types.is_numeric_dtype(values):
+                    values = values.astype(object).where(values.isna(), values.astype(str))
+                codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=True)
+                encoded[col] = codes.astype('int32')
+                categories[col] = np.asarray(uniques.tolist(), dtype=None if len(uniques) else str)
+            elif pd.api.types.is_datetime64_any_dtype(values):
+                encoded[col] = values.values.astype('datetime64[ns]')
+            elif pd.api.types.is_bool_dtype(values):
+                encoded[col] = values.values.astype(bool)
+            else:
+                encoded[col] = values.values.astype('float64' if values.isna().any() else values.dtype)
+
+        order = np.lexsort([encoded[col] for col in reversed(INDEXED_COLUMNS)])
+
+        dtypes = {}
+        for col, values in encoded.items():
+            np.save(_column_path(path, col), values[order])
+            dtypes[col] = str(values.dtype)
+
+        for col in INDEXED_COLUMNS:
+            codes = encoded[col][order]
+            postings = np.argsort(codes, kind='stable').astype('int64')
+            offsets = np.searchsorted(codes[postings], np.arange(len(categories[col]) + 1))
+            np.save(_column_path(path, col, 'postings'), postings)
+            np.save(_column_path(path, col, 'offsets'), offsets.astype('int64'))
+
+        for col, uniques in categories.items():
+            np.save(_column_path(path, col, 'categories'), uniques)
+
+        with open(os.path.join(path, META_FILENAME), 'w') as f:
+            json.dump(dict(rows=len(df), columns=list(encoded), dtypes=dtypes, categorical=list(categories)), f)
+
+        return cls(path)
+
+    def __len__(self):
+        return self._meta['rows']
+
+    @property
+    def columns(self) -> List[str]:
+        return self._meta['columns']
+
+    def categories(self, col: str) -> np.ndarray:
+        key = (col, 'categories')
+        if key not in self._arrays:
+            self._arrays[key] = np.load(_column_path(self.path, col, 'categories'))
+        return self._arrays[key]
+
+    def query(self, columns: List[str] = None, **criteria: Any) -> pd.DataFrame:
+        """
+        Returns the rows matching all criteria as a DataFrame. Criteria are keyed by column, and each value is either a
+        single value, a list of values, or for range lookups a (low, high) tuple, inclusive at both ends. For example
+            store.query(candidate='Jane Doe', year=(2012, 2016))
+        :param columns: restrict the result to these columns
+        :param criteria:
+        :return:
+        """
+        rows = None
+        indexed = sorted((col for col in criteria if col in INDEXED_COLUMNS),
+                         key=lambda col: self._estimate(col, criteria[col]))
+        for col in indexed:
+            if rows is None:
+                rows = self._lookup(col, criteria[col])
+            else:
+                codes = self._column(col)[rows]
+                rows = rows[np.isin(codes, self._codes(col, criteria[col]))]
+        if rows is None:
+            rows = np.arange(len(self))
+
+        result = self._materialize(rows, columns or self.columns)
+        for col, criterion in criteria.items():
+            if col not in INDEXED_COLUMNS:
+                result = result[_matches(result[col], criterion)]
+
+        return result.reset_index(drop=True)
+
+    def _materialize(self, rows: np.ndarray, columns: List[str]) -> pd.DataFrame:
+        rows = np.sort(rows)
+        data = {}
+        for col in columns:
+            values = self._column(col)[rows]
+            if col in self._meta['categorical']:
+                data[col] = _decode(self.categories(col), values)
+            else:
+                data[col] = values
+        return pd.DataFrame(data, columns=columns)
+
+    def _lookup(self, col: str, criterion: Any) -> np.ndarray:
+        postings, offsets = self._index(col)
+        spans = [postings[offsets[lo]:offsets[hi]] for lo, hi in self._code_ranges(col, criterion)]
+        return np.concatenate(spans) if spans else np.array([], dtype='int64')
+
+    def _estimate(self, col: str, criterion: Any) -> int:
+        _, offsets = self._index(col)
+        return sum(int(offsets[hi] - offsets[lo]) for lo, hi in self._code_ranges(col, criterion))
+
+    def _codes(self, col: str, criterion: Any) -> np.ndarray:
+        ranges = self._code_ranges(col, criterion)
+        return np.concatenate([np.arange(lo, hi) for lo, hi in ranges]) if ranges else np.array([], dtype='int64')
+
+    def _code_ranges(self, col: str, criterion: Any) -> List[tuple]:
+        categories = self.categories(col)
+        if isinstance(criterion, tuple):
+            low, high = criterion
+            lo = 0 if low is None else int(np.searchsorted(categories, low, side='left'))
+            hi = len(categories) if high is None else int(np.searchsorted(categories, high, side='right'))
+            return [(lo, hi)] if lo < hi else []
+
+        ranges = []
+        for value in (criterion if isinstance(criterion, list) else [criterion]):
+            value = value if np.issubdtype(categories.dtype, np.number) else str(value)
+            position = int(np.searchsorted(categories, value))
+            if position < len(categories) and categories[position] == value:
+                ranges.append((position, position + 1))
+        return ranges
+
+    def _column(self, col: str) -> np.ndarray:
+        if col not in self._arrays:
+            self._arrays[col] = np.load(_column_path(self.path, col), mmap_mode='r')
+        return self._arrays[col]
+
+    def _index(self, col: str):
+        key = (col, 'index')
+        if key not in self._arrays:
+            self._arrays[key] = (np.load(_column_path(self.path, col, 'postings'), mmap_mode='r'),
+                                 np.load(_column_path(self.path, col, 'offsets'), mmap_mode='r'))
+        return self._arrays[key]
+
+
+def _decode(categories: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    missing = codes == NULL_CODE
+    if not missing.any():
+        return categories[codes]
+    decoded = np.full(len(codes), None, dtype=object)
+    decoded[~missing] = categories[codes[~missing]]
+    return decoded
+
+
+def _matches(values: pd.Series, criterion: Any) -> pd.Series:
+    if isinstance(criterion, tuple):
+        low, high = criterion
+        return values.between(low if low is not None else values.min(), high if high is not None else values.max())
+    return values.isin(criterion if isinstance(criterion, list) else [criterion])
+
+
+def _column_path(path: str, col: str, suffix: Optional[str] = None) -> str:
+    return os.path.join(path, '{}.npy'.format(col if suffix is None else '{}.{}'.format(col, suffix)))
@@ -0,0 +1,34 @@
+from open_elections.tools.canonical import NameCanonicalizer, canonicalize_names
+import pandas as pd
+
+
+def test_canonicalize_names():
+    df = pd.DataFrame(dict(candidate=['Kenneth P La Valle', 'Kenneth P Lavalle', 'Errol D. Toulon, Jr.', 'John Smith'],
+                           party=['REP', 'republican', 'Dem', 'Working  Families'],
+                           office=['US House', 'U.S. House', 'State Senate', 'state senate'],
+                           county=['Suffolk County', 'Suffolk', 'SUFFOLK', 'NA']))
+    canonicalizer = NameCanonicalizer()
+    result = canonicalizer.canonicalize(df, {'candidate': {'john smith': 'John Q Smith'}})
+    assert result['candidate'].tolist() == ['Kenneth P La Valle', 'Kenneth P La Valle', 'Errol D Toulon Jr',
+                                            'John Q Smith']
+    assert result['party'].tolist() == ['REP', 'REP', 'DEM', 'Working Families']
+    assert result['office'].tolist() == ['U.S. House', 'U.S. House', 'State Senate', 'State Senate']
+    assert result['county'].tolist() == ['Suffolk', 'Suffolk', 'Suffolk', 'NA']
+
+    # Spellings seen in earlier files keep the canonical form they were first given
+    later = canonicalizer.canonicalize(pd.DataFrame(dict(candidate=['KENNETH P LAVALLE'])))
+    assert later['candidate'].tolist() == ['Kenneth P La Valle']
+
+
+def test_canonical_form_is_the_most_common_spelling():
+    candidates = ['JOHN DOE', 'John Doe', 'John  Doe', 'Jane Roe', 'JANE ROE']
+    for order in (candidates, candidates[::-1]):
+        result = NameCanonicalizer().canonicalize(pd.DataFrame(dict(candidate=order, office=['U.S House'] * 5)))
+        assert sorted(set(result['candidate'])) == ['JANE ROE', 'John Doe']
+        assert set(result['office']) == {'U.S. House'}
+
+
+def test_canonicalize_names_does_not_carry_forms_between_calls():
+    first = canonicalize_names(pd.DataFrame(dict(candidate=['JOHN DOE', 'JOHN DOE', 'John Doe'])))
+    second = canonicalize_names(pd.DataFrame(dict(candidate=['JOHN DOE', 'John Doe', 'John Doe'])))
+    assert set(first['candidate']) == {'JOHN DOE'} and set(second['candidate']) == {'John Doe'}
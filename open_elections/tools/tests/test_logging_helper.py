@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+
+def test_importing_configures_no_logging():
+    # In a fresh interpreter, as pytest has imported everything already
+    script = ('import logging, open_elections.validation.profiling\n'
+              'from open_elections.tools import logging_helper\n'
+              'assert logging_helper._listener is None and not logging.getLogger().handlers\n'
+              'logging_helper.configure_logging()\n'
+              'assert logging_helper._listener is not None\n')
+    subprocess.run([sys.executable, '-c', script], check=True)
+
+
+def test_paused_logging_keeps_records_for_after():
+    script = ('import logging, multiprocessing\n'
+              'from open_elections.tools import logging_helper\n'
+              'records = []\n'
+              'handler = logging.Handler()\n'
+              'handler.emit = lambda record: records.append(record.getMessage())\n'
+              'logging_helper.add_handler(handler)\n'
+              'logging_helper.configure_logging()\n'
+              'logger = logging_helper.get_logger("test")\n'
+              'with logging_helper.paused_logging():\n'
+              '    assert logging_helper._listener._thread is None\n'
+              '    child = multiprocessing.get_context("fork").Process(target=logger.info, args=("from child",))\n'
+              '    child.start()\n'
+              '    logger.info("while paused")\n'
+              'child.join()\n'
+              'logging_helper._stop_listener()\n'
+              'assert sorted(records) == ["from child", "while paused"], records\n')
+    subprocess.run([sys.executable, '-c', script], check=True)
@@ -0,0 +1,69 @@
+from open_elections.tools.reading import StateMetadata, PrecinctFile
+from open_elections.tools.sources import LocalDirectorySource, GitObjectSource
+from open_elections.tools.quarantine import FileWatchdog, QuarantineLedger, TIMEOUT
+from datetime import datetime
+import os
+import subprocess
+import time
+import pytest
+
+
+def _slow_reader(vote_file):
+    time.sleep(30)
+
+
+def _failing_reader(vote_file):
+    raise ValueError('bad file')
+
+
+def test_watchdog_quarantines_slow_files(tmp_path):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True)
+    path = year_dir / '20161108__pa__general__precinct.csv'
+    path.write_bytes(b'county,votes\nAdams,10\n')
+    state_metadata = StateMetadata(LocalDirectorySource(str(tmp_path / 'openelections-data-pa')), 'pa', [], ['votes'])
+    vote_file = PrecinctFile(str(path), state_metadata, 2016, datetime(2016, 11, 8), 'general', False, False)
+    ledger_path = str(tmp_path / 'quarantine.jsonl')
+
+    watchdog = FileWatchdog(QuarantineLedger(ledger_path), timeout=0.5)
+    assert watchdog.guard()(vote_file)['votes'].tolist() == [10]
+    with pytest.raises(ValueError):
+        watchdog.guard(_failing_reader)(vote_file)
+
+    start = time.monotonic()
+    assert watchdog.guard(_slow_reader)(vote_file) is None
+    assert time.monotonic() - start < 10
+
+    # Later runs skip the file, until it changes
+    ledger = QuarantineLedger(ledger_path)
+    assert ledger.get(vote_file)['reason'] == TIMEOUT
+    assert FileWatchdog(ledger).guard()(vote_file) is None
+    path.write_bytes(b'county,votes\nAdams,11\n')
+    os.utime(str(path), ns=(0, 0))
+    assert FileWatchdog(ledger).guard()(vote_file)['votes'].tolist() == [11]
+
+
+def test_watchdog_children_do_not_share_git_pipes(tmp_path):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True)
+    for county, votes in [('adams', 10), ('berks', 20)]:
+        (year_dir / '20161108__pa__general__{}__precinct.csv'.format(county)).write_bytes(
+            'county,votes\n{},{}\n'.format(county, votes).encode('utf-8')
+        )
+    for args in (['init', '-q'], ['add', '.'], ['commit', '-q', '-m', 'data']):
+        subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + args,
+                       cwd=str(tmp_path / 'openelections-data-pa'),
+                       check=True)
+    source = GitObjectSource(str(tmp_path / 'openelections-data-pa'))
+    state_metadata = StateMetadata(source, 'pa', [], ['votes'])
+    adams, berks = [PrecinctFile(os.path.join(source.root, '2016', filename), state_metadata, 2016,
+                                 datetime(2016, 11, 8), 'general', False, False)
+                    for filename in sorted(os.listdir(str(year_dir)))]
+
+    watchdog = FileWatchdog(QuarantineLedger(str(tmp_path / 'quarantine.jsonl')), timeout=10)
+    with source:
+        # The parent's cat-file process is running, and its lock held as another thread reading would hold it
+        assert adams.to_enriched_df()['votes'].tolist() == [10]
+        with source._lock:
+            assert watchdog.guard()(berks)['votes'].tolist() == [20]
+        assert adams.to_enriched_df()['votes'].tolist() == [10]
@@ -0,0 +1,306 @@
+from open_elections.tools import reading, sources
+from open_elections.tools.reading import StateMetadata, PrecinctFile, gather_files, build_file_objects, preview_files, \
+    files_to_table_data
+from open_elections.tools.sources import GitObjectSource, ZipArchiveSource, LocalDirectorySource
+from open_elections.tools.scheduling import CostModel, WorkScheduler
+from datetime import datetime
+import codecs
+import gzip
+import io
+import os
+import subprocess
+import zipfile
+import pandas as pd
+import pytest
+
+PRECINCT_CSV = b'county,precinct,office,district,party,candidate,votes\nAdams,1,President,,DEM,Jane Doe,10\n'
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True)
+    (year_dir / '20161108__pa__general__precinct.csv').write_bytes(PRECINCT_CSV)
+    with gzip.open(str(year_dir / '20161108__pa__general__adams__precinct.csv.gz'), 'wb') as f:
+        f.write(PRECINCT_CSV)
+    (tmp_path / 'openelections-data-pa' / 'README.md').write_text('not data')
+    return str(tmp_path / 'openelections-data-pa')
+
+
+@pytest.fixture
+def bare_repo(state_dir, tmp_path):
+    def git(*args, cwd=state_dir):
+        subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+                       cwd=cwd,
+                       check=True,
+                       stdout=subprocess.DEVNULL)
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'data')
+    bare = str(tmp_path / 'pa.git')
+    git('clone', '-q', '--bare', state_dir, bare, cwd=str(tmp_path))
+    return bare
+
+
+@pytest.fixture
+def zip_bundle(state_dir, tmp_path):
+    path = str(tmp_path / 'pa.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        for dirpath, _, filenames in os.walk(state_dir):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                archive.write(full_path, os.path.relpath(full_path, state_dir))
+    return path
+
+
+def _filenames(source):
+    return sorted(filename for _, _, filename in gather_files(source))
+
+
+def _precinct_file_builder(year, dirpath, filename, state_metadata, excluded):
+    return PrecinctFile(os.path.join(dirpath, filename), state_metadata, year, datetime(2016, 11, 8), 'general',
+                        False, excluded)
+
+
+def test_gather_files_is_consistent_across_sources(state_dir, bare_repo, zip_bundle):
+    expected = ['20161108__pa__general__adams__precinct.csv.gz', '20161108__pa__general__precinct.csv']
+    with GitObjectSource(bare_repo, 'HEAD') as git_source, ZipArchiveSource(zip_bundle) as zip_source:
+        assert _filenames(state_dir) == expected
+        assert _filenames(git_source) == expected
+        assert _filenames(zip_source) == expected
+
+
+@pytest.mark.parametrize('source_type', ['local', 'git', 'git-streamed', 'zip'])
+def test_vote_files_read_through_source(state_dir, bare_repo, zip_bundle, source_type, monkeypatch):
+    if source_type == 'git-streamed':
+        monkeypatch.setattr(sources, 'STREAM_BLOB_BYTES', 0)
+    source = {'local': lambda: LocalDirectorySource(state_dir),
+              'git': lambda: GitObjectSource(bare_repo, 'HEAD'),
+              'git-streamed': lambda: GitObjectSource(bare_repo, 'HEAD'),
+              'zip': lambda: ZipArchiveSource(zip_bundle)}[source_type]()
+    state_metadata = StateMetadata(source, 'pa', [], ['votes'], excluded_files=['20161108__pa__general__precinct.csv'])
+    with source:
+        vote_files = list(build_file_objects(state_metadata, _precinct_file_builder))
+        assert sorted(vote_file.excluded for vote_file in vote_files) == [False, True]
+        for vote_file in vote_files:
+            df = vote_file.to_enriched_df()
+            assert df['votes'].tolist() == [10]
+            assert df['state'].tolist() == ['PA']
+
+
+@pytest.mark.parametrize('raw,encoding,replaced_bytes', [
+    ('candidate,votes\nJosé Núñez,10\n'.encode('utf-8'), 'utf-8', 0),
+    (codecs.BOM_UTF8 + 'candidate,votes\nJosé Núñez,10\n'.encode('utf-8'), 'utf-8-sig', 0),
+    ('candidate,votes\nJosé Núñez,10\n'.encode('cp1252'), 'cp1252', 0),
+    (b'candidate,votes\nJos\x81 N\x90\x9d,10\n', 'utf-8', 3),
+])
+def test_vote_files_are_decoded_in_one_pass(tmp_path, raw, encoding, replaced_bytes):
+    path = tmp_path / '20161108__pa__general__precinct.csv'
+    path.write_bytes(raw)
+    state_metadata = StateMetadata(str(tmp_path), 'pa', [], ['votes'], excluded_files=[])
+    vote_file = _precinct_file_builder(2016, str(tmp_path), path.name, state_metadata, False)
+    df = vote_file.to_enriched_df()
+    assert df['votes'].tolist() == [10]
+    assert vote_file.encoding == encoding
+    assert vote_file.replaced_bytes == replaced_bytes
+    if not replaced_bytes:
+        assert df['candidate'].tolist() == ['José Núñez']
+
+
+def _sum_vote_columns(df):
+    return df.assign(votes=df['election_day'] + df['absentee']) if 'election_day' in df.columns else df
+
+
+@pytest.mark.parametrize('header,has_plan', [
+    ('County,Precinct ,office,district,party,candidate,vote,extra', True),
+    ('county,precinct,office,district,party,candidate,election_day,absentee', False),
+])
+def test_read_plans_match_transformers(tmp_path, header, has_plan):
+    rows = ['Adams,1,President,,DEM,Jane Doe,10,2', 'Adams,1,President,,DEM,Jane Doe,10,2', 'Adams,,Governor,,,Joe,5,1']
+    for name in ['20161108__pa__general__precinct.csv', '20161108__pa__general__adams__precinct.csv']:
+        (tmp_path / name).write_text('\n'.join([header] + rows) + '\n')
+    columns = ['county', 'precinct', 'office', 'district', 'party', 'candidate', 'votes']
+    transformers = [lambda df: df.rename(columns={'vote': 'votes'}),
+                    _sum_vote_columns,
+                    lambda df: df.assign(district=df['district'].fillna('NA'))]
+    state_metadata = StateMetadata(str(tmp_path), 'pa', columns, [], transformers, excluded_files=[], plan_reads=True)
+
+    for name in ['20161108__pa__general__precinct.csv', '20161108__pa__general__adams__precinct.csv']:
+        vote_file = _precinct_file_builder(2016, str(tmp_path), name, state_metadata, False)
+        planned = vote_file.to_enriched_df()
+        transformed = vote_file.enrich(vote_file.read_df())
+        assert (state_metadata.read_plans.get(tuple(vote_file.read_df().columns)) is not None) == has_plan
+        pd.testing.assert_frame_equal(planned[columns].reset_index(drop=True),
+                                      transformed[columns].drop_duplicates().reset_index(drop=True))
+        assert set(planned['filepath']) == {vote_file.filepath}
+    assert len(state_metadata.read_plans) == 1
+
+
+def test_read_plans_are_dropped_for_transformers_that_filter_rows(tmp_path):
+    (tmp_path / '20161108__pa__general__precinct.csv').write_text(
+        'county,precinct,candidate,votes\nAdams,1,Jane Doe,10\nAdams,1,Total,10\nAdams,2,Jane Doe,3\n'
+    )
+    columns = ['county', 'precinct', 'candidate', 'votes']
+    transformers = [lambda df: df[df['candidate'] != 'Total']]
+    state_metadata = StateMetadata(str(tmp_path), 'pa', columns, [], transformers, excluded_files=[], plan_reads=True)
+    vote_file = _precinct_file_builder(2016, str(tmp_path), '20161108__pa__general__precinct.csv', state_metadata,
+                                       False)
+    header = tuple(columns)
+    assert state_metadata.read_plans.get(header) is not None
+
+    df = vote_file.to_enriched_df()
+    assert df['candidate'].tolist() == ['Jane Doe', 'Jane Doe']
+    assert state_metadata.read_plans.get(header) is None
+    assert vote_file.to_enriched_df()['candidate'].tolist() == ['Jane Doe', 'Jane Doe']
+
+
+def _pad_precincts(df):
+    return df.assign(precinct=df['precinct'].astype(str).str.zfill(3))
+
+
+@pytest.mark.parametrize('transformer,has_plan', [
+    (lambda df: df.assign(candidate=df['candidate'].str.strip()), False),
+    (_pad_precincts, True),
+])
+def test_read_plans_are_not_used_for_transformers_that_change_values(tmp_path, transformer, has_plan):
+    (tmp_path / '20161108__pa__general__precinct.csv').write_text(
+        'county,precinct,candidate,votes\nAdams,1, Jane Doe ,10\nAdams,2,Jane Doe,3\nAdams,2,Joe,3\n'
+    )
+    columns = ['county', 'precinct', 'candidate', 'votes']
+    state_metadata = StateMetadata(str(tmp_path), 'pa', columns, [], [transformer], excluded_files=[],
+                                   plan_reads=True)
+    vote_file = _precinct_file_builder(2016, str(tmp_path), '20161108__pa__general__precinct.csv', state_metadata,
+                                       False)
+    header = tuple(columns)
+    # The probe catches stripping, zero padding only changes short values, so is caught comparing with the transformers
+    assert (state_metadata.read_plans.get(header) is not None) == has_plan
+
+    df = vote_file.to_enriched_df()
+    pd.testing.assert_frame_equal(df, vote_file.enrich(vote_file.read_df()))
+    assert state_metadata.read_plans.get(header) is None
+
+
+def test_preview_reads_a_few_rows_per_file(tmp_path):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True)
+    for county in ('adams', 'berks'):
+        rows = ''.join('{},{},{}\n'.format(county, precinct, precinct) for precinct in range(100))
+        filename = '20161108__pa__general__{}__precinct.csv'.format(county)
+        (year_dir / filename).write_text('county,precinct,votes\n' + rows)
+    state_metadata = StateMetadata(str(tmp_path / 'openelections-data-pa'), 'pa', [], ['votes'], excluded_files=[])
+    preview = preview_files(state_metadata, _precinct_file_builder)
+
+    assert len(preview) == 2
+    assert preview.head(3)['precinct'].tolist() == [0, 1, 2, 0, 1, 2]
+    assert len(preview.head(3, max_rows=2)) == 2
+    sample = preview.sample(10, seed=1)
+    assert len(sample) == 20 and sample['county'].value_counts().tolist() == [10, 10]
+    assert sample.equals(preview.sample(10, seed=1))
+    assert state_metadata.source.relpath(sample['filepath'].iloc[0]).startswith('2016/')
+
+
+def test_chunked_parsing_matches_whole_file(tmp_path):
+    # Repeats across chunk boundaries, and a cp1252 byte, so both the encoding and the duplicates are found by
+    # streaming. The footnote would have votes inferred as text in the first chunk only, and its repeats there kept,
+    # where a whole file parse has them as text throughout
+    adams = ['Adams,{},{}'.format(precinct, precinct % 3) for precinct in range(10)]
+    rows = ['Centre,1,5*'] + adams * 2 + ['Bèrks,1,1']
+    filepath = tmp_path / '2016' / '20161108__pa__general__precinct.csv'
+    filepath.parent.mkdir()
+    filepath.write_bytes('County,Precinct,Votes\n{}\n'.format('\n'.join(rows)).encode('cp1252'))
+    state_metadata = StateMetadata(str(tmp_path), 'pa', [], ['votes'], excluded_files=[])
+    vote_file = _precinct_file_builder(2016, str(filepath.parent), filepath.name, state_metadata, False)
+
+    chunks = list(vote_file.iter_enriched_dfs(chunksize=4))
+    assert len(chunks) == 6 and vote_file.encoding == 'cp1252'
+    whole = pd.read_csv(io.StringIO(vote_file.read_text().text))
+    pd.testing.assert_frame_equal(pd.concat(chunks), vote_file.enrich(whole))
+    assert len(pd.concat(chunks)) == 12
+    # Previews stream the file too, rather than reading its whole text
+    vote_file.read_text = None
+    assert vote_file.head_df(3)['precinct'].tolist() == [1, 0, 1]
+    sample = vote_file.sample_df(5, chunksize=4)
+    # Repeats among the sampled rows are dropped by enrich
+    assert 1 <= len(sample) <= 5 and sample.index.is_monotonic_increasing and vote_file.encoding == 'cp1252'
+
+
+def test_chunked_parsing_gives_transformers_the_whole_file_dtypes(tmp_path, monkeypatch):
+    monkeypatch.setattr(reading, 'CHUNKED_READ_BYTES', 100)
+    # A missing absentee count only in the last chunk, so it alone would infer floats, as the whole file does
+    rows = ['Adams,{:03d},{},{}'.format(precinct, precinct, precinct % 2) for precinct in range(10)] + ['Adams,010,1,']
+    (tmp_path / '20161108__pa__general__precinct.csv').write_text(
+        'county,precinct,election_day,absentee\n{}\n'.format('\n'.join(rows))
+    )
+    state_metadata = StateMetadata(str(tmp_path), 'pa', [], ['votes'], [_sum_vote_columns], excluded_files=[])
+    vote_file = _precinct_file_builder(2016, str(tmp_path), '20161108__pa__general__precinct.csv', state_metadata,
+                                       False)
+
+    chunks = list(vote_file.iter_enriched_dfs(chunksize=4))
+    assert len(chunks) == 3
+    whole = vote_file.enrich(vote_file.read_df())
+    pd.testing.assert_frame_equal(pd.concat(chunks), whole)
+    assert whole['votes'].tolist()[:3] == [0, 2, 2] and whole['precinct'].tolist()[:2] == [0, 1]
+    pd.testing.assert_frame_equal(vote_file.to_enriched_df(), whole)
+
+
+def test_previews_guess_the_encoding_from_the_start_of_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(reading, 'PREVIEW_ENCODING_BYTES', 64)
+    monkeypatch.setattr(reading, 'detect_encoding', None)
+    rows = ['Adams,{},{}'.format(precinct, precinct) for precinct in range(20)] + ['Bèrks,1,1']
+    (tmp_path / '20161108__pa__general__precinct.csv').write_bytes(
+        'County,Precinct,Votes\n{}\n'.format('\n'.join(rows)).encode('cp1252')
+    )
+    (tmp_path / '20161108__pa__general__adams__precinct.csv').write_bytes(b'')
+    state_metadata = StateMetadata(str(tmp_path), 'pa', [], ['votes'], excluded_files=[])
+
+    vote_file = _precinct_file_builder(2016, str(tmp_path), '20161108__pa__general__precinct.csv', state_metadata,
+                                       False)
+    # The cp1252 byte is past the bytes the encoding is guessed from, so it is replaced rather than failing the preview
+    assert vote_file.head_df(3)['precinct'].tolist() == [0, 1, 2]
+    assert vote_file.sample_df(30)['county'].iloc[-1] == 'B\ufffdrks'
+    assert vote_file.encoding is None
+
+    empty = _precinct_file_builder(2016, str(tmp_path), '20161108__pa__general__adams__precinct.csv', state_metadata,
+                                   False)
+    assert empty.head_df(3).empty and empty.sample_df(3).empty
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_table_data_is_built_per_chunk(tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(reading, 'CHUNKED_READ_BYTES', 100)
+    monkeypatch.setattr(reading, 'CHUNK_ROWS', 10)
+    year_dir = tmp_path / '2016'
+    year_dir.mkdir()
+    (year_dir / '20161108__pa__general__adams__precinct.csv').write_text(
+        'county,precinct,votes\n' + ''.join('Adams,{},{}\n'.format(precinct, precinct) for precinct in range(45))
+    )
+    (year_dir / '20161108__pa__general__precinct.csv').write_text('county,precinct,votes\nAdams,0,7\nBerks,0,1\n')
+    state_metadata = StateMetadata(str(tmp_path), 'pa', [], ['votes'], excluded_files=[])
+    built = []
+
+    def table_data_builder(raw, state_metadata):
+        built.append(len(raw))
+        return raw[['county', 'precinct', 'votes']].astype({'precinct': str})
+
+    # Workers build the table data of the files they read, in processes of their own
+    scheduler = WorkScheduler(workers, CostModel(str(tmp_path / 'costs.json'))) if workers else None
+    table_data = files_to_table_data(state_metadata, _precinct_file_builder, table_data_builder,
+                                     scheduler=scheduler, pks=['county', 'precinct'])
+    assert built == ([] if workers else [10, 10, 10, 10, 5, 2])
+    # Whichever file finishes first, the first file's row is kept of the two with the same key
+    assert len(table_data) == 46 and table_data['votes'].tolist()[-1] == 1
+    assert table_data.set_index(['county', 'precinct']).loc[('Adams', '0'), 'votes'] == 0
+
+
+def test_names_are_canonicalized_across_the_whole_state(tmp_path):
+    year_dir = tmp_path / '2016'
+    year_dir.mkdir()
+    # The file read first holds the less common spelling
+    (year_dir / '20161108__pa__general__adams__precinct.csv').write_text('county,precinct,candidate,votes\n'
+                                                                          'Adams,1,JANE DOE,1\n')
+    (year_dir / '20161108__pa__general__berks__precinct.csv').write_text('county,precinct,candidate,votes\n'
+                                                                          'Berks,1,Jane Doe,2\nBerks,2,Jane Doe,3\n')
+    state_metadata = StateMetadata(str(tmp_path), 'pa', [], ['votes'], excluded_files=[], canonicalize_names=True)
+    table_data = files_to_table_data(state_metadata, _precinct_file_builder,
+                                     lambda raw, state_metadata: raw[['county', 'precinct', 'candidate', 'votes']])
+    assert table_data['candidate'].tolist() == ['Jane Doe'] * 3
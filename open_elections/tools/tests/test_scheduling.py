@@ -0,0 +1,40 @@
+from open_elections.tools.sources import LocalDirectorySource
+from open_elections.tools.scheduling import CostModel, WorkScheduler, PARSE_STAGE, DEFAULT_SECONDS_PER_BYTE
+import os
+import time
+
+
+def test_scheduler_runs_largest_first_and_records_costs(tmp_path):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True)
+    sizes = {'adams': 10, 'berks': 1000, 'centre': 100}
+    paths = []
+    for county, size in sizes.items():
+        path = year_dir / '20161108__pa__general__{}__precinct.csv'.format(county)
+        path.write_bytes(b'x' * size)
+        paths.append(str(path))
+    source = LocalDirectorySource(str(tmp_path / 'openelections-data-pa'))
+    cost_model_path = str(tmp_path / 'costs.json')
+    started = str(tmp_path / 'started')
+
+    def run(path):
+        # Not picklable, workers inherit it
+        with open(started, 'a') as f:
+            f.write(os.path.basename(path) + '\n')
+        time.sleep(0.2)
+        return os.path.getsize(path)
+
+    scheduler = WorkScheduler(workers=2, cost_model=CostModel(cost_model_path))
+    assert scheduler.map(PARSE_STAGE, run, paths, source, paths, 'PA') == [10, 1000, 100]
+    # The two largest start at once, the smallest waits for a worker to free up
+    with open(started) as f:
+        assert 'adams' in f.readlines()[-1]
+
+    # Timings of unchanged files replace the estimate from their size, changed files are scaled by their new size
+    cost_model = CostModel(cost_model_path)
+    key = 'pa/2016/20161108__pa__general__berks__precinct.csv'
+    recorded = cost_model.estimate(PARSE_STAGE, key, 1000, source.fingerprint(paths[1]))
+    assert 0.2 <= recorded < 5
+    assert cost_model.estimate(PARSE_STAGE, key, 2000, 'changed') == recorded * 2
+    assert cost_model.estimate('validate_2', key, 1000) == 1000 * DEFAULT_SECONDS_PER_BYTE
+    assert cost_model.estimate(PARSE_STAGE, 'pa/unknown.csv') is None
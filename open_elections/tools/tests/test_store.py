@@ -0,0 +1,36 @@
+from datetime import datetime
+import json
+import os
+import pandas as pd
+from open_elections.tools.store import VotingDataStore, META_FILENAME
+
+
+def test_round_trip_with_missing_values(tmp_path):
+    data = pd.DataFrame(dict(state=['PA', 'PA', 'NY', 'NY'],
+                             year=[2016, 2018, 2016, 2016],
+                             date=[datetime(2016, 11, 8), datetime(2018, 11, 6), datetime(2016, 11, 8),
+                                   datetime(2016, 11, 8)],
+                             office=['President', 'Governor', 'President', 'President'],
+                             county=['Adams', None, 'Kings', 'Kings'],
+                             precinct=['001', '002', None, '004'],
+                             party=['D', None, 'R', 'D'],
+                             candidate=['Clinton', 'Wolf', 'Trump', 'Clinton'],
+                             votes=pd.Series([10, '1,000', None, 'n/a'], dtype=object)))
+    store = VotingDataStore.build(str(tmp_path), data)
+
+    result = store.query().sort_values(['state', 'year', 'candidate']).reset_index(drop=True)
+    expected = data.assign(votes=[10.0, 1000.0, None, None]).sort_values(['state', 'year', 'candidate'])
+    expected = expected.reset_index(drop=True)
+    assert result['party'].tolist() == expected['party'].tolist()
+    assert result['county'].tolist() == expected['county'].tolist()
+    assert result['precinct'].tolist() == expected['precinct'].tolist()
+    pd.testing.assert_series_equal(result['votes'], expected['votes'].astype(float))
+
+    # Missing values are in no category, so lookups never return them
+    assert store.query(county='Kings')['candidate'].tolist() == ['Clinton', 'Trump']
+    assert store.query(state='PA', year=(2017, 2020))['county'].tolist() == [None]
+    assert store.query(party='R')['candidate'].tolist() == ['Trump']
+    assert len(store.query(candidate='Nobody')) == 0
+
+    with open(os.path.join(str(tmp_path), META_FILENAME)) as f:
+        assert 'categories' not in json.load(f)
@@ -0,0 +1,210 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socketserver
+import subprocess
+import sys
+import traceback
+from typing import List, Mapping, Optional, Tuple
+from open_elections.tools.reading import gather_files
+from open_elections.tools.sources import FileSource, LocalDirectorySource, build_file_source
+from open_elections.tools.logging_helper import get_logger, configure_logging
+from open_elections.validation.daemon_client import DEFAULT_SOCKET_PATH
+from open_elections.validation.data_issues_by_state import DataFileException, STATE_SCHEMA_DEF_FILENAME, \
+    build_parser, check_file, get_schema_def, parse_years, report_result, run_checks, write_shard_results
+
+logger = get_logger(__name__)
+
+
+class ValidationCache:
+    """
+    What the validation daemon keeps between requests, so that validating a state again only costs reading the files
+    that changed:
+        - open FileSources, so a git source keeps its tree listing and cat-file process
+        - each source's file listing, which for a directory is re-walked only when the modification time of the root
+          or of a directory holding data files changes, and for a git source only when its ref moves
+        - each source's schema definitions, rebuilt when the listing or column_types.csv changes
+        - the results of checking each file, reused while the file's fingerprint and its year's schema are unchanged
+    """
+    def __init__(self):
+        self._sources = {}
+        self._listings = {}
+        self._schemas = {}
+        self._results = {}
+
+    def source(self, path: str, commit: Optional[str] = None) -> FileSource:
+        token = _source_token(path, commit)
+        key = (path, commit)
+        if key in self._sources and self._sources[key][0] == token:
+            return self._sources[key][1]
+        if key in self._sources:
+            self._sources[key][1].close()
+        logger.info('Opening {}{}'.format(path, ' at {}'.format(commit) if commit else ''))
+        # A git source is opened at the commit its ref resolved to, so it keeps reading that snapshot
+        source = build_file_source(path, token if isinstance(token, str) else commit)
+        self._sources[key] = (token, source)
+        return source
+
+    def files(self, source: FileSource) -> List[Tuple[int, str, str]]:
+        key = _cache_key(source)
+        cached = self._listings.get(key)
+        if cached is not None and cached[0] == _listing_token(source, cached[1]):
+            return cached[1]
+        files = list(gather_files(source))
+        self._listings[key] = (_listing_token(source, files), files)
+        return files
+
+    def schema_def(self, source: FileSource) -> Mapping[int, Mapping[str, type]]:
+        key = _cache_key(source)
+        self.files(source)
+        schema_file = os.path.join(source.root, STATE_SCHEMA_DEF_FILENAME)
+        token = (self._listings[key][0], source.fingerprint(schema_file) if source.exists(schema_file) else None)
+        cached = self._schemas.get(key)
+        if cached is None or cached[0] != token:
+            self._schemas[key] = (token, get_schema_def(source))
+        return self._schemas[key][1]
+
+    def check_file(self,
+                   state: str,
+                   year: int,
+                   path: str,
+                   schema_def: Mapping[str, type],
+                   source: FileSource,
+                   level: int) -> Tuple[List[DataFileException], Optional[List[str]]]:
+        # Not keyed by commit, a file's fingerprint in a git source is its blob, so results carry over between commits
+        key = (type(source).__name__, source.root, path, state, level)
+        token = (source.fingerprint(path), tuple(sorted((col, t.__name__) for col, t in schema_def.items())))
+        cached = self._results.get(key)
+        if cached is None or cached[0] != token:
+            self._results[key] = (token, check_file(state, year, path, schema_def, source, level))
+        return self._results[key][1]
+
+    def close(self):
+        for _, source in self._sources.values():
+            source.close()
+
+
+def handle_request(argv: List[str], cwd: str, cache: ValidationCache) -> dict:
+    """
+    Runs validate-state with argv as though from cwd, returning its exit code and report. The report is the lines
+    validate-state would log, along with anything argparse would print.
+    :param argv:
+    :param cwd:
+    :param cache:
+    :return:
+    """
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            parser = build_parser()
+            parser.prog = 'validate-state'
+            args = parser.parse_args(argv)
+    except SystemExit as e:
+        return dict(exit_code=e.code, output=output.getvalue(), lines=[])
+
+    try:
+        base_dir = os.path.join(cwd, args.base_dir)
+        assert os.path.exists(base_dir), 'The directory passed to --base-dir must exist'
+        source = cache.source(os.path.abspath(base_dir), args.commit)
+        exceptions = run_checks(source, args.state, parse_years(args.years), args.level, args.shard, cache)
+        if args.output:
+            write_shard_results(os.path.join(cwd, args.output), exceptions, args.shard)
+        exit_code, lines = report_result(exceptions)
+    except Exception:
+        logger.exception('Error handling request {}'.format(argv))
+        exit_code, lines = 1, [(logging.ERROR, traceback.format_exc())]
+    return dict(exit_code=exit_code, output=output.getvalue(), lines=lines)
+
+
+class ValidationRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8', errors='replace')
+        try:
+            request = json.loads(line)
+            argv, cwd = request['argv'], request['cwd']
+        except (ValueError, KeyError, TypeError) as e:
+            # Answered as argparse answers bad arguments, so the client always gets a response to report
+            logger.error('Malformed request {!r}: {}'.format(line[:200], e))
+            response = dict(exit_code=2, output='validate-state-daemon: malformed request: {}\n'.format(e), lines=[])
+        else:
+            response = handle_request(argv, cwd, self.server.cache)
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class ValidationServer(socketserver.UnixStreamServer):
+    """
+    Serves validate-state requests on a Unix socket, one at a time, from a single warm ValidationCache.
+    """
+    def __init__(self, socket_path: str, cache: ValidationCache = None):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        super().__init__(socket_path, ValidationRequestHandler)
+        os.chmod(socket_path, 0o600)
+        self.socket_path = socket_path
+        self.cache = cache or ValidationCache()
+
+    def server_close(self):
+        super().server_close()
+        self.cache.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def _cache_key(source: FileSource) -> tuple:
+    return type(source).__name__, source.root, getattr(source, 'commit', None)
+
+
+def _source_token(path: str, commit: Optional[str]):
+    # A git source is reopened when its commit, which may be a branch, resolves to something new, and an archive when
+    # it is rewritten. A directory is read live, so the same source always serves.
+    if commit is not None and not path.endswith('.zip'):
+        return subprocess.run(['git', '-C', path, 'rev-parse', '--verify', '{}^{{commit}}'.format(commit)],
+                              check=True,
+                              stdout=subprocess.PIPE).stdout.decode('ascii').strip()
+    if path.endswith('.zip'):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    return None
+
+
+def _listing_token(source: FileSource, files: List[Tuple[int, str, str]]):
+    # Adding, removing or renaming a file changes the modification time of its directory
+    if isinstance(source, LocalDirectorySource):
+        dirs = {source.root} | {os.path.join(source.root, str(year)) for year, _, _ in files}
+        dirs |= {dirpath for _, dirpath, _ in files}
+        tokens = []
+        for dirpath in sorted(dirs):
+            try:
+                tokens.append((dirpath, os.stat(dirpath).st_mtime_ns))
+            except FileNotFoundError:
+                tokens.append((dirpath, None))
+        return tuple(tokens)
+    # Other sources are snapshots, replaced by ValidationCache.source when they change
+    return id(source)
+
+
+def main():
+    configure_logging()
+    parser = argparse.ArgumentParser(description='Serve validate-state requests from validate-state-client on a Unix '
+                                                 'socket, keeping schemas, file listings and results warm')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH)
+    args = parser.parse_args()
+
+    server = ValidationServer(args.socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info('Listening on {}'.format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+from typing import List
+from open_elections.tools.logging_helper import get_logger, LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT
+
+# Report lines are logged under the same name validate-state logs them under, so the output is the same
+logger = get_logger('open_elections.validation.data_issues_by_state')
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.open_elections', 'validate.sock')
+
+
+def send_request(socket_path: str, argv: List[str], cwd: str = None) -> dict:
+    """
+    Sends the arguments of a validate-state run to the daemon listening on socket_path, returning its response. Paths
+    in argv are resolved against cwd, by default the current directory. A daemon that closes the connection without
+    answering, as one stopped mid request does, gives a failed response saying so.
+    :param socket_path:
+    :param argv:
+    :param cwd:
+    :return:
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as f:
+            f.write((json.dumps(dict(argv=argv, cwd=cwd or os.getcwd())) + '\n').encode('utf-8'))
+            f.flush()
+            line = f.readline()
+    if not line:
+        return dict(exit_code=1, output='validate-state-daemon on {} closed the connection without responding\n'.format(
+            socket_path
+        ), lines=[])
+    return json.loads(line.decode('utf-8'))
+
+
+def main():
+    """
+    validate-state-client takes the same arguments as validate-state, and gives the same report and exit code, but has
+    a running validate-state-daemon do the work. Beyond the standard library it imports only logging_helper, and it
+    logs the daemon's report lines straight to stderr rather than starting the queue listener configure_logging would.
+    """
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+    parser = argparse.ArgumentParser(description='Run validate-state through a running validate-state-daemon, '
+                                                 'any other arguments are passed to validate-state')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH)
+    args, argv = parser.parse_known_args()
+
+    response = send_request(args.socket, argv)
+    sys.stderr.write(response['output'])
+    for level, message in response['lines']:
+        logger.log(level, message)
+    sys.exit(response['exit_code'])
+
+
+if __name__ == '__main__':
+    main()
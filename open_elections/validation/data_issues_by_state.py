@@ -1,10 +1,17 @@
 from open_elections.tools.reading import gather_files
-from open_elections.tools.logging_helper import get_logger
+from open_elections.tools.sources import FileSource, as_file_source, build_file_source
+from open_elections.tools.scheduling import CostModel, WorkScheduler, DEFAULT_COST_MODEL_PATH, validate_stage
+from open_elections.tools.logging_helper import get_logger, configure_logging
 import pandas as pd
 import os
-from typing import List, Mapping, Any, Tuple, Optional
+from typing import List, Mapping, Any, Tuple, Optional, Union
 import argparse
+import io
+import json
+import logging
+import random
 import sys
+import zlib
 
 logger = get_logger(__name__)
 
@@ -21,6 +28,16 @@ BASE_SCHEMA_DEF = {
 
 STATE_SCHEMA_DEF_FILENAME = 'column_types.csv'
 
+# Level 0 reads only headers, level 1 type checks a sample of rows from each file, level 2 type checks every row
+HEADER_LEVEL = 0
+SAMPLE_LEVEL = 1
+FULL_LEVEL = 2
+LEVELS = [HEADER_LEVEL, SAMPLE_LEVEL, FULL_LEVEL]
+SAMPLE_ROWS = 1000
+
+# Shards are written as 'i/N', for the i-th of N shards counting from zero
+Shard = Tuple[int, int]
+
 
 class DataFileException(Exception):
     def __init__(self, state: str, year: int, path: str):
@@ -77,12 +94,26 @@ class ValueTypeException(DataFileException):
         )
 
 
-def validate_file(state: str, year: int, path: str, schema_def: Mapping[str, type]) -> List[DataFileException]:
-    data, exception = read_file(state, year, path)
+def validate_file(state: str,
+                  year: int,
+                  path: str,
+                  schema_def: Mapping[str, type],
+                  source: FileSource = None,
+                  level: int = FULL_LEVEL) -> List[DataFileException]:
+    data, exception = read_file(state, year, path, source, level)
     if exception is not None:
         logger.debug('File {} cannot be parsed into a DataFrame'.format(path))
         return [exception]
 
+    return validate_data(state, year, path, data, schema_def, level)
+
+
+def validate_data(state: str,
+                  year: int,
+                  path: str,
+                  data: pd.DataFrame,
+                  schema_def: Mapping[str, type],
+                  level: int = FULL_LEVEL) -> List[DataFileException]:
     exceptions = []
     columns_present = []
 
@@ -94,11 +125,16 @@ def validate_file(state: str, year: int, path: str, schema_def: Mapping[str, typ
             logger.debug('Column {} missing from file {}'.format(column_name, path))
             exceptions.append(ColumnMissingException(state, year, path, column_name))
 
+    if level == HEADER_LEVEL:
+        return exceptions
+
     for column_name in columns_present:
         logger.debug('Checking types of column {} in file {}'.format(column_name, path))
         column_type = schema_def[column_name]
         errors = check_types(data[column_name], column_type)
         if errors:
+            # Sampled rows keep their row numbers in the index
+            errors = {int(data.index[i]): v for i, v in errors.items()}
             exceptions.append(ValueTypeException(state, year, path, column_name, column_type, errors))
 
     return exceptions
@@ -116,9 +152,29 @@ def check_types(values: List[Any], column_type: type) -> Mapping[int, Any]:
     return errors
 
 
-def read_file(state: str, year: int, path: str) -> Tuple[Optional[pd.DataFrame], Optional[DataFileException]]:
+def read_file(state: str,
+              year: int,
+              path: str,
+              source: FileSource = None,
+              level: int = FULL_LEVEL) -> Tuple[Optional[pd.DataFrame], Optional[DataFileException]]:
+    """
+    Reads the file at path at the given level of validation: just the header at level 0, a sample of SAMPLE_ROWS rows
+    chosen deterministically from the path at level 1, and every row at level 2.
+    :param state:
+    :param year:
+    :param path:
+    :param source:
+    :param level:
+    :return:
+    """
     try:
-        data = pd.read_csv(path)
+        with (source or as_file_source(path)).open(path) as f:
+            if level == HEADER_LEVEL:
+                data = pd.read_csv(f, nrows=0)
+            elif level == SAMPLE_LEVEL:
+                data = read_sample(f.read(), path)
+            else:
+                data = pd.read_csv(f)
         return data, None
     # handle the additional types of exeception
     except UnicodeDecodeError as e:
@@ -127,23 +183,156 @@ def read_file(state: str, year: int, path: str) -> Tuple[Optional[pd.DataFrame],
         return None, FileFormatException(state, year, path, e)
 
 
-def run_checks(base_dir: str, state: str, years: List[int] = None):
-    schema_def = get_schema_def(base_dir)
+def read_sample(raw: bytes, path: str, sample_rows: int = SAMPLE_ROWS) -> pd.DataFrame:
+    """
+    Parses sample_rows rows of raw, chosen with a random number generator seeded from path so the same file always
+    gives the same sample. The index of the result holds each row's position in the full file.
+    :param raw:
+    :param path:
+    :param sample_rows:
+    :return:
+    """
+    # An upper bound on the number of data rows, quoted fields may contain line breaks
+    lines = raw.count(b'\n')
+    if lines <= sample_rows:
+        return pd.read_csv(io.BytesIO(raw))
+
+    sampled = sorted(random.Random(zlib.crc32(path.encode('utf-8'))).sample(range(1, lines + 1), sample_rows))
+    keep = set(sampled)
+    keep.add(0)
+    data = pd.read_csv(io.BytesIO(raw), skiprows=lambda i: i not in keep)
+    data.index = [row - 1 for row in sampled[:len(data)]]
+    return data
+
+
+def run_checks(base_dir: Union[str, FileSource],
+               state: str,
+               years: List[int] = None,
+               level: int = FULL_LEVEL,
+               shard: Shard = None,
+               cache: Any = None,
+               scheduler: WorkScheduler = None):
+    """
+    Checks the files of a state, returning the exceptions found in each keyed by path.
+    :param base_dir:
+    :param state:
+    :param years:
+    :param level:
+    :param shard:
+    :param cache: a daemon.ValidationCache to take the schema, file listing and the results for unchanged files from
+    :param scheduler: if given, and there is no cache, files are checked across its workers, largest first
+    :return:
+    """
+    assert level in LEVELS, 'level must be one of {}'.format(LEVELS)
+    source = as_file_source(base_dir)
+    schema_def = cache.schema_def(source) if cache else get_schema_def(source)
+    files = cache.files(source) if cache else None
     result = {}
-    for year, dirpath, filename in gather_files(base_dir):
-        if not years or year in years:
-            path = os.path.join(dirpath, filename)
-            result[path] = validate_file(state, year, path, schema_def[year])
+    headers = {}
+    shard_files = gather_shard_files(source, years, shard, files)
+
+    def check(year_and_path: Tuple[int, str]):
+        year, path = year_and_path
+        if cache:
+            return cache.check_file(state, year, path, schema_def[year], source, level)
+        return check_file(state, year, path, schema_def[year], source, level)
+
+    if scheduler and not cache:
+        paths = [path for _, path in shard_files]
+        checked = scheduler.map(validate_stage(level), check, shard_files, source, paths, state)
+    else:
+        checked = [check(year_and_path) for year_and_path in shard_files]
+
+    for (year, path), (result[path], columns) in zip(shard_files, checked):
+        if columns is not None:
+            headers[path] = (year, columns)
+
+    if level == HEADER_LEVEL:
+        report_column_drift(headers)
 
     return result
 
 
-def get_schema_def(base_dir: str) -> Mapping[int, Mapping[str, type]]:
-    schema_def = get_base_schema_def(base_dir)
-    state_schema_file = os.path.join(base_dir, STATE_SCHEMA_DEF_FILENAME)
+def check_file(state: str,
+               year: int,
+               path: str,
+               schema_def: Mapping[str, type],
+               source: FileSource = None,
+               level: int = FULL_LEVEL) -> Tuple[List[DataFileException], Optional[List[str]]]:
+    """
+    As validate_file, but also returns the columns of the file, or None if it could not be parsed.
+    """
+    data, exception = read_file(state, year, path, source, level)
+    if exception is not None:
+        logger.debug('File {} cannot be parsed into a DataFrame'.format(path))
+        return [exception], None
+    return validate_data(state, year, path, data, schema_def, level), list(data.columns)
+
 
-    if os.path.exists(state_schema_file):
-        df = pd.read_csv(state_schema_file)
+def parse_shard(shard: str) -> Shard:
+    try:
+        index, count = [int(part) for part in shard.split('/')]
+    except ValueError:
+        raise ValueError('Shards are given as i/N, got {}'.format(shard))
+    assert 0 <= index < count, 'Shard index must be between 0 and {}, got {}'.format(count - 1, index)
+    return index, count
+
+
+def in_shard(source: FileSource, path: str, shard: Optional[Shard]) -> bool:
+    """
+    Files are assigned to shards by a hash of their path within the state repo, so every runner agrees on the
+    assignment whatever the repo is checked out as.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(source.relpath(path).encode('utf-8')) % count == index
+
+
+def gather_shard_files(base_dir: Union[str, FileSource],
+                       years: List[int] = None,
+                       shard: Shard = None,
+                       files: List[Tuple[int, str, str]] = None) -> List[Tuple[int, str]]:
+    """
+    Returns the (year, path) of each file to check in the given years and shard.
+    :param base_dir:
+    :param years:
+    :param shard:
+    :param files: the files of base_dir as gather_files lists them, if they are already known
+    :return:
+    """
+    source = as_file_source(base_dir)
+    files = gather_files(source) if files is None else files
+    return [(year, os.path.join(dirpath, filename)) for year, dirpath, filename in files
+            if (not years or year in years) and in_shard(source, os.path.join(dirpath, filename), shard)]
+
+
+def report_column_drift(headers: Mapping[str, Tuple[int, List[str]]]):
+    """
+    Logs the files whose columns differ from the most common set of columns across all the years checked, since
+    columns that come and go between years usually mean a file was formatted by hand.
+    :param headers: the year and columns of each file, keyed by path
+    :return:
+    """
+    column_sets = pd.Series([frozenset(columns) for _, columns in headers.values()], dtype=object)
+    if column_sets.empty:
+        return
+    common_columns = column_sets.value_counts().index[0]
+    for path, (year, columns) in sorted(headers.items()):
+        if frozenset(columns) != common_columns:
+            logger.warning('Columns of {} ({}) drift from the most common columns, missing: {}, extra: {}'.format(
+                path, year, sorted(common_columns - set(columns)), sorted(set(columns) - common_columns)
+            ))
+
+
+def get_schema_def(base_dir: Union[str, FileSource]) -> Mapping[int, Mapping[str, type]]:
+    source = as_file_source(base_dir)
+    schema_def = get_base_schema_def(source)
+    state_schema_file = os.path.join(source.root, STATE_SCHEMA_DEF_FILENAME)
+
+    if source.exists(state_schema_file):
+        with source.open(state_schema_file) as f:
+            df = pd.read_csv(f)
         schema_def_cols = ['year', 'column', 'type']
         assert all(col in schema_def_cols for col in df.columns), 'schema def file must contain {}'.format(schema_def_cols)
         for record in df.to_dict('records'):
@@ -154,9 +343,11 @@ def get_schema_def(base_dir: str) -> Mapping[int, Mapping[str, type]]:
     return schema_def
 
 
-def get_base_schema_def(base_dir: str) -> dict:
+def get_base_schema_def(base_dir: Union[str, FileSource]) -> dict:
     years = set(year for year, _, _ in gather_files(base_dir))
-    return {year: BASE_SCHEMA_DEF for year in years}
+    # A copy per year, which get_schema_def overrides per state, so neither other years nor later calls, such as the
+    # daemon's for other states, see the overrides
+    return {year: dict(BASE_SCHEMA_DEF) for year in years}
 
 
 def _resolve_column_type(column_type: str):
@@ -169,34 +360,160 @@ def _resolve_column_type(column_type: str):
 
 
 def display_exceptions(exceptions: Mapping[str, List[DataFileException]]):
-    for path, exceptions in exceptions.items():
-        logger.error('Showing exceptions for file {}'.format(path))
-        for exception in exceptions:
-            logger.error(exception)
+    for level, message in format_exceptions(exceptions):
+        logger.log(level, message)
+
+
+def format_exceptions(exceptions: Mapping[str, List[DataFileException]]) -> List[Tuple[int, str]]:
+    """
+    Returns the log level and message of each line of the report display_exceptions logs.
+    """
+    lines = []
+    for path, file_exceptions in exceptions.items():
+        lines.append((logging.ERROR, 'Showing exceptions for file {}'.format(path)))
+        lines.extend((logging.ERROR, str(exception)) for exception in file_exceptions)
+    return lines
+
+
+def report_result(exceptions: Mapping[str, List[DataFileException]]) -> Tuple[int, List[Tuple[int, str]]]:
+    """
+    Returns the exit code for the result of a run of checks, along with the lines of its report.
+    """
+    lines = format_exceptions(exceptions)
+    if any(exceptions.values()):
+        return 1, lines + [(logging.ERROR, 'Exceptions found, exiting with non-zero error code')]
+    return 0, lines + [(logging.INFO, 'Data is clean, exiting')]
+
+
+def exit_with_report(exceptions: Mapping[str, List[DataFileException]]):
+    exit_code, lines = report_result(exceptions)
+    for level, message in lines:
+        logger.log(level, message)
+    sys.exit(exit_code)
+
+
+def write_shard_results(path: str, exceptions: Mapping[str, List[DataFileException]], shard: Shard = None):
+    """
+    Writes the results of checking one shard as JSON, so the shards checked on different runners can be combined by
+    merge_shard_results.
+    :param path:
+    :param exceptions: as returned by run_checks
+    :param shard:
+    :return:
+    """
+    index, count = shard or (0, 1)
+    results = dict(shard=index,
+                   shards=count,
+                   files={file_path: [exception_to_dict(exception) for exception in file_exceptions]
+                          for file_path, file_exceptions in exceptions.items()})
+    with open(path, 'w') as f:
+        json.dump(results, f, default=str)
+
+
+def merge_shard_results(paths: List[str]) -> Mapping[str, List[DataFileException]]:
+    """
+    Combines shard results written by write_shard_results into the mapping run_checks returns for a whole state,
+    checking that every shard is present. A shard may be split over several files, such as one per pytest-xdist worker.
+    :param paths:
+    :return:
+    """
+    exceptions, shards, counts = {}, set(), set()
+    for path in paths:
+        with open(path) as f:
+            results = json.load(f)
+        shards.add(results['shard'])
+        counts.add(results['shards'])
+        for file_path, file_exceptions in results['files'].items():
+            exceptions[file_path] = [exception_from_dict(exception) for exception in file_exceptions]
+
+    assert len(counts) == 1, 'Shard results are from runs with different numbers of shards: {}'.format(sorted(counts))
+    missing = sorted(set(range(counts.pop())) - shards)
+    assert not missing, 'Results missing for shards {}'.format(missing)
+    return {file_path: exceptions[file_path] for file_path in sorted(exceptions)}
+
+
+def exception_to_dict(exception: DataFileException) -> dict:
+    result = dict(type=type(exception).__name__, state=exception.state, year=exception.year, path=exception.path)
+    if isinstance(exception, FileEncodingException):
+        result.update(cause=str(exception.encoding_exception))
+    elif isinstance(exception, FileFormatException):
+        result.update(cause=str(exception.format_exception))
+    elif isinstance(exception, ColumnMissingException):
+        result.update(column_name=exception.column_name)
+    elif isinstance(exception, ValueTypeException):
+        result.update(column_name=exception.column_name,
+                      column_type=exception.column_type.__name__,
+                      values_and_line_numbers=[[line, value] for line, value in
+                                               exception.values_and_line_numbers.items()])
+    return result
 
 
-def main():
+def exception_from_dict(dic: dict) -> DataFileException:
+    args = dic['state'], dic['year'], dic['path']
+    if dic['type'] == FileEncodingException.__name__:
+        return FileEncodingException(*args, Exception(dic['cause']))
+    elif dic['type'] == FileFormatException.__name__:
+        return FileFormatException(*args, Exception(dic['cause']))
+    elif dic['type'] == ColumnMissingException.__name__:
+        return ColumnMissingException(*args, dic['column_name'])
+    elif dic['type'] == ValueTypeException.__name__:
+        column_type = {str.__name__: str, int.__name__: int}[dic['column_type']]
+        return ValueTypeException(*args, dic['column_name'], column_type, dict(dic['values_and_line_numbers']))
+    raise ValueError('Unknown exception type {}'.format(dic['type']))
+
+
+def merge_main():
+    configure_logging()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('results', nargs='+', help='Shard results written by validate-state --output')
+    args = parser.parse_args()
+
+    exceptions = merge_shard_results(args.results)
+    exit_with_report(exceptions)
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument('--years', type=str)
     parser.add_argument('--state', type=str, required=True)
     parser.add_argument('--base-dir', type=str, required=True)
-    args = parser.parse_args()
-
+    parser.add_argument('--commit', type=str, help='Read files from the git repo at --base-dir at this commit')
+    parser.add_argument('--level', type=int, choices=LEVELS, default=FULL_LEVEL,
+                        help='0 checks headers only, 1 type checks a sample of rows per file, 2 checks every row')
+    parser.add_argument('--shard', type=parse_shard, help='Only check the files in shard i of N, given as i/N')
+    parser.add_argument('--output', type=str, help='Write results to this file for validate-state-merge')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Check files in this many processes, those expected to take longest first')
+    parser.add_argument('--cost-model', type=str,
+                        help='Where the time taken on each file is recorded, to estimate the next run, by default '
+                             '{} when checking with more than one worker'.format(DEFAULT_COST_MODEL_PATH))
+    return parser
+
+
+def parse_years(years: Optional[str]) -> Optional[List[int]]:
+    if not years:
+        return None
     try:
-        years = [int(year) for year in args.years.split(',')]
+        return [int(year) for year in years.split(',')]
     except ValueError as e:
         logger.error('--years expects a commma separated list of integer values')
         raise e
 
+
+def main():
+    configure_logging()
+    args = build_parser().parse_args()
+    years = parse_years(args.years)
+
     assert os.path.exists(args.base_dir), 'The directory passed to --base-dir must exist'
-    exceptions = run_checks(args.base_dir, args.state, years)
-    display_exceptions(exceptions)
-    if exceptions:
-        logger.error('Exceptions found, exiting with non-zero error code')
-        sys.exit(1)
-    else:
-        logger.info('Data is clean, exiting')
-        sys.exit(0)
+    with build_file_source(args.base_dir, args.commit) as source:
+        scheduler = None
+        if args.workers > 1 or args.cost_model:
+            scheduler = WorkScheduler(args.workers, CostModel(args.cost_model or DEFAULT_COST_MODEL_PATH))
+        exceptions = run_checks(source, args.state, years, args.level, args.shard, scheduler=scheduler)
+    if args.output:
+        write_shard_results(args.output, exceptions, args.shard)
+    exit_with_report(exceptions)
 
 
 if __name__ == '__main__':
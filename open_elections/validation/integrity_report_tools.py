@@ -1,5 +1,7 @@
-from open_elections.tools.reading import StateMetadata, VoteFile, VoteFileBuilder, build_file_objects
+from open_elections.tools.reading import StateMetadata, VoteFile, VoteFileBuilder, TableDataBuilder, TableData, \
+    build_file_objects, as_table_df
 from open_elections.tools.logging_helper import get_logger
+from open_elections.validation.report_writer import IntegrityReportWriter, read_report_index
 from typing import List, Tuple, Optional, Any, Union, Callable, Iterable
 import pandas as pd
 
@@ -29,33 +31,37 @@ class VoteFileIntegrityReport:
         """
         df, file_parse_exception = self.parse_file()
         if df is not None:
-            enriched_df = self.vote_file.to_enriched_df()
-            return None, self._check_helper(enriched_df.to_dict('records'))
+            enriched_df = self.vote_file.enrich(df)
+            return None, self._check_helper(enriched_df)
 
         return dict(filepath=self.vote_file.filepath, exception=str(file_parse_exception)), None
 
-    def check_post_cleaning(self,
-                            table_data_builder: Callable[[pd.DataFrame, StateMetadata], List[dict]]) -> pd.DataFrame:
+    def check_post_cleaning(self, table_data_builder: TableDataBuilder) -> pd.DataFrame:
         enriched_df = self.vote_file.to_enriched_df()
         if enriched_df.empty:
             return pd.DataFrame()
         return self._check_helper(table_data_builder(enriched_df, self.vote_file.state_metadata))
 
-    def _check_helper(self, data: List[dict]):
+    def _check_helper(self, data: TableData):
+        data = as_table_df(data)
         results = []
         missing_cols = set()
-        for i, dic in enumerate(data):
-            for col in self.vote_file.state_metadata.vote_columns:
-                if col in dic and not self.is_numeric(dic[col]):
-                    results.append(dict(line_number=i+1,
-                                        column_name=col,
-                                        present=True,
-                                        type_check=False,
-                                        value=dic[col] if col in dic else None))
-                elif col not in dic:
+        for col in self.vote_file.state_metadata.vote_columns:
+            if col not in data.columns:
+                if not data.empty:
                     missing_cols.add(col)
-                else:
-                    pass
+                continue
+
+            # Vote columns have few distinct values, so check each of those once
+            distinct = pd.unique(data[col])
+            numeric = pd.Series([self.is_numeric(value) for value in distinct], index=distinct, dtype=bool)
+            invalid = ~data[col].map(numeric).astype(bool).values
+            for i, value in zip(invalid.nonzero()[0], data[col].values[invalid]):
+                results.append(dict(line_number=int(i)+1,
+                                    column_name=col,
+                                    present=True,
+                                    type_check=False,
+                                    value=value))
 
         for col in missing_cols:
             results.append(dict(line_number=-1,
@@ -91,38 +97,76 @@ class VoteFileIntegrityReport:
 
     def parse_file(self) -> Tuple[Optional[pd.DataFrame], Optional[Exception]]:
         try:
-            df = pd.read_csv(self.vote_file.filepath)
-            return df, None
+            return self.vote_file.read_df(), None
         except Exception as e:
             return None, e
 
 
 def check_pre_clean(state_or_states: Union[StateMetadata, List[StateMetadata]],
                     vote_file_builder: VoteFileBuilder,) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
-    if type(state_or_states) == list:
-        states = state_or_states
-    else:
-        states = [state_or_states]
-
-    vote_file_reports = build_vote_file_reports(states, vote_file_builder)
-    reports = [vote_file_report.check_pre_cleaning() for vote_file_report in vote_file_reports]
-    file_parse_reports = [file_parse_report for file_parse_report, _ in reports if file_parse_report]
-    pre_clean_reports = [pre_clean_report for _, pre_clean_report in reports if pre_clean_report is not None]
+    reports = list(iter_pre_clean(_as_list(state_or_states), vote_file_builder))
+    file_parse_reports = [file_parse_report for _, file_parse_report, _ in reports if file_parse_report]
+    pre_clean_reports = [pre_clean_report for _, _, pre_clean_report in reports if pre_clean_report is not None]
     return pd.DataFrame(file_parse_reports), pd.concat(pre_clean_reports)
 
 
 def check_post_clean(state_or_states: Union[StateMetadata, List[StateMetadata]],
                      vote_file_builder: VoteFileBuilder,
-                     table_data_builder: Callable[[pd.DataFrame], List[dict]]) -> pd.DataFrame:
-    if type(state_or_states) == list:
-        states = state_or_states
-    else:
-        states = [state_or_states]
-
-    vote_file_reports = build_vote_file_reports(states, vote_file_builder)
-    reports = [vote_file_report.check_post_cleaning(table_data_builder) for vote_file_report in vote_file_reports
-               if not vote_file_report.vote_file.excluded]
-    return pd.concat(reports)
+                     table_data_builder: TableDataBuilder) -> pd.DataFrame:
+    reports = iter_post_clean(_as_list(state_or_states), vote_file_builder, table_data_builder)
+    return pd.concat([report for _, report in reports])
+
+
+def write_pre_clean_report(state_or_states: Union[StateMetadata, List[StateMetadata]],
+                           vote_file_builder: VoteFileBuilder,
+                           writer: IntegrityReportWriter) -> pd.DataFrame:
+    """
+    As check_pre_clean, but streams each file's findings to writer as it is checked, and returns the summary index.
+    """
+    with writer:
+        for vote_file, file_parse_report, pre_clean_report in iter_pre_clean(_as_list(state_or_states),
+                                                                             vote_file_builder):
+            writer.write(vote_file.state_metadata.state,
+                         vote_file.filepath,
+                         pre_clean_report,
+                         file_parse_report['exception'] if file_parse_report else None)
+    return read_report_index(writer.path)
+
+
+def write_post_clean_report(state_or_states: Union[StateMetadata, List[StateMetadata]],
+                            vote_file_builder: VoteFileBuilder,
+                            table_data_builder: TableDataBuilder,
+                            writer: IntegrityReportWriter) -> pd.DataFrame:
+    """
+    As check_post_clean, but streams each file's findings to writer as it is checked, and returns the summary index.
+    """
+    with writer:
+        for vote_file, post_clean_report in iter_post_clean(_as_list(state_or_states),
+                                                            vote_file_builder,
+                                                            table_data_builder):
+            writer.write(vote_file.state_metadata.state, vote_file.filepath, post_clean_report)
+    return read_report_index(writer.path)
+
+
+def iter_pre_clean(states: List[StateMetadata],
+                   vote_file_builder: VoteFileBuilder) -> Iterable[Tuple[VoteFile,
+                                                                         Optional[dict],
+                                                                         Optional[pd.DataFrame]]]:
+    for vote_file_report in build_vote_file_reports(states, vote_file_builder):
+        file_parse_report, pre_clean_report = vote_file_report.check_pre_cleaning()
+        yield vote_file_report.vote_file, file_parse_report, pre_clean_report
+
+
+def iter_post_clean(states: List[StateMetadata],
+                    vote_file_builder: VoteFileBuilder,
+                    table_data_builder: TableDataBuilder) -> Iterable[Tuple[VoteFile, pd.DataFrame]]:
+    for vote_file_report in build_vote_file_reports(states, vote_file_builder):
+        if not vote_file_report.vote_file.excluded:
+            yield vote_file_report.vote_file, vote_file_report.check_post_cleaning(table_data_builder)
+
+
+def _as_list(state_or_states: Union[StateMetadata, List[StateMetadata]]) -> List[StateMetadata]:
+    return state_or_states if type(state_or_states) == list else [state_or_states]
 
 
 def build_vote_file_reports(states: List[StateMetadata],
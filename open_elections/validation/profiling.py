@@ -0,0 +1,315 @@
+from open_elections.tools.reading import StateMetadata, VoteFileBuilder, build_file_objects, get_coerce_to_integer, \
+    apply_row_cleaners
+from open_elections.tools.config import STATES, BASE_DIR
+from open_elections.tools.logging_helper import get_logger, configure_logging, paused_logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Mapping, Callable, Any, Iterable, Tuple
+import argparse
+import functools
+import hashlib
+import os
+import re
+import pandas as pd
+
+logger = get_logger(__name__)
+
+StateMetadataBuilder = Callable[[str], StateMetadata]
+
+TEXT_PK_COLUMNS = ['county', 'office', 'party', 'candidate']
+PK_COLUMNS = TEXT_PK_COLUMNS + ['precinct', 'district']
+# Strings people use for a missing value, other than the 'NA' we fill missing primary key values with
+NULL_LIKE_VALUES = ['', 'nan', 'null', 'none', 'n/a', '-', '--', '?']
+
+NON_NUMERIC = 'non_numeric'
+DECORATED_NUMBER = 'decorated_number'
+NULL_LIKE = 'null_like'
+WHITESPACE = 'whitespace'
+NUMERIC_TEXT = 'numeric_text'
+
+# Vote counts with footnote marks and the like around them, which we can clean rather than throw away
+DECORATED_NUMBER_PATTERN = re.compile(r'^\s*([^\w\s,.]*)\s*\d[\d,]*\s*([^\w\s,.]*)\s*$')
+# Files in which at least this fraction of vote values are not numbers are suggested for exclusion
+EXCLUSION_THRESHOLD = 0.5
+
+PROFILE_COLUMNS = ['state', 'column', 'issue', 'value', 'count', 'example_file']
+
+
+class ValueCounter:
+    """
+    Counts values by a 64 bit hash of their string form, keeping the value itself and the first file it was seen in
+    for the report. Memory grows with the number of distinct values, never with the number of rows.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.values = {}
+        self.files = {}
+
+    def add(self, value_counts: pd.Series, filepath: str):
+        for value, count in value_counts.items():
+            key = _hash_value(value)
+            if key in self.counts:
+                self.counts[key] += int(count)
+            else:
+                self.counts[key] = int(count)
+                self.values[key] = value
+                self.files[key] = filepath
+
+    def most_common(self) -> List[Tuple[Any, int, str]]:
+        keys = sorted(self.counts, key=lambda key: (-self.counts[key], str(self.values[key])))
+        return [(self.values[key], self.counts[key], self.files[key]) for key in keys]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class StateProfile:
+    """
+    The dirty values found in one state's files, keyed by (column, issue), along with the files that could not be
+    read or whose vote values are mostly not numbers.
+    """
+    def __init__(self, state: str):
+        self.state = state
+        self.files = 0
+        self.rows = 0
+        self.counters = {}
+        self.suggested_exclusions = {}
+
+    def counter(self, column: str, issue: str) -> ValueCounter:
+        return self.counters.setdefault((column, issue), ValueCounter())
+
+    def to_df(self) -> pd.DataFrame:
+        records = [dict(state=self.state, column=column, issue=issue, value=value, count=count, example_file=filepath)
+                   for (column, issue), counter in sorted(self.counters.items())
+                   for value, count, filepath in counter.most_common()]
+        return pd.DataFrame(records, columns=PROFILE_COLUMNS)
+
+
+def profile_corpus(states: List[str],
+                   state_metadata_builder: StateMetadataBuilder,
+                   vote_file_builder: VoteFileBuilder,
+                   workers: int = 4) -> Mapping[str, StateProfile]:
+    """
+    Profiles the dirty values in every state in one parallel pass, one state per worker process at a time. Workers
+    build their own StateMetadata, so state_metadata_builder and vote_file_builder must be module level functions.
+    :param states:
+    :param state_metadata_builder:
+    :param vote_file_builder:
+    :param workers:
+    :return:
+    """
+    logger.info('Profiling {} states with {} workers'.format(len(states), workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure_logging) as executor:
+        # Submitting forks the workers
+        with paused_logging():
+            profiles = executor.map(_profile_state, states, [state_metadata_builder] * len(states),
+                                    [vote_file_builder] * len(states))
+        return {profile.state: profile for profile in profiles}
+
+
+def _profile_state(state: str,
+                   state_metadata_builder: StateMetadataBuilder,
+                   vote_file_builder: VoteFileBuilder) -> StateProfile:
+    return profile_state(state_metadata_builder(state), vote_file_builder)
+
+
+def profile_state(state_metadata: StateMetadata, vote_file_builder: VoteFileBuilder) -> StateProfile:
+    """
+    Reads each of a state's files through its transformers and row cleaners, one at a time, as the loader does, and
+    counts the values in vote columns the state's row cleaners leave that would fail to coerce to an integer, and the
+    suspicious values in primary key columns.
+    :param state_metadata:
+    :param vote_file_builder:
+    :return:
+    """
+    profile = StateProfile(state_metadata.state)
+    for vote_file in build_file_objects(state_metadata, vote_file_builder):
+        if vote_file.excluded:
+            continue
+        profile.files += 1
+        try:
+            df = vote_file.to_enriched_df()
+        except Exception as e:
+            logger.warning('Failed to read {}: {}'.format(vote_file.filepath, e))
+            profile.suggested_exclusions[vote_file.filepath] = 'failed to read: {}'.format(e)
+            continue
+        if df.empty:
+            profile.suggested_exclusions[vote_file.filepath] = 'no rows parsed'
+            continue
+
+        df = apply_row_cleaners(df, state_metadata.row_cleaners, state_metadata.vote_columns)
+        profile.rows += len(df)
+        for col in state_metadata.vote_columns:
+            if col in df.columns:
+                _profile_vote_column(profile, col, df[col], vote_file.filepath)
+        for col in PK_COLUMNS:
+            if col in df.columns:
+                _profile_pk_column(profile, col, df[col], vote_file.filepath)
+
+    logger.info('Profiled {} rows in {} files for state {}, {} distinct dirty values'.format(
+        profile.rows, profile.files, profile.state, sum(len(counter) for counter in profile.counters.values())
+    ))
+    return profile
+
+
+def _profile_vote_column(profile: StateProfile, col: str, values: pd.Series, filepath: str):
+    value_counts = values[values.map(type) == str].value_counts()
+    coerce = get_coerce_to_integer()
+    invalid = [value for value in value_counts.index if not _is_coercible(coerce, value)]
+    if not invalid:
+        return
+
+    decorated = [value for value in invalid if DECORATED_NUMBER_PATTERN.match(value)]
+    non_numeric = [value for value in invalid if value not in decorated]
+    profile.counter(col, DECORATED_NUMBER).add(value_counts[decorated], filepath)
+    profile.counter(col, NON_NUMERIC).add(value_counts[non_numeric], filepath)
+
+    invalid_fraction = value_counts[non_numeric].sum() / len(values)
+    if invalid_fraction >= EXCLUSION_THRESHOLD:
+        profile.suggested_exclusions[filepath] = '{:.0%} of {} values are not numbers'.format(invalid_fraction, col)
+
+
+def _profile_pk_column(profile: StateProfile, col: str, values: pd.Series, filepath: str):
+    value_counts = values[values.map(type) == str].value_counts()
+    if value_counts.empty:
+        return
+
+    strings = pd.Series(value_counts.index, index=value_counts.index)
+    stripped = strings.str.strip()
+    null_like = stripped.str.lower().isin(NULL_LIKE_VALUES)
+    profile.counter(col, NULL_LIKE).add(value_counts[null_like], filepath)
+    whitespace = ~null_like & ((strings != stripped) | strings.str.contains('  ', regex=False))
+    profile.counter(col, WHITESPACE).add(value_counts[whitespace], filepath)
+    if col in TEXT_PK_COLUMNS:
+        numeric = ~null_like & stripped.str.fullmatch(r'[\d,.]+')
+        profile.counter(col, NUMERIC_TEXT).add(value_counts[numeric], filepath)
+
+
+def suggest_state_data_format(profile: StateProfile, base_dir: str = None) -> str:
+    """
+    Renders the profile as the source of a state module in the style of open_elections/dolt/states, listing the
+    values to null out and the characters to strip from vote counts, and the files to exclude, for review before it
+    is merged into the state's StateDataFormat.
+    :param profile:
+    :param base_dir: if given, suggested exclusions are shown relative to it
+    :return:
+    """
+    lines = ['from open_elections.tools import StateDataFormat', '', '']
+    row_cleaners = []
+
+    invalid_votes = _counter_values(profile, 'votes', NON_NUMERIC)
+    if invalid_votes:
+        lines.append('INVALID_VOTE_VALUES = [')
+        lines.extend('    {!r},'.format(value) for value in invalid_votes)
+        lines.extend([']', '', ''])
+
+    strip_chars = sorted(set(''.join(re.sub(r'[\w\s,.]', '', value)
+                                     for value in _counter_values(profile, 'votes', DECORATED_NUMBER))))
+    if strip_chars:
+        lines.extend(['VOTE_STRIP_CHARS = {!r}'.format(''.join(strip_chars)), '', ''])
+
+    if invalid_votes or strip_chars:
+        lines.append('def clean_vote_counts(dic: dict):')
+        lines.append("    value = dic['votes']")
+        if invalid_votes:
+            lines.append('    if value in INVALID_VOTE_VALUES:')
+            lines.append("        dic['votes'] = None")
+        if strip_chars:
+            lines.append('    {} type(value) == str:'.format('elif' if invalid_votes else 'if'))
+            lines.append("        dic['votes'] = value.strip().strip(VOTE_STRIP_CHARS).strip()")
+        lines.extend(['', ''])
+        row_cleaners.append('clean_vote_counts')
+
+    null_like = {col: _counter_values(profile, col, NULL_LIKE) for col in PK_COLUMNS}
+    whitespace_cols = [col for col in PK_COLUMNS if _counter_values(profile, col, WHITESPACE)]
+    if any(null_like.values()) or whitespace_cols:
+        lines.append('def clean_pk_values(dic: dict):')
+        for col in PK_COLUMNS:
+            if null_like[col]:
+                lines.append('    if dic[{!r}] in {!r}:'.format(col, null_like[col]))
+                lines.append("        dic[{!r}] = 'NA'".format(col))
+        for col in whitespace_cols:
+            lines.append('    if type(dic[{col!r}]) == str:'.format(col=col))
+            lines.append("        dic[{col!r}] = ' '.join(dic[{col!r}].split())".format(col=col))
+        lines.extend(['', ''])
+        row_cleaners.append('clean_pk_values')
+
+    numeric_cols = [col for col in TEXT_PK_COLUMNS if _counter_values(profile, col, NUMERIC_TEXT)]
+    for col in numeric_cols:
+        numeric = _counter_values(profile, col, NUMERIC_TEXT)
+        lines.append('# Numbers found in {}, check for shifted columns: {!r}'.format(col, numeric[:20]))
+    if numeric_cols:
+        lines.append('')
+
+    lines.append('national_precinct_dataformat = StateDataFormat(')
+    if profile.suggested_exclusions:
+        lines.append('    excluded_files=[')
+        for path, reason in sorted(profile.suggested_exclusions.items(), key=lambda item: os.path.basename(item[0])):
+            shown = os.path.relpath(path, base_dir) if base_dir else path
+            lines.append('        {!r},  # {}: {}'.format(os.path.basename(path), shown, reason))
+        lines.append('    ],')
+    if row_cleaners:
+        lines.append('    row_cleaners=[{}]'.format(', '.join(row_cleaners)))
+    lines.append(')')
+    return '\n'.join(lines) + '\n'
+
+
+def profiles_to_df(profiles: Iterable[StateProfile]) -> pd.DataFrame:
+    dfs = [profile.to_df() for profile in profiles]
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=PROFILE_COLUMNS)
+
+
+def _counter_values(profile: StateProfile, col: str, issue: str) -> List[Any]:
+    counter = profile.counters.get((col, issue))
+    return [value for value, _, _ in counter.most_common()] if counter else []
+
+
+def _is_coercible(coerce: Callable[[Any], Any], value: Any) -> bool:
+    try:
+        coerce(value)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def _hash_value(value: Any) -> int:
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _build_profile_metadata(base_dir: str, state: str) -> StateMetadata:
+    # Imported here since the loading module imports the validation package
+    from open_elections.dolt.load_shared_voting_data import build_metadata_helper
+    return build_metadata_helper(state, os.path.join(base_dir, 'openelections-data-{}'.format(state)))
+
+
+def main():
+    from open_elections.dolt.load_shared_voting_data import filepath_to_precinct_file
+
+    configure_logging()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--states', type=str, help='Comma separated list of states, defaults to every state present')
+    parser.add_argument('--base-dir', type=str, default=BASE_DIR,
+                        help='Directory holding the openelections-data-* repos')
+    parser.add_argument('--output-dir', type=str, required=True)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    states = args.states.split(',') if args.states else [
+        state for state in STATES if os.path.exists(os.path.join(args.base_dir, 'openelections-data-{}'.format(state)))
+    ]
+    profiles = profile_corpus(states,
+                              functools.partial(_build_profile_metadata, args.base_dir),
+                              filepath_to_precinct_file,
+                              args.workers)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    profiles_to_df(profiles.values()).to_csv(os.path.join(args.output_dir, 'dirty_values.csv'), index=False)
+    for state, profile in profiles.items():
+        with open(os.path.join(args.output_dir, '{}.py'.format(state)), 'w') as f:
+            f.write(suggest_state_data_format(profile, args.base_dir))
+    logger.info('Wrote dirty value counts and suggested state data formats for {} states to {}'.format(
+        len(profiles), args.output_dir
+    ))
+
+
+if __name__ == '__main__':
+    main()
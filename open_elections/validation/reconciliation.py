@@ -0,0 +1,111 @@
+from open_elections.tools.reading import StateMetadata, VoteFileBuilder, build_file_objects
+from open_elections.tools.logging_helper import get_logger
+from typing import List, Union
+import pandas as pd
+
+logger = get_logger(__name__)
+
+ELECTION_KEYS = ['state', 'date', 'election', 'special']
+RECONCILIATION_KEYS = ELECTION_KEYS + ['county', 'office', 'district', 'party', 'candidate']
+# Columns we compare as free text, and so normalize for case, whitespace and float formatting before grouping
+TEXT_KEYS = ['county', 'office', 'district', 'party', 'candidate']
+
+MISMATCH = 'mismatch'
+MISSING_FROM_PRECINCTS = 'missing_from_precincts'
+MISSING_FROM_COUNTY = 'missing_from_county'
+
+
+def check_reconciliation(state_or_states: Union[StateMetadata, List[StateMetadata]],
+                         precinct_file_builder: VoteFileBuilder,
+                         county_file_builder: VoteFileBuilder,
+                         tolerance: int = 0,
+                         relative_tolerance: float = 0.0) -> pd.DataFrame:
+    """
+    Checks that precinct level results sum to the published county level totals for every election where a state has
+    both precinct and county files. Each state's files are parsed once and compared in a single vectorized pass.
+    :param state_or_states:
+    :param precinct_file_builder:
+    :param county_file_builder:
+    :param tolerance: absolute difference in votes allowed before a total is reported as a mismatch
+    :param relative_tolerance: difference allowed as a fraction of the county total
+    :return:
+    """
+    if type(state_or_states) == list:
+        states = state_or_states
+    else:
+        states = [state_or_states]
+
+    reports = []
+    for state_metadata in states:
+        logger.info('Reconciling precinct and county totals for state {}'.format(state_metadata.state))
+        precinct_data = _load_vote_files(state_metadata, precinct_file_builder)
+        county_data = _load_vote_files(state_metadata, county_file_builder)
+        reports.append(reconcile_votes(precinct_data, county_data, tolerance, relative_tolerance))
+
+    return pd.concat(reports, ignore_index=True) if reports else pd.DataFrame()
+
+
+def reconcile_votes(precinct_data: pd.DataFrame,
+                    county_data: pd.DataFrame,
+                    tolerance: int = 0,
+                    relative_tolerance: float = 0.0) -> pd.DataFrame:
+    """
+    Aggregates precinct votes by RECONCILIATION_KEYS and compares them against the county level totals. Only elections
+    present on both sides are compared. Returns one row per key where the totals disagree by more than the tolerance,
+    or where a key appears on one side only, with a status column saying which.
+    :param precinct_data:
+    :param county_data:
+    :param tolerance:
+    :param relative_tolerance:
+    :return:
+    """
+    precinct_totals = _aggregate_votes(precinct_data).rename(columns={'votes': 'precinct_votes'})
+    county_totals = _aggregate_votes(county_data).rename(columns={'votes': 'county_votes'})
+
+    precinct_elections = precinct_totals[ELECTION_KEYS].drop_duplicates()
+    common_elections = precinct_elections.merge(county_totals[ELECTION_KEYS].drop_duplicates(), on=ELECTION_KEYS)
+    precinct_totals = precinct_totals.merge(common_elections, on=ELECTION_KEYS)
+    county_totals = county_totals.merge(common_elections, on=ELECTION_KEYS)
+
+    merged = precinct_totals.merge(county_totals, on=RECONCILIATION_KEYS, how='outer', indicator=True)
+    difference = merged['precinct_votes'].fillna(0) - merged['county_votes'].fillna(0)
+    allowed = (merged['county_votes'].fillna(0).abs() * relative_tolerance).clip(lower=tolerance)
+    status = pd.Series(MISMATCH, index=merged.index)
+    status[merged['_merge'] == 'left_only'] = MISSING_FROM_COUNTY
+    status[merged['_merge'] == 'right_only'] = MISSING_FROM_PRECINCTS
+
+    report = merged.drop(columns='_merge').assign(difference=difference, status=status)
+    flagged = (merged['_merge'] != 'both') | (difference.abs() > allowed)
+    logger.info('Compared {} totals across {} elections, {} flagged'.format(len(merged),
+                                                                             len(common_elections),
+                                                                             int(flagged.sum())))
+    return report[flagged].reset_index(drop=True)
+
+
+def _load_vote_files(state_metadata: StateMetadata, vote_file_builder: VoteFileBuilder) -> pd.DataFrame:
+    dfs = [vote_file.to_enriched_df() for vote_file in build_file_objects(state_metadata, vote_file_builder)
+           if not vote_file.excluded]
+    dfs = [df for df in dfs if not df.empty]
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=RECONCILIATION_KEYS + ['votes'])
+
+
+def _aggregate_votes(data: pd.DataFrame) -> pd.DataFrame:
+    if 'votes' not in data.columns:
+        logger.warning('No votes column present, nothing to reconcile')
+        return pd.DataFrame(columns=RECONCILIATION_KEYS + ['votes'])
+
+    normalized = {}
+    for col in TEXT_KEYS:
+        values = data[col].fillna('na').astype(str) if col in data.columns else pd.Series('na', index=data.index)
+        normalized[col] = (values.str.strip()
+                           .str.casefold()
+                           .str.replace(r'\s+', ' ', regex=True)
+                           .str.replace(r'^(\d+)\.0+$', r'\1', regex=True)
+                           .replace({'nan': 'na', 'none': 'na', '': 'na'}))
+    votes = pd.to_numeric(data['votes'].astype(str).str.replace(',', '', regex=False), errors='coerce')
+
+    return (data[ELECTION_KEYS]
+            .assign(votes=votes, **normalized)
+            .groupby(RECONCILIATION_KEYS, sort=False, dropna=False)['votes']
+            .sum(min_count=1)
+            .reset_index())
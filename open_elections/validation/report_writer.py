@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import pandas as pd
+from typing import Optional
+from open_elections.tools.logging_helper import get_logger
+
+logger = get_logger(__name__)
+
+REPORT_COLUMNS = ['state', 'filename', 'line_number', 'column_name', 'present', 'type_check', 'value', 'exception']
+# Findings buffered in memory before they are flushed to the report
+DEFAULT_ROW_GROUP_SIZE = 50000
+
+JSONL_FORMAT = 'jsonl'
+PARQUET_FORMAT = 'parquet'
+
+
+class IntegrityReportWriter:
+    """
+    Streams integrity report findings to disk as they are produced, rather than collecting every state's findings in
+    memory and writing them out at the end. Findings are buffered up to row_group_size rows and then flushed, so memory
+    stays bounded however large the corpus is.
+
+    Reports whose path ends in .parquet are written as a directory of Parquet files, one per flushed row group, which
+    pandas reads back as a single DataFrame. Any other path is written as JSON lines. Either way, everything flushed
+    before a crash can be read back.
+
+    Alongside the report, path.index.jsonl records one line per file with its counts of findings. Each file's line is
+    written only once all its findings have been flushed, so the index never counts findings the report does not hold,
+    and it can be read with read_report_index without loading the report itself.
+    """
+    def __init__(self, path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        self.path = path
+        self.index_path = report_index_path(path)
+        self.format = PARQUET_FORMAT if path.endswith('.parquet') else JSONL_FORMAT
+        self.row_group_size = row_group_size
+        self._buffer = []
+        self._buffered_rows = 0
+        self._pending_index = []
+        self._row_groups = 0
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        if self.format == PARQUET_FORMAT:
+            os.makedirs(path)
+        else:
+            open(path, 'w').close()
+        open(self.index_path, 'w').close()
+
+    def write(self, state: str, filename: str, findings: pd.DataFrame = None, exception: Optional[str] = None):
+        """
+        Adds one file's findings to the report. A file that could not be parsed is recorded by its exception.
+        :param state:
+        :param filename:
+        :param findings: DataFrame as returned by VoteFileIntegrityReport._check_helper
+        :param exception:
+        :return:
+        """
+        if findings is not None and not findings.empty:
+            rows = findings.reindex(columns=REPORT_COLUMNS).assign(state=state, filename=filename)
+            rows['value'] = [None if pd.isna(value) else str(value) for value in rows['value']]
+            self._buffer.append(rows)
+            self._buffered_rows += len(rows)
+        if exception is not None:
+            parse_error = dict(state=state, filename=filename, line_number=-1, exception=exception)
+            self._buffer.append(pd.DataFrame([parse_error], columns=REPORT_COLUMNS))
+            self._buffered_rows += 1
+
+        present = findings['present'] if findings is not None and not findings.empty else pd.Series(dtype=bool)
+        self._pending_index.append(dict(state=state,
+                                        filename=filename,
+                                        invalid_values=int(present.sum()),
+                                        missing_columns=int((~present.astype(bool)).sum()),
+                                        parse_error=exception))
+        if self._buffered_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            rows = pd.concat(self._buffer, ignore_index=True)
+            if self.format == PARQUET_FORMAT:
+                self._write_parquet(rows)
+            else:
+                self._append_lines(self.path, rows.astype(object).where(rows.notna(), None).to_dict('records'))
+            logger.debug('Flushed %d findings to %s', len(rows), self.path)
+        self._append_lines(self.index_path, self._pending_index)
+        self._buffer, self._buffered_rows, self._pending_index = [], 0, []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_parquet(self, rows: pd.DataFrame):
+        # Each row group is a complete file, so one torn by a crash loses only that group
+        part_path = os.path.join(self.path, 'part-{:05d}.parquet'.format(self._row_groups))
+        tmp_path = part_path + '.tmp'
+        rows.astype({'line_number': 'int64', 'present': 'boolean', 'type_check': 'boolean'}).to_parquet(
+            tmp_path, engine='pyarrow', index=False
+        )
+        os.replace(tmp_path, part_path)
+        self._row_groups += 1
+
+    @staticmethod
+    def _append_lines(path: str, records: list):
+        if not records:
+            return
+        with open(path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, default=_json_default) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def report_index_path(path: str) -> str:
+    return path.rstrip(os.sep) + '.index.jsonl'
+
+
+def read_report(path: str) -> pd.DataFrame:
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, engine='pyarrow')
+    return pd.read_json(path, lines=True) if os.path.getsize(path) else pd.DataFrame(columns=REPORT_COLUMNS)
+
+
+def read_report_index(path: str) -> pd.DataFrame:
+    """
+    Reads the per file counts of findings for the report at path, without reading the report.
+    """
+    with open(report_index_path(path)) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()],
+                            columns=['state', 'filename', 'invalid_values', 'missing_columns', 'parse_error'])
+
+
+def _json_default(value):
+    # numpy scalars, which json cannot serialize itself
+    return value.item() if hasattr(value, 'item') else str(value)
@@ -1,10 +1,29 @@
+import os
 import pytest
+from open_elections.validation.data_issues_by_state import LEVELS, FULL_LEVEL, parse_shard, gather_shard_files, \
+    get_schema_def, write_shard_results
 
 
 def pytest_addoption(parser):
     parser.addoption('--years', type=str)
-    parser.addoption('--state', type=str, required=True)
-    parser.addoption('--base-dir', type=str, required=True)
+    # Only the data corruption checks need a state's data, the unit tests alongside them run without it
+    parser.addoption('--state', type=str)
+    parser.addoption('--base-dir', type=str)
+    parser.addoption('--level', type=int, choices=LEVELS, default=FULL_LEVEL)
+    parser.addoption('--shard', type=parse_shard, help='Only check the files in shard i of N, given as i/N')
+    parser.addoption('--shard-output', type=str, help='Write this shard\'s results here for validate-state-merge')
+
+
+def pytest_generate_tests(metafunc):
+    config = metafunc.config
+    if not config.getoption('base_dir'):
+        _parameterize_helper(metafunc, 'data_file', [pytest.param(None, marks=pytest.mark.skip(
+            reason='--state and --base-dir give the data to check'
+        ))])
+        return
+    years = _parse_years(config.getoption('years'))
+    files = gather_shard_files(config.getoption('base_dir'), years, config.getoption('shard'))
+    _parameterize_helper(metafunc, 'data_file', files, ids=[os.path.basename(path) for _, path in files])
 
 
 @pytest.fixture
@@ -17,11 +36,41 @@ def state(request):
     return request.config.getoption('state')
 
 
+@pytest.fixture
+def level(request):
+    return request.config.getoption('level')
+
+
 @pytest.fixture
 def years(request):
-    return [int(year) for year in request.config.getoption('years').split(',')]
+    return _parse_years(request.config.getoption('years'))
+
+
+@pytest.fixture(scope='session')
+def schema_def(request):
+    return get_schema_def(request.config.getoption('base_dir'))
+
+
+@pytest.fixture(scope='session')
+def shard_results(request):
+    """
+    Collects the exceptions found for each file, and writes them out at the end of the session if --shard-output was
+    given. Under pytest-xdist each worker writes its own file, suffixed with the worker id.
+    """
+    results = {}
+    yield results
+    output = request.config.getoption('shard_output')
+    if output:
+        worker = os.environ.get('PYTEST_XDIST_WORKER')
+        write_shard_results('{}.{}'.format(output, worker) if worker else output,
+                            results,
+                            request.config.getoption('shard'))
+
+
+def _parse_years(years):
+    return [int(year) for year in years.split(',')] if years else None
 
 
-def _parameterize_helper(metafunc, param_name, param_value):
+def _parameterize_helper(metafunc, param_name, param_value, ids=None):
     if param_name in metafunc.fixturenames:
-        metafunc.parametrize(param_name, param_value)
+        metafunc.parametrize(param_name, param_value, ids=ids)
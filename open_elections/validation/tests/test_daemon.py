@@ -0,0 +1,110 @@
+import os
+import socket
+import socketserver
+import threading
+import pytest
+from open_elections.tools.sources import LocalDirectorySource
+from open_elections.validation import daemon
+from open_elections.validation.daemon import ValidationCache, ValidationServer, handle_request
+from open_elections.validation.daemon_client import send_request
+from open_elections.validation.data_issues_by_state import BASE_SCHEMA_DEF, STATE_SCHEMA_DEF_FILENAME
+
+HEADER = 'county,precinct,office,district,party,candidate,votes\n'
+ROW = 'Adams,1,President,1,DEM,Jane Doe,{}\n'
+
+
+def _state_dir(tmp_path, state, column_types=None):
+    for year in (2016, 2018):
+        year_dir = tmp_path / 'openelections-data-{}'.format(state) / str(year)
+        year_dir.mkdir(parents=True)
+        (year_dir / '{}1108__{}__general__precinct.csv'.format(year, state)).write_text(HEADER + ROW.format(10))
+    if column_types:
+        (tmp_path / 'openelections-data-{}'.format(state) / STATE_SCHEMA_DEF_FILENAME).write_text(column_types)
+    return LocalDirectorySource(str(tmp_path / 'openelections-data-{}'.format(state)))
+
+
+def test_state_schema_overrides_stay_in_their_state_and_year(tmp_path):
+    base_schema_def = dict(BASE_SCHEMA_DEF)
+    cache = ValidationCache()
+    overridden = cache.schema_def(_state_dir(tmp_path, 'pa', 'year,column,type\n2016,district,string\n'))
+    assert overridden[2016]['district'] == str and overridden[2018]['district'] == int
+
+    assert cache.schema_def(_state_dir(tmp_path, 'ny'))[2016]['district'] == int
+    assert BASE_SCHEMA_DEF == base_schema_def
+
+
+@pytest.fixture
+def checked(monkeypatch):
+    checked = []
+
+    def check_file(state, year, path, schema_def, source, level):
+        checked.append(os.path.basename(path))
+        return check_file_unwatched(state, year, path, schema_def, source, level)
+
+    check_file_unwatched = daemon.check_file
+    monkeypatch.setattr(daemon, 'check_file', check_file)
+    return checked
+
+
+def test_only_changed_files_are_checked_again(tmp_path, checked):
+    _state_dir(tmp_path, 'pa')
+    cache = ValidationCache()
+    argv = ['--state', 'pa', '--base-dir', 'openelections-data-pa']
+    response = handle_request(argv, str(tmp_path), cache)
+    assert response['exit_code'] == 0
+    assert sorted(checked) == ['20161108__pa__general__precinct.csv', '20181108__pa__general__precinct.csv']
+
+    del checked[:]
+    assert handle_request(argv, str(tmp_path), cache)['exit_code'] == 0
+    assert checked == []
+
+    year_dir = tmp_path / 'openelections-data-pa' / '2018'
+    (year_dir / '20181108__pa__general__precinct.csv').write_text(HEADER + ROW.format('X'))
+    assert handle_request(argv, str(tmp_path), cache)['exit_code'] == 1
+    assert checked == ['20181108__pa__general__precinct.csv']
+
+    # A new file changes the modification time of its directory, so the listing is walked again
+    del checked[:]
+    (year_dir / '20181106__pa__primary__precinct.csv').write_text(HEADER + ROW.format(10))
+    handle_request(argv, str(tmp_path), cache)
+    assert checked == ['20181106__pa__primary__precinct.csv']
+
+
+def test_bad_arguments_get_the_usage_error(tmp_path, checked):
+    response = handle_request(['--state', 'pa'], str(tmp_path), ValidationCache())
+    assert response['exit_code'] == 2 and '--base-dir' in response['output']
+    assert response['lines'] == [] and checked == []
+
+
+def test_malformed_requests_get_a_response(tmp_path):
+    socket_path = str(tmp_path / 'validate.sock')
+    server = ValidationServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(b'not json\n')
+            response = sock.makefile('rb').readline()
+        assert b'"exit_code": 2' in response
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_client_reports_a_daemon_that_does_not_respond(tmp_path):
+    class Hangup(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.rfile.readline()
+
+    socket_path = str(tmp_path / 'validate.sock')
+    server = socketserver.UnixStreamServer(socket_path, Hangup)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    try:
+        response = send_request(socket_path, ['--state', 'pa'])
+    finally:
+        thread.join()
+        server.server_close()
+    assert response['exit_code'] == 1 and 'without responding' in response['output']
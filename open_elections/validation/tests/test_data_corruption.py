@@ -1,7 +1,9 @@
-from open_elections.validation.data_issues_by_state import run_checks, display_exceptions
+from open_elections.validation.data_issues_by_state import validate_file, display_exceptions
 
 
-def test_state_data_corruption(base_dir, state, years):
-    exceptions = run_checks(base_dir, state, years)
-    display_exceptions(exceptions)
+def test_data_corruption(base_dir, state, data_file, schema_def, level, shard_results):
+    year, path = data_file
+    exceptions = validate_file(state, year, path, schema_def[year], level=level)
+    shard_results[path] = exceptions
+    display_exceptions({path: exceptions})
     assert not exceptions
@@ -0,0 +1,68 @@
+from open_elections.tools.reading import StateMetadata, PrecinctFile
+from open_elections.validation.profiling import ValueCounter, StateProfile, profile_state, profiles_to_df, \
+    suggest_state_data_format, NON_NUMERIC, DECORATED_NUMBER, NULL_LIKE, WHITESPACE, PROFILE_COLUMNS
+from datetime import datetime
+import os
+import pandas as pd
+
+COLUMNS = ['county', 'precinct', 'office', 'district', 'party', 'candidate', 'votes']
+PRECINCT_CSV = '\n'.join(['county,precinct,office,district,party,candidate,votes',
+                          'Adams,1,President,,DEM,Jane Doe,10',
+                          'Adams,2,President,,DEM,Jane  Doe,X',
+                          'Adams,3,President,,DEM,Jane Doe,12*',
+                          '--,4,President,,DEM,Jane Doe,-']) + '\n'
+
+
+def _precinct_file_builder(year, dirpath, filename, state_metadata, excluded):
+    return PrecinctFile(os.path.join(dirpath, filename), state_metadata, year, datetime(2016, 11, 8), 'general',
+                        False, excluded)
+
+
+def _state_metadata(tmp_path, row_cleaners=None):
+    year_dir = tmp_path / 'openelections-data-pa' / '2016'
+    year_dir.mkdir(parents=True, exist_ok=True)
+    (year_dir / '20161108__pa__general__precinct.csv').write_text(PRECINCT_CSV)
+    return StateMetadata(str(tmp_path / 'openelections-data-pa'), 'pa', COLUMNS, ['votes'], row_cleaners=row_cleaners,
+                         excluded_files=[])
+
+
+def test_value_counter():
+    counter = ValueCounter()
+    counter.add(pd.Series({'X': 2, 'Y': 1}), 'a.csv')
+    counter.add(pd.Series({'Y': 3, 'Z': 1}), 'b.csv')
+    assert counter.most_common() == [('Y', 4, 'a.csv'), ('X', 2, 'a.csv'), ('Z', 1, 'b.csv')]
+    assert len(counter) == 3
+
+
+def test_profile_state(tmp_path):
+    profile = profile_state(_state_metadata(tmp_path), _precinct_file_builder)
+    assert (profile.files, profile.rows) == (1, 4)
+    assert [value for value, _, _ in profile.counters[('votes', NON_NUMERIC)].most_common()] == ['-', 'X']
+    assert [value for value, _, _ in profile.counters[('votes', DECORATED_NUMBER)].most_common()] == ['12*']
+    assert [value for value, _, _ in profile.counters[('county', NULL_LIKE)].most_common()] == ['--']
+    assert [value for value, _, _ in profile.counters[('candidate', WHITESPACE)].most_common()] == ['Jane  Doe']
+
+    source = suggest_state_data_format(profile)
+    assert "INVALID_VOTE_VALUES = [\n    '-',\n    'X',\n]" in source
+    assert "VOTE_STRIP_CHARS = '*'" in source
+    assert 'row_cleaners=[clean_vote_counts, clean_pk_values]' in source
+    compile(source, 'suggested.py', 'exec')
+
+
+def test_values_the_state_already_cleans_are_not_reported(tmp_path):
+    def clean_votes(dic):
+        if dic['votes'] in ('X', '-'):
+            dic['votes'] = None
+
+    profile = profile_state(_state_metadata(tmp_path, [clean_votes]), _precinct_file_builder)
+    assert len(profile.counters[('votes', NON_NUMERIC)]) == 0
+    assert len(profile.counters[('votes', DECORATED_NUMBER)]) == 1
+
+
+def test_profiles_to_df():
+    assert profiles_to_df([]).columns.tolist() == PROFILE_COLUMNS
+    profile = StateProfile('pa')
+    profile.counter('votes', NON_NUMERIC).add(pd.Series({'X': 2}), 'a.csv')
+    assert profiles_to_df([profile, StateProfile('ny')]).to_dict('records') == [
+        dict(state='pa', column='votes', issue=NON_NUMERIC, value='X', count=2, example_file='a.csv')
+    ]
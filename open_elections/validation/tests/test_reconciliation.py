@@ -0,0 +1,37 @@
+import pandas as pd
+from open_elections.validation.reconciliation import reconcile_votes, MISMATCH, MISSING_FROM_COUNTY, \
+    MISSING_FROM_PRECINCTS
+
+
+def _votes(rows):
+    return pd.DataFrame([dict(state='PA', date='20161108', election='general', special=False, county=county,
+                              office='President', district='', party='DEM', candidate=candidate, votes=votes)
+                         for county, candidate, votes in rows])
+
+
+def test_tolerances():
+    precincts = _votes([('Adams', 'Clinton', '1,000'), ('Adams', 'Clinton', 5), ('Berks', 'Clinton', 100),
+                        ('Centre', ' clinton ', 50), ('Centre', 'Stein', 3)])
+    counties = _votes([('Adams', 'Clinton', 1000), ('berks', 'CLINTON', 110), ('Centre', 'Clinton', 50),
+                       ('Centre', 'Johnson', 7)])
+
+    # Names are compared normalized, so only the differing totals and the candidates on one side are reported
+    report = reconcile_votes(precincts, counties).set_index(['county', 'candidate'])
+    assert report.loc[('adams', 'clinton'), 'difference'] == 5
+    assert report.loc[('berks', 'clinton'), 'difference'] == -10
+    assert report.loc[('centre', 'stein'), 'status'] == MISSING_FROM_COUNTY
+    assert report.loc[('centre', 'johnson'), 'status'] == MISSING_FROM_PRECINCTS
+    assert len(report) == 4
+
+    # Absolute and relative tolerances each allow the larger of the two
+    assert reconcile_votes(precincts, counties, tolerance=5)['status'].tolist().count(MISMATCH) == 1
+    assert reconcile_votes(precincts, counties, relative_tolerance=0.005)['status'].tolist().count(MISMATCH) == 1
+    assert sorted(reconcile_votes(precincts, counties, tolerance=5, relative_tolerance=0.1)['status']) == [
+        MISSING_FROM_COUNTY, MISSING_FROM_PRECINCTS
+    ]
+
+
+def test_elections_on_one_side_only_are_not_compared():
+    precincts = _votes([('Adams', 'Clinton', 10)])
+    counties = _votes([('Adams', 'Clinton', 10)]).assign(election='primary')
+    assert reconcile_votes(precincts, counties).empty
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from open_elections.validation.report_writer import IntegrityReportWriter, read_report, read_report_index, \
+    report_index_path
+
+
+def _findings(values):
+    return pd.DataFrame([dict(line_number=i, column_name='votes', present=value is not None, type_check=False,
+                              value=value, exception='not an integer')
+                         for i, value in enumerate(values)])
+
+
+@pytest.fixture(params=['report.jsonl', 'report.parquet'])
+def report_path(request, tmp_path):
+    if request.param.endswith('.parquet'):
+        pytest.importorskip('pyarrow')
+    return str(tmp_path / request.param)
+
+
+def test_findings_are_flushed_with_their_index_lines(report_path):
+    writer = IntegrityReportWriter(report_path, row_group_size=3)
+    writer.write('pa', 'a.csv', _findings(['X', 'Y']))
+    # Nothing is flushed below the row group size, so neither the report nor the index holds a.csv yet
+    assert read_report_index(report_path).empty
+
+    writer.write('pa', 'b.csv', _findings(['Z', None]))
+    index = read_report_index(report_path)
+    assert index['filename'].tolist() == ['a.csv', 'b.csv']
+    assert index['invalid_values'].tolist() == [2, 1] and index['missing_columns'].tolist() == [0, 1]
+    assert len(read_report(report_path)) == 4
+
+    writer.write('pa', 'c.csv', exception='could not parse')
+    writer.write('pa', 'd.csv', _findings([]))
+    writer.close()
+    report = read_report(report_path)
+    assert report['filename'].tolist() == ['a.csv', 'a.csv', 'b.csv', 'b.csv', 'c.csv']
+    assert report['line_number'].iloc[-1] == -1
+    index = read_report_index(report_path)
+    assert index['filename'].tolist() == ['a.csv', 'b.csv', 'c.csv', 'd.csv']
+    assert index['parse_error'].iloc[2] == 'could not parse' and pd.isna(index['parse_error'].iloc[3])
+
+
+def test_an_existing_report_is_replaced(report_path):
+    with IntegrityReportWriter(report_path) as writer:
+        writer.write('pa', 'a.csv', _findings(['X']))
+    with IntegrityReportWriter(report_path):
+        pass
+    assert read_report(report_path).empty
+    assert read_report_index(report_path).empty
+    assert report_index_path(report_path + '/') == report_path + '.index.jsonl'
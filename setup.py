@@ -7,12 +7,17 @@ setup(name='open-elections',
       packages=find_packages(),
       install_requires=['pandas>=1.0.5',
                         'doltpy>=1.0.10'],
+      extras_require={'parquet': ['pyarrow']},
       tests_require=['pytest'],
       setup_requires=['wheel'],
       author='Open Elections',
       author_email='oscar@liquidata.co',
       description='A Python package for working with Open Elections data',
       entry_points={
-          'console_scripts': ['validate-state=open_elections.validation.data_issues_by_state:main']
+          'console_scripts': ['validate-state=open_elections.validation.data_issues_by_state:main',
+                              'validate-state-merge=open_elections.validation.data_issues_by_state:merge_main',
+                              'validate-state-daemon=open_elections.validation.daemon:main',
+                              'validate-state-client=open_elections.validation.daemon_client:main',
+                              'profile-states=open_elections.validation.profiling:main']
       }
   )